@@ -0,0 +1,43 @@
+$('#zynthian_midi_filter_rules_check').click(
+	function(){
+		var buttonElem = $('#zynthian_midi_filter_rules_check');
+		// 0 or empty => only check the rules
+		var events = prompt("Benchmark with how many random MIDI events? (0 = only check the rules)", "10000");
+		if (events === null) return;
+		buttonElem.prop('disabled', true);
+		$.post('/midi-filter-rules', {
+			'rules': $('textarea#ZYNTHIAN_MIDI_FILTER_RULES').val(),
+			'benchmark': parseInt(events) || 0
+		}).done(function(result){
+			if (result.error) {
+				alert(result.error);
+				return;
+			}
+			var text = "";
+			if (result.errors.length) {
+				text += "ERRORS:\n";
+				result.errors.forEach(function(e){
+					text += "line " + e.line + ": " + e.error + "\n";
+				});
+			} else {
+				text += "No errors.\n";
+			}
+			var bm = result.benchmark;
+			if (bm) {
+				text += "\nParse: " + bm.parse_us + " us, compile: " + bm.compile_ms + " ms\n";
+				text += bm.events + " random events => ignored: " + bm.ignored + ", mapped: " + bm.mapped + ", toggled: " + bm.toggled + ", passed: " + bm.passed + "\n";
+				bm.rules.forEach(function(r){
+					text += "line " + r.line + ": " + r.rule + " => " + r.hits + " hits (" + r.share + "%), parse " + r.parse_us + " us\n";
+				});
+				bm.errors.forEach(function(e){
+					text += "line " + e.line + ": not benchmarked, " + e.error + "\n";
+				});
+			}
+			alert(text);
+		}).fail(function(){
+			alert("Can't check the MIDI filter rules!");
+		}).always(function(){
+			buttonElem.prop('disabled', false);
+		});
+	}
+);
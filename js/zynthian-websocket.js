@@ -1,7 +1,8 @@
 function connectZynthianWebSocket(onopenDeferred){
 	var url = window.location.href
 	var parts = url.split("/");
-	var zynthianSocket = new WebSocket("ws://"+parts[2]+"/ws");
+	// Compact {h, d} JSON envelopes. Servers not supporting it use the legacy jsonpickle format.
+	var zynthianSocket = new WebSocket("ws://"+parts[2]+"/ws", ["zynthian.json"]);
 	zynthianSocket.onconnecting = function(evn){
 		console.log("zynthianSocket:onconnecting:",evn);
 
@@ -16,10 +17,18 @@ function connectZynthianWebSocket(onopenDeferred){
 	}
 
 	zynthianSocket.onmessage = function(evn){
-		console.log("zynthianSocket.onmessage:",evn.data);
+		//console.log("zynthianSocket.onmessage:",evn.data);
 		var jsonMessage = JSON.parse(evn.data);
-		if (this.messageHandler[jsonMessage._handler_name]){
-			this.messageHandler[jsonMessage._handler_name](jsonMessage._data);
+		var handlerName, data;
+		if ('h' in jsonMessage) {
+			handlerName = jsonMessage.h;
+			data = jsonMessage.d;
+		} else {
+			handlerName = jsonMessage._handler_name;
+			data = jsonMessage._data;
+		}
+		if (this.messageHandler[handlerName]){
+			this.messageHandler[handlerName](data);
 		}
 	}
 
@@ -27,5 +36,9 @@ function connectZynthianWebSocket(onopenDeferred){
 	zynthianSocket.registerHandler = function(handlerName, onmessage) {
 		this.messageHandler[handlerName] = onmessage;
 	}
+
+	zynthianSocket.sendMessage = function(handlerName, data) {
+		this.send(JSON.stringify({'h': handlerName, 'd': data}));
+	}
 	window.zynthianSocket = zynthianSocket;
 }
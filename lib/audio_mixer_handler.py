@@ -26,21 +26,23 @@ import os
 import re
 import sys
 import logging
-import jsonpickle
 from typing import Optional, Awaitable
 
 import tornado.web
 from lib.audio_config_handler import AudioConfigHandler
-from lib.zynthian_websocket_handler import ZynthianWebSocketMessageHandler, ZynthianWebSocketMessage
+from lib.zynthian_websocket_handler import ZynthianWebSocketMessageHandler, SEND_LATEST
+from lib.websocket_broker import broker
 from zyngine.zynthian_engine_mixer import *
 
 
 #------------------------------------------------------------------------------
 # Audio Configuration
 #------------------------------------------------------------------------------
-class AudioMixerHandler(tornado.web.RequestHandler):
 
-	websocket_message_handler_list = []
+# Controller changes posted by the UI, as "symbol=value"
+MIXER_TOPIC = "mixer"
+
+class AudioMixerHandler(tornado.web.RequestHandler):
 
 	def get_current_user(self):
 		return self.get_secure_cookie("user")
@@ -51,11 +53,7 @@ class AudioMixerHandler(tornado.web.RequestHandler):
 
 		try:
 			logging.debug('updating webconfig view: {} with {}'.format(ctrl, val))
-
-			for websocket_message_handler in AudioMixerHandler.websocket_message_handler_list:
-				logging.debug('message_handler: {}'.format(websocket_message_handler))
-				websocket_message_handler.update_controller_value(ctrl, val)
-
+			broker.publish(MIXER_TOPIC, '{}={}'.format(ctrl, val))
 
 		except Exception as err:
 			result['errors'] = str(err)
@@ -65,17 +63,9 @@ class AudioMixerHandler(tornado.web.RequestHandler):
 		if result:
 			self.write(result)
 
-	@classmethod
-	def register_websocket(self, websocket_message_handler:ZynthianWebSocketMessageHandler):
-		AudioMixerHandler.websocket_message_handler_list.append(websocket_message_handler)
-
-	@classmethod
-	def unregister_websocket(self, websocket_message_handler: ZynthianWebSocketMessageHandler):
-		AudioMixerHandler.websocket_message_handler_list.remove(websocket_message_handler)
-
 
 class AudioConfigMessageHandler(ZynthianWebSocketMessageHandler):
-	logging_thread = None
+	send_policy = SEND_LATEST
 
 	@classmethod
 	def is_registered_for(cls, handler_name):
@@ -90,16 +80,12 @@ class AudioConfigMessageHandler(ZynthianWebSocketMessageHandler):
 		if action == 'UPDATE_AUDIO_MIXER':
 			self.do_update_audio_mixer(parm1, parm2)
 		elif action == 'REGISTER_WEBSOCKET':
-			AudioMixerHandler.register_websocket(self)
+			self.subscribe(MIXER_TOPIC)
 		else:
 			logging.error('Unknown action {}'.format(action))
 		logging.debug("message handled.")  # this needs to show up early to get the socket working again.
 
 
-	def on_close(self):
-		AudioMixerHandler.unregister_websocket(self)
-
-
 	def do_update_audio_mixer(self, symbol, value):
 		try:
 			zctrl = AudioConfigHandler.zctrls[symbol]
@@ -112,7 +98,6 @@ class AudioConfigMessageHandler(ZynthianWebSocketMessageHandler):
 			logging.debug("Can't set controller '{}' value to '{}': {}".format(symbol, value, e))
 
 
-	def update_controller_value(self, symbol, value):
-		message = ZynthianWebSocketMessage('AudioConfigMessageHandler', '{}={}'.format(symbol, value))
-		self.websocket.write_message(jsonpickle.encode(message))
-
+	# Only the latest value of each controller is sent to slow clients
+	def get_send_key(self, data):
+		return data.split("=", 1)[0]
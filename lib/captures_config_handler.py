@@ -29,11 +29,29 @@ import shutil
 import mutagen
 import fnmatch
 import logging
+import inspect
 import jsonpickle
-import subprocess
 import tornado.web
 from collections import OrderedDict
 from lib.zynthian_config_handler import ZynthianBasicHandler
+from lib.library_index import library_index
+from lib.command_runner import command_runner
+from lib.workers import workers
+
+#------------------------------------------------------------------------------
+# Module helper functions
+#------------------------------------------------------------------------------
+
+def get_media_lengths(fpaths):
+	# Run by the worker pool, so it must be picklable => module level
+	result = []
+	for fpath in fpaths:
+		try:
+			result.append(mutagen.File(fpath).info.length)
+		except Exception as e:
+			logging.warning(e)
+			result.append(None)
+	return result
 
 #------------------------------------------------------------------------------
 # Soundfont Configuration
@@ -42,6 +60,7 @@ from lib.zynthian_config_handler import ZynthianBasicHandler
 class CapturesConfigHandler(ZynthianBasicHandler):
 	CAPTURES_DIRECTORY = "/zynthian/zynthian-my-data/capture"
 	MOUNTED_CAPTURES_DIRECTORY = "/media/usb0"
+	CONVERT_TIMEOUT = 600
 
 	selectedTreeNode = 0
 	selected_full_path = ''
@@ -49,17 +68,13 @@ class CapturesConfigHandler(ZynthianBasicHandler):
 	maxTreeNodeIndex = 0
 
 	@tornado.web.authenticated
-	def get(self, errors=None):
+	async def get(self, errors=None):
 		config=OrderedDict([])
 		self.maxTreeNodeIndex = 0
 		if self.get_argument('stream', None, True):
 			self.do_download(self.get_argument('stream').replace("%27","'"))
 		else:
-			captures = []
-			captures.append(self.create_node('wav'))
-			captures.append(self.create_node('ogg'))
-			captures.append(self.create_node('mp3'))
-			captures.append(self.create_node('mid'))
+			captures = await self.get_captures_data()
 
 			config['ZYNTHIAN_CAPTURES'] = json.dumps(captures)
 			config['ZYNTHIAN_CAPTURES_SELECTION_NODE_ID'] = self.selectedTreeNode | 0
@@ -68,7 +83,7 @@ class CapturesConfigHandler(ZynthianBasicHandler):
 			super().get("captures.html", "Captures", config, errors)
 
 
-	def post(self):
+	async def post(self):
 		action = self.get_argument('ZYNTHIAN_CAPTURES_ACTION', None)
 		if not action and self.get_argument('INSTALL_FPATH', None):
 			action = 'UPLOAD'
@@ -81,9 +96,11 @@ class CapturesConfigHandler(ZynthianBasicHandler):
 				'CONVERT_OGG': lambda: self.do_convert_ogg(),
 				'UPLOAD': lambda: self.do_install_file()
 			}[action]()
+			if inspect.isawaitable(errors):
+				errors = await errors
 
 		if (action != 'DOWNLOAD'):
-			self.get(errors)
+			await self.get(errors)
 
 
 	def do_remove(self):
@@ -147,14 +164,14 @@ class CapturesConfigHandler(ZynthianBasicHandler):
 
 		return result
 
-	def do_convert_ogg(self):
+	async def do_convert_ogg(self):
 		ogg_file_name = os.path.splitext(self.selected_full_path)[0]+'.ogg'
-		cmd = 'oggenc "{}" -o "{}"'.format(self.selected_full_path, ogg_file_name)
+		cmd = ['oggenc', self.selected_full_path, '-o', ogg_file_name]
 		try:
 			logging.info(cmd)
-			subprocess.check_output(cmd, stderr=subprocess.STDOUT, shell=True)
+			await command_runner.run(cmd, timeout=self.CONVERT_TIMEOUT, stderr_to_stdout=True)
 		except Exception as e:
-			return e.output
+			return getattr(e, 'output', None) or format(e)
 		return
 
 
@@ -171,7 +188,27 @@ class CapturesConfigHandler(ZynthianBasicHandler):
 				return 'application/wav'
 
 
-	def create_node(self, file_extension):
+	async def get_captures_data(self):
+		# The tree is walked in a thread and the media files are parsed by the worker pool.
+		# Node texts are completed with the length afterwards.
+		media_files = []
+		captures = await workers.run_in_thread(self.walk_captures, media_files)
+		lengths = await workers.run_cpu_bound(get_media_lengths, [fpath for capture, fpath in media_files])
+		for (capture, fpath), l in zip(media_files, lengths):
+			if l is not None:
+				capture['text'] = "{} [{}:{:02d}]".format(capture['name'], int(l/60), int(l%60))
+		return captures
+
+
+	def walk_captures(self, media_files):
+		library_index.sync()
+		captures = []
+		for file_extension in ('wav', 'ogg', 'mp3', 'mid'):
+			captures.append(self.create_node(file_extension, media_files))
+		return captures
+
+
+	def create_node(self, file_extension, media_files=None):
 		captures = []
 		root_capture = {
 			'text': file_extension,
@@ -185,14 +222,14 @@ class CapturesConfigHandler(ZynthianBasicHandler):
 		try:
 			if os.path.ismount(CapturesConfigHandler.MOUNTED_CAPTURES_DIRECTORY):
 				captures.extend(
-					self.walk_directory(CapturesConfigHandler.MOUNTED_CAPTURES_DIRECTORY, 'fa fa-fw fa-usb', file_extension))
+					self.walk_directory(CapturesConfigHandler.MOUNTED_CAPTURES_DIRECTORY, 'fa fa-fw fa-usb', file_extension, media_files))
 			else:
 				logging.info("/media/usb0 not found")
 		except:
 			pass
 
 		try:
-			captures.extend(self.walk_directory(CapturesConfigHandler.CAPTURES_DIRECTORY, 'fa fa-fw fa-file', file_extension))
+			captures.extend(self.walk_directory(CapturesConfigHandler.CAPTURES_DIRECTORY, 'fa fa-fw fa-file', file_extension, media_files))
 		except:
 			pass
 		root_capture['nodes'] = captures
@@ -206,10 +243,10 @@ class CapturesConfigHandler(ZynthianBasicHandler):
 		logging.info(destination)
 		shutil.move(fpath, destination)
 
-	def walk_directory(self, directory, icon, file_extension):
+	def walk_directory(self, directory, icon, file_extension, media_files=None):
 		captures = []
 		logging.info("Getting {} filelist from {}".format(file_extension,directory))
-		for f in sorted(os.listdir(directory)):
+		for f in sorted(library_index.listdir(directory)):
 
 			fname, fext = os.path.splitext(f)
 			if len(fext)>0:
@@ -234,12 +271,6 @@ class CapturesConfigHandler(ZynthianBasicHandler):
 				pass
 
 			text = f.replace("'", "&#39;")
-			try:
-				l = mutagen.File(fullPath).info.length
-				text = "{} [{}:{:02d}]".format(f.replace("'", "&#39;"), int(l/60), int(l%60))
-			except Exception as e:
-				logging.warning(e)
-
 			capture = {
 				'text': text,
 				'name': f.replace("'","&#39;"),
@@ -249,8 +280,10 @@ class CapturesConfigHandler(ZynthianBasicHandler):
 				'id': self.maxTreeNodeIndex
 			}
 			self.maxTreeNodeIndex+=1
-			if os.path.isdir(fullPath):
-				capture['nodes'] = self.walk_directory(os.path.join(directory, f), icon)
+			if library_index.isdir(fullPath):
+				capture['nodes'] = self.walk_directory(os.path.join(directory, f), icon, file_extension, media_files)
+			elif media_files is not None:
+				media_files.append((capture, fullPath))
 			captures.append(capture)
 
 
@@ -0,0 +1,197 @@
+# -*- coding: utf-8 -*-
+#********************************************************************
+# ZYNTHIAN PROJECT: Zynthian Web Configurator
+#
+# Async Command Runner
+#
+# Copyright (C) 2018 Fernando Moyano <jofemodo@zynthian.org>
+#
+#********************************************************************
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License as
+# published by the Free Software Foundation; either version 2 of
+# the License, or any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# For a full copy of the GNU General Public License see the LICENSE.txt file.
+#
+#********************************************************************
+
+import os
+import time
+import asyncio
+import logging
+import subprocess
+
+#------------------------------------------------------------------------------
+# Async Command Runner
+#
+# External commands are run with asyncio.create_subprocess_exec, so they
+# never block the IOLoop. Every command has a timeout and semaphores cap the
+# number of concurrent child processes. Long jobs (timeout over
+# DEFAULT_TIMEOUT: builds, installs, conversions, service restarts ...) have
+# their own limit, so they never make short probes (service status ...)
+# wait for them. Results can be cached for a few seconds, so several
+# requests asking the same thing share a single fork.
+#
+# Errors are reported like subprocess.check_output does:
+# CalledProcessError for non-zero exit codes, TimeoutExpired for timeouts.
+#------------------------------------------------------------------------------
+
+DEFAULT_TIMEOUT = 30
+
+class CommandRunner():
+
+	def __init__(self, max_procs=None, max_long_procs=None):
+		if max_procs is None:
+			max_procs = int(os.environ.get('ZYNTHIAN_WEBCONF_MAX_PROCS', 2))
+		if max_long_procs is None:
+			max_long_procs = int(os.environ.get('ZYNTHIAN_WEBCONF_MAX_LONG_PROCS', 2))
+		self.max_procs = max_procs
+		self.max_long_procs = max_long_procs
+		self.semaphore = None
+		self.long_semaphore = None
+		# key => (expiration time, output)
+		self.cache = {}
+		# key => future, for cached commands that are already running
+		self.pending = {}
+		# Background tasks launched with spawn
+		self.tasks = set()
+
+
+	def get_semaphore(self, timeout=DEFAULT_TIMEOUT):
+		# Created lazily, so they're bound to the running loop
+		if timeout is None or timeout > DEFAULT_TIMEOUT:
+			if self.long_semaphore is None:
+				self.long_semaphore = asyncio.Semaphore(self.max_long_procs)
+			return self.long_semaphore
+		if self.semaphore is None:
+			self.semaphore = asyncio.Semaphore(self.max_procs)
+		return self.semaphore
+
+
+	async def run(self, args, timeout=DEFAULT_TIMEOUT, cache_ttl=0, check=True, cwd=None, stderr_to_stdout=False):
+		"""Run a command and return its stdout as bytes."""
+		args = [str(a) for a in args]
+		if cache_ttl <= 0:
+			return await self.execute(args, timeout, check, cwd, stderr_to_stdout)
+
+		key = (tuple(args), cwd, check, stderr_to_stdout)
+		try:
+			expiration, output = self.cache[key]
+			if expiration > time.monotonic():
+				return output
+		except KeyError:
+			pass
+
+		future = self.pending.get(key)
+		if future:
+			return await asyncio.shield(future)
+
+		future = asyncio.ensure_future(self.execute(args, timeout, check, cwd, stderr_to_stdout))
+		self.pending[key] = future
+		try:
+			output = await asyncio.shield(future)
+			self.cache[key] = (time.monotonic() + cache_ttl, output)
+			return output
+		finally:
+			del self.pending[key]
+
+
+	async def run_text(self, args, **kwargs):
+		"""Same than run, but return stdout decoded as UTF-8."""
+		output = await self.run(args, **kwargs)
+		return output.decode('utf-8', 'ignore')
+
+
+	async def execute(self, args, timeout, check, cwd, stderr_to_stdout):
+		if stderr_to_stdout:
+			stderr = asyncio.subprocess.STDOUT
+		else:
+			stderr = asyncio.subprocess.PIPE
+
+		async with self.get_semaphore(timeout):
+			logging.debug("Running command: {}".format(args))
+			proc = await asyncio.create_subprocess_exec(*args, cwd=cwd,
+				stdin=asyncio.subprocess.DEVNULL, stdout=asyncio.subprocess.PIPE, stderr=stderr)
+			try:
+				stdout, stderr = await asyncio.wait_for(proc.communicate(), timeout)
+			except asyncio.TimeoutError:
+				proc.kill()
+				await proc.wait()
+				raise subprocess.TimeoutExpired(args, timeout)
+
+		if check and proc.returncode != 0:
+			raise subprocess.CalledProcessError(proc.returncode, args, stdout, stderr)
+		return stdout
+
+
+	async def stream(self, args, on_line, cwd=None):
+		"""Run a command, calling on_line with every output line (stdout &
+		stderr) as soon as it's written. Return the exit code. It's meant for
+		long operations the user is watching (updates ...), so there is no
+		timeout and it doesn't take a slot of the semaphore."""
+		args = [str(a) for a in args]
+		logging.debug("Streaming command: {}".format(args))
+		proc = await asyncio.create_subprocess_exec(*args, cwd=cwd,
+			stdin=asyncio.subprocess.DEVNULL, stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.STDOUT)
+		while True:
+			line = await proc.stdout.readline()
+			if not line:
+				break
+			on_line(line.decode('utf-8', 'ignore'))
+		return await proc.wait()
+
+
+	def spawn(self, args, timeout=None, cwd=None):
+		"""Run a command in background, logging the result instead of waiting for it."""
+		async def spawn_command():
+			try:
+				await self.run(args, timeout=timeout, cwd=cwd)
+			except Exception as e:
+				logging.error("Command {} failed => {}".format(args, e))
+		return self.spawn_task(spawn_command())
+
+
+	def spawn_task(self, coro):
+		task = asyncio.ensure_future(coro)
+		# Keep a reference until it's done, so it's not garbage collected
+		self.tasks.add(task)
+		task.add_done_callback(self.tasks.discard)
+		return task
+
+
+	def invalidate(self, args=None):
+		if args is None:
+			self.cache.clear()
+		else:
+			args = tuple(str(a) for a in args)
+			for key in [k for k in self.cache if k[0] == args]:
+				del self.cache[key]
+
+
+command_runner = CommandRunner()
+
+#------------------------------------------------------------------------------
+# Common commands
+#------------------------------------------------------------------------------
+
+async def is_service_active(service, cache_ttl=2):
+	try:
+		result = await command_runner.run_text(["systemctl", "is-active", service], timeout=5, cache_ttl=cache_ttl, check=False)
+	except Exception as e:
+		logging.error("Can't get status of service {} => {}".format(service, e))
+		return False
+	return result.strip() == 'active'
+
+
+async def get_root_crypt():
+	result = await command_runner.run_text(["getent", "shadow", "root"], timeout=5)
+	return result.split(':')[1]
+
+#------------------------------------------------------------------------------
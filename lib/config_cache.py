@@ -0,0 +1,97 @@
+# -*- coding: utf-8 -*-
+#********************************************************************
+# ZYNTHIAN PROJECT: Zynthian Web Configurator
+#
+# Zynthian Config Cache
+#
+# Copyright (C) 2017 Fernando Moyano <jofemodo@zynthian.org>
+#
+#********************************************************************
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License as
+# published by the Free Software Foundation; either version 2 of
+# the License, or any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# For a full copy of the GNU General Public License see the LICENSE.txt file.
+#
+#********************************************************************
+
+import os
+import sys
+import logging
+
+sys.path.append(os.environ.get('ZYNTHIAN_UI_DIR'))
+import zynconf
+
+#------------------------------------------------------------------------------
+# Zynthian Config Cache
+#
+# zynconf.load_config() & zynconf.load_midi_config() parse the envars & MIDI
+# profile scripts and export them to os.environ. They are only called again
+# when the backing file path, mtime or size has changed.
+#------------------------------------------------------------------------------
+
+def get_file_stamp(fpath):
+	try:
+		st = os.stat(fpath)
+		return (fpath, st.st_mtime_ns, st.st_size)
+	except OSError:
+		return None
+
+
+class ZynthianConfigCache():
+
+	def __init__(self):
+		self.config_stamp = None
+		self.midi_config_stamp = None
+
+
+	def load_config(self):
+		stamp = get_file_stamp(zynconf.get_config_fpath())
+		if stamp is None or stamp != self.config_stamp:
+			logging.debug("Loading config from {}".format(stamp))
+			zynconf.load_config()
+			self.config_stamp = stamp
+
+
+	def load_midi_config(self):
+		# The MIDI profile path depends on ZYNTHIAN_SCRIPT_MIDI_PROFILE, so it's part of the stamp
+		stamp = get_file_stamp(zynconf.get_midi_config_fpath())
+		if stamp is None or stamp != self.midi_config_stamp:
+			logging.debug("Loading MIDI config from {}".format(stamp))
+			zynconf.load_midi_config()
+			self.midi_config_stamp = stamp
+
+
+	def invalidate(self):
+		self.config_stamp = None
+		self.midi_config_stamp = None
+
+
+	def invalidate_midi_config(self):
+		self.midi_config_stamp = None
+
+
+	def save_config(self, config, update_sys=False):
+		try:
+			return zynconf.save_config(config, update_sys=update_sys)
+		finally:
+			self.invalidate()
+
+
+	def update_midi_profile(self, params, fpath=None):
+		try:
+			return zynconf.update_midi_profile(params, fpath)
+		finally:
+			self.invalidate_midi_config()
+
+
+config_cache = ZynthianConfigCache()
+
+#------------------------------------------------------------------------------
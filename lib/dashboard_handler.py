@@ -23,14 +23,19 @@
 #********************************************************************
 
 import os
-import re
 import sys
+import time
+import asyncio
 import logging
 import tornado.web
-from subprocess import check_output
 from distutils import util
 from collections import OrderedDict
 from lib.zynthian_config_handler import ZynthianBasicHandler
+from lib.zynthian_websocket_handler import ZynthianWebSocketMessageHandler, SEND_MERGE
+from lib.system_metrics import system_metrics
+from lib.git_info import get_git_info
+from lib.library_index import library_index
+from lib.hardware_probe import hardware_probe
 
 sys.path.append(os.environ.get('ZYNTHIAN_UI_DIR'))
 import zynconf
@@ -42,7 +47,7 @@ import zynconf
 class DashboardHandler(ZynthianBasicHandler):
 
 	@tornado.web.authenticated
-	def get(self):
+	async def get(self):
 		# Get git info
 		git_info_zyncoder=self.get_git_info("/zynthian/zyncoder")
 		git_info_ui=self.get_git_info("/zynthian/zynthian-ui")
@@ -50,9 +55,18 @@ class DashboardHandler(ZynthianBasicHandler):
 		git_info_webconf=self.get_git_info("/zynthian/zynthian-webconf")
 		git_info_data=self.get_git_info("/zynthian/zynthian-data")
 
-		# Get Memory & SD Card info
-		ram_info=self.get_ram_info()
-		sd_info=self.get_sd_info()
+		# Get Memory, SD Card & Network info from the metrics collector
+		metrics=system_metrics.get_snapshot()
+		live_metrics=self.get_live_metrics(metrics)
+
+		# Get hardware info, probed once per boot
+		hw_info=await hardware_probe.get_info()
+
+		# Get services status, running systemctl concurrently
+		rtpmidi_active, qmidinet_active, touchosc_active = await asyncio.gather(
+			self.is_service_active("jackrtpmidid"),
+			self.is_service_active("qmidinet"),
+			self.is_service_active("touchosc2midi"))
 
 		config=OrderedDict([
 			['HARDWARE', {
@@ -79,8 +93,16 @@ class DashboardHandler(ZynthianBasicHandler):
 					}],
 					['GPIO_EXPANDER', {
 						'title': 'GPIO Expander',
-						'value': self.get_gpio_expander(),
+						'value': hw_info['gpio_expander'],
 						'url': "/hw-wiring"
+					}],
+					['DETECTED_SOUNDCARDS', {
+						'title': 'Detected Soundcards',
+						'value': ", ".join(sc['name'] for sc in hw_info['soundcards']) or "None"
+					}],
+					['FRAMEBUFFERS', {
+						'title': 'Framebuffers',
+						'value': ", ".join(fb['name'] for fb in hw_info['framebuffers']) or "None"
 					}]
 				])
 			}],
@@ -89,7 +111,7 @@ class DashboardHandler(ZynthianBasicHandler):
 				'icon': 'glyphicon glyphicon-tasks',
 				'info': OrderedDict([
 					['OS_INFO', {
-						'title': "{}".format(self.get_os_info())
+						'title': "{}".format(metrics['os_info'])
 					}],
 					['BUILD_DATE', {
 						'title': 'Build Date',
@@ -97,15 +119,27 @@ class DashboardHandler(ZynthianBasicHandler):
 					}],
 					['RAM', {
 						'title': 'Memory',
-						'value': "{} ({}/{})".format(ram_info['usage'],ram_info['used'],ram_info['total'])
+						'value': live_metrics['RAM']
 					}],
 					['SD CARD', {
 						'title': 'SD Card',
-						'value': "{} ({}/{})".format(sd_info['usage'],sd_info['used'],sd_info['total'])
+						'value': live_metrics['SD CARD']
 					}],
 					['TEMPERATURE', {
 						'title': 'Temperature',
-						'value': self.get_temperature()
+						'value': live_metrics['TEMPERATURE']
+					}],
+					['CPU_LOAD', {
+						'title': 'CPU Load',
+						'value': live_metrics['CPU_LOAD']
+					}],
+					['DSP_LOAD', {
+						'title': 'JACK DSP Load',
+						'value': live_metrics['DSP_LOAD']
+					}],
+					['XRUNS', {
+						'title': 'JACK Xruns',
+						'value': live_metrics['XRUNS']
 					}]
 				])
 			}],
@@ -174,27 +208,27 @@ class DashboardHandler(ZynthianBasicHandler):
 				'info': OrderedDict([
 					['SNAPSHOTS', {
 						'title': 'Snapshots',
-						'value': str(self.get_num_of_files(os.environ.get('ZYNTHIAN_MY_DATA_DIR')+"/snapshots")),
+						'value': str(library_index.count('snapshots')),
 						'url': "/lib-snapshot"
 					}],
 					['USER_PRESETS', {
 						'title': 'User Presets',
-						'value': str(self.get_num_of_presets(os.environ.get('ZYNTHIAN_MY_DATA_DIR')+"/presets")),
+						'value': str(self.get_num_of_presets()),
 						'url': "/lib-presets"
 					}],
 					['USER_SOUNDFONTS', {
 						'title': 'User Soundfonts',
-						'value': str(self.get_num_of_files(os.environ.get('ZYNTHIAN_MY_DATA_DIR')+"/soundfonts")),
+						'value': str(library_index.count('soundfonts')),
 						'url': "/lib-soundfont"
 					}],
 					['AUDIO_CAPTURES', {
 						'title': 'Audio Captures',
-						'value': str(self.get_num_of_files(os.environ.get('ZYNTHIAN_MY_DATA_DIR')+"/capture","*.wav")),
+						'value': str(library_index.count('captures_wav')),
 						'url': "/lib-captures"
 					}],
 					['MIDI_CAPTURES', {
 						'title': 'MIDI Captures',
-						'value': str(self.get_num_of_files(os.environ.get('ZYNTHIAN_MY_DATA_DIR')+"/capture","*.mid")),
+						'value': str(library_index.count('captures_mid')),
 						'url': "/lib-captures"
 					}]
 				])
@@ -204,7 +238,7 @@ class DashboardHandler(ZynthianBasicHandler):
 				'info': OrderedDict([
 					['HOSTNAME', {
 						'title': 'Hostname',
-						'value': self.get_host_name(),
+						'value': metrics['host_name'],
 						'url': "/sys-security"
 					}],
 					['WIFI', {
@@ -214,24 +248,24 @@ class DashboardHandler(ZynthianBasicHandler):
 					}],
 					['IP', {
 						'title': 'IP',
-						'value': self.get_ip(),
+						'value': " ".join(metrics['ip']),
 						'url': "/sys-wifi"
 					}],
 					['RTPMIDI', {
 						'title': 'RTP-MIDI',
-						'value': self.bool2onoff(self.is_service_active("jackrtpmidid")),
+						'value': self.bool2onoff(rtpmidi_active),
 						'url': "/ui-midi-options"
 					}],
 					['QMIDINET', {
 						'title': 'QMidiNet',
-						'value': self.bool2onoff(self.is_service_active("qmidinet")),
+						'value': self.bool2onoff(qmidinet_active),
 						'url': "/ui-midi-options"
 					}]
 				])
 			}]
 		])
 
-		if self.is_service_active("touchosc2midi"):
+		if touchosc_active:
 			config['NETWORK']['info']['TOUCHOSC'] = {
 				'title': 'TouchOSC',
 				'value': 'on',
@@ -241,21 +275,16 @@ class DashboardHandler(ZynthianBasicHandler):
 		super().get("dashboard_block.html", "Dashboard", config, None)
 
 
-	def get_git_info(self, path):
-		branch = check_output("cd %s; git branch | grep '*'" % path, shell=True).decode()[2:-1]
-		gitid = check_output("cd %s; git rev-parse HEAD" % path, shell=True).decode()[:-1]
-		return { "branch": branch, "gitid": gitid }
-
-
-	def get_host_name(self):
-		with open("/etc/hostname") as f:
-			hostname=f.readline()
-			return hostname
-		return ""
+	@tornado.web.authenticated
+	async def post(self):
+		command = self.get_argument('_command', '')
+		if command == 'RESCAN_HARDWARE':
+			await hardware_probe.rescan()
+		self.redirect("/")
 
 
-	def get_os_info(self):
-		return check_output("lsb_release -ds", shell=True).decode()
+	def get_git_info(self, path):
+		return get_git_info(path)
 
 
 	def get_build_info(self):
@@ -279,73 +308,41 @@ class DashboardHandler(ZynthianBasicHandler):
 		return info
 
 
-	def get_ip(self):
-		#out=check_output("hostname -I | cut -f1 -d' '", shell=True).decode()
-		out=check_output("hostname -I", shell=True).decode()
-		return out
-
-
-	def get_gpio_expander(self):
-		try:
-			out=check_output("gpio i2cd", shell=True).decode().split("\n")
-			if len(out)>3 and out[3].startswith("20: 20"):
-				out2 = check_output("i2cget -y 1 0x20 0x10", shell=True).decode().strip()
-				if out2=='0x00':
-					return "MCP23008"
-				else:
-					return "MCP23017"
-		except:
-			pass
-		return "Not detected"
-
-
-	def get_ram_info(self):
-		out=check_output("free -m | grep 'Mem'", shell=True).decode()
-		parts=re.split('\s+', out)
-		return { 'total': parts[1]+"M", 'used': parts[2]+"M", 'free': parts[3]+"M", 'usage': "{}%".format(int(100*float(parts[2])/float(parts[1]))) }
+	@staticmethod
+	def get_live_metrics(metrics):
+		ram_info=metrics['ram']
+		sd_info=metrics['sd']
+		return {
+			'RAM': "{} ({}/{})".format(ram_info['usage'],ram_info['used'],ram_info['total']),
+			'SD CARD': "{} ({}/{})".format(sd_info['usage'],sd_info['used'],sd_info['total']),
+			'TEMPERATURE': DashboardHandler.format_temperature(metrics['temperature']),
+			'CPU_LOAD': DashboardHandler.format_percent(metrics['cpu_load']),
+			'DSP_LOAD': DashboardHandler.format_percent(metrics['dsp_load']),
+			'XRUNS': str(metrics['xruns'])
+		}
 
 
-	def get_temperature(self):
-		try:
-			return check_output("/opt/vc/bin/vcgencmd measure_temp", shell=True).decode()[5:-3] + "ºC"
-		except:
+	@staticmethod
+	def format_temperature(temperature):
+		if temperature is None:
 			return "???"
+		return "{:.1f}ºC".format(temperature)
 
 
-	def get_sd_info(self):
-		try:
-			out=check_output("df -h / | grep '/dev/root'", shell=True).decode()
-			parts=re.split('\s+', out)
-			return { 'total': parts[1], 'used': parts[2], 'free': parts[3], 'usage': parts[4] }
-		except:
-			return { 'total': 'NA', 'used': 'NA', 'free': 'NA', 'usage': 'NA' }
+	@staticmethod
+	def format_percent(value):
+		if value is None:
+			return "???"
+		return "{:.0f}%".format(value)
 
 
-	def get_num_of_files(self, path, pattern=None):
-		if pattern:
-			pattern = "-name \"{}\"".format(pattern)
-		else:
-			pattern = ""
-		n=check_output("find {} -type f -follow {} | wc -l".format(path, pattern), shell=True).decode()
+	def get_num_of_presets(self):
+		n = 0
+		for category in ('presets_lv2', 'presets_pianoteq', 'presets_puredata', 'presets_zynaddsubfx'):
+			n += library_index.count(category)
 		return n
 
 
-	def get_num_of_presets(self, path):
-		# LV2 presets
-		n1 = int(check_output("find {}/lv2 -type f -prune -name manifest.ttl | wc -l".format(path), shell=True).decode())
-		logging.debug("LV2 presets => {}".format(n1))
-		# Pianoteq presets
-		n2 = int(check_output("find {}/pianoteq -type f -prune | wc -l".format(path), shell=True).decode())
-		logging.debug("Pianoteq presets => {}".format(n2))
-		# Puredata presets
-		n3 = int(check_output("find {}/puredata/*/* -type d -prune | wc -l".format(path), shell=True).decode())
-		logging.debug("Puredata presets => {}".format(n3))
-		# ZynAddSubFX presets
-		n4 = int(check_output("find {}/zynaddsubfx -type f -name *.xiz | wc -l".format(path), shell=True).decode())
-		logging.debug("ZynAddSubFX presets => {}".format(n4))
-		return n1 + n2 + n3 + n4
-
-
 	def get_midi_master_chan(self):
 		mmc = os.environ.get('ZYNTHIAN_MIDI_MASTER_CHANNEL',"16")
 		if int(mmc)==0:
@@ -354,17 +351,6 @@ class DashboardHandler(ZynthianBasicHandler):
 			return mmc
 
 
-	def is_service_active(self, service):
-		cmd="systemctl is-active %s" % service
-		try:
-			result=check_output(cmd, shell=True).decode('utf-8','ignore')
-		except Exception as e:
-			result="ERROR: %s" % e
-		#print("Is service "+str(service)+" active? => "+str(result))
-		if result.strip()=='active': return True
-		else: return False
-
-
 	@staticmethod
 	def bool2onoff(b):
 		if (isinstance(b, str) and util.strtobool(b)) or (isinstance(b, bool) and b):
@@ -372,3 +358,72 @@ class DashboardHandler(ZynthianBasicHandler):
 		else:
 			return "off"
 
+
+#------------------------------------------------------------------------------
+# Dashboard Live Metrics
+#------------------------------------------------------------------------------
+
+class DashboardMessageHandler(ZynthianWebSocketMessageHandler):
+	MIN_RATE = 250
+	# Deltas pending for a slow client are merged, so it gets one up-to-date message
+	send_policy = SEND_MERGE
+
+	# websocket => subscribed message handler
+	subscribers = {}
+
+	@classmethod
+	def is_registered_for(cls, handler_name):
+		return handler_name == 'DashboardMessageHandler'
+
+
+	def on_websocket_message(self, message):
+		logging.debug("message: %s " % message)
+		parts = message.split(" ", maxsplit=1)
+		action = parts[0]
+
+		if action == 'SUBSCRIBE':
+			try:
+				rate = int(parts[1])
+			except:
+				rate = system_metrics.interval
+			self.do_subscribe(rate)
+
+		elif action == 'UNSUBSCRIBE':
+			self.do_unsubscribe()
+
+
+	def do_subscribe(self, rate):
+		# All subscribers share the collector's sampling, only the push rate is per client
+		self.do_unsubscribe()
+		self.rate = max(rate, self.MIN_RATE) / 1000.0
+		self.last_push_ts = 0
+		self.last_sent = {}
+		DashboardMessageHandler.subscribers[self.websocket] = self
+		system_metrics.add_listener(self.on_metrics)
+		self.on_metrics(system_metrics.get_snapshot())
+
+
+	def do_unsubscribe(self):
+		handler = DashboardMessageHandler.subscribers.pop(self.websocket, None)
+		if handler:
+			system_metrics.remove_listener(handler.on_metrics)
+
+
+	def on_metrics(self, snapshot):
+		now = time.monotonic()
+		if now - self.last_push_ts < self.rate:
+			return
+		self.last_push_ts = now
+
+		delta = {}
+		for key, value in DashboardHandler.get_live_metrics(snapshot).items():
+			if self.last_sent.get(key) != value:
+				delta[key] = value
+				self.last_sent[key] = value
+
+		if delta:
+			self.send(delta)
+
+
+	def on_close(self):
+		self.do_unsubscribe()
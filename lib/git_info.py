@@ -0,0 +1,189 @@
+# -*- coding: utf-8 -*-
+#********************************************************************
+# ZYNTHIAN PROJECT: Zynthian Web Configurator
+#
+# GIT Metadata Reader
+#
+# Copyright (C) 2018 Fernando Moyano <jofemodo@zynthian.org>
+#
+#********************************************************************
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License as
+# published by the Free Software Foundation; either version 2 of
+# the License, or any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# For a full copy of the GNU General Public License see the LICENSE.txt file.
+#
+#********************************************************************
+
+import os
+import logging
+
+#------------------------------------------------------------------------------
+# GIT metadata is read directly from the .git directory, without calling git.
+# Results are cached per repository and invalidated when the mtime of HEAD,
+# packed-refs or any directory below refs changes.
+#------------------------------------------------------------------------------
+
+metadata_cache = {}
+
+
+def get_git_dir(repo_dir):
+	git_dir = os.path.join(repo_dir, ".git")
+	# Worktrees & submodules use a ".git" file pointing to the real directory
+	if os.path.isfile(git_dir):
+		with open(git_dir) as f:
+			line = f.readline().strip()
+		if line.startswith("gitdir:"):
+			git_dir = os.path.normpath(os.path.join(repo_dir, line[7:].strip()))
+	return git_dir
+
+
+def get_mtime(fpath):
+	try:
+		return os.stat(fpath).st_mtime_ns
+	except OSError:
+		return None
+
+
+def get_stamp(git_dir):
+	stamp = [get_mtime(os.path.join(git_dir, "HEAD")), get_mtime(os.path.join(git_dir, "packed-refs"))]
+	for dirname, subdirs, files in os.walk(os.path.join(git_dir, "refs")):
+		stamp.append(get_mtime(dirname))
+	return tuple(stamp)
+
+
+def read_packed_refs(git_dir):
+	refs = {}
+	try:
+		with open(os.path.join(git_dir, "packed-refs")) as f:
+			for line in f:
+				line = line.strip()
+				# Skip comments and peeled tag lines ("^sha")
+				if not line or line[0] in "#^":
+					continue
+				parts = line.split(" ", 1)
+				if len(parts) == 2:
+					refs[parts[1]] = parts[0]
+	except FileNotFoundError:
+		pass
+	return refs
+
+
+def read_loose_refs(git_dir):
+	refs = {}
+	refs_dir = os.path.join(git_dir, "refs")
+	for dirname, subdirs, files in os.walk(refs_dir):
+		for fname in files:
+			fpath = os.path.join(dirname, fname)
+			try:
+				with open(fpath) as f:
+					refs[os.path.relpath(fpath, git_dir)] = f.readline().strip()
+			except Exception as e:
+				logging.warning("Can't read git ref {} => {}".format(fpath, e))
+	return refs
+
+
+def resolve_ref(refs, value, depth=0):
+	# Follow symbolic refs ("ref: refs/heads/master")
+	while value.startswith("ref:") and depth < 8:
+		value = refs.get(value[4:].strip(), "")
+		depth += 1
+	return value
+
+
+def read_metadata(git_dir):
+	refs = read_packed_refs(git_dir)
+	refs.update(read_loose_refs(git_dir))
+
+	with open(os.path.join(git_dir, "HEAD")) as f:
+		head = f.readline().strip()
+
+	if head.startswith("ref:"):
+		head_ref = head[4:].strip()
+		gitid = resolve_ref(refs, head)
+		if head_ref.startswith("refs/heads/"):
+			branch = head_ref[11:]
+		else:
+			branch = head_ref
+	else:
+		gitid = head
+		branch = "(HEAD detached at {})".format(gitid[0:7])
+
+	branches = []
+	remote_branches = []
+	tags = []
+	for ref in sorted(refs):
+		if ref.startswith("refs/heads/"):
+			branches.append(ref[11:])
+		elif ref.startswith("refs/remotes/origin/"):
+			name = ref[20:]
+			if name != "HEAD":
+				remote_branches.append(name)
+		elif ref.startswith("refs/tags/"):
+			tags.append(ref[10:])
+
+	return {
+		'branch': branch,
+		'gitid': gitid,
+		'branches': branches,
+		'remote_branches': remote_branches,
+		'tags': tags
+	}
+
+
+def get_metadata(repo_dir):
+	git_dir = get_git_dir(repo_dir)
+	stamp = get_stamp(git_dir)
+	try:
+		cached_stamp, metadata = metadata_cache[git_dir]
+		if cached_stamp == stamp:
+			return metadata
+	except KeyError:
+		pass
+
+	metadata = read_metadata(git_dir)
+	metadata_cache[git_dir] = (stamp, metadata)
+	return metadata
+
+#------------------------------------------------------------------------------
+# Public API
+#------------------------------------------------------------------------------
+
+def get_git_info(repo_dir):
+	try:
+		metadata = get_metadata(repo_dir)
+		return { "branch": metadata['branch'], "gitid": metadata['gitid'] }
+	except Exception as e:
+		logging.warning("Can't get git info from {} => {}".format(repo_dir, e))
+		return { "branch": "???", "gitid": "" }
+
+
+def get_current_branch(repo_dir):
+	return get_metadata(repo_dir)['branch']
+
+
+def get_head(repo_dir):
+	return get_metadata(repo_dir)['gitid']
+
+
+def get_branches(repo_dir, remotes=True):
+	metadata = get_metadata(repo_dir)
+	result = list(metadata['branches'])
+	if remotes:
+		for bname in metadata['remote_branches']:
+			if bname not in result:
+				result.append(bname)
+	return result
+
+
+def get_tags(repo_dir):
+	return list(get_metadata(repo_dir)['tags'])
+
+#------------------------------------------------------------------------------
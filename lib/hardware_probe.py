@@ -0,0 +1,171 @@
+# -*- coding: utf-8 -*-
+#********************************************************************
+# ZYNTHIAN PROJECT: Zynthian Web Configurator
+#
+# Hardware Probe Cache
+#
+# Copyright (C) 2018 Fernando Moyano <jofemodo@zynthian.org>
+#
+#********************************************************************
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License as
+# published by the Free Software Foundation; either version 2 of
+# the License, or any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# For a full copy of the GNU General Public License see the LICENSE.txt file.
+#
+#********************************************************************
+
+import os
+import re
+import json
+import asyncio
+import logging
+
+from lib.command_runner import command_runner
+
+#------------------------------------------------------------------------------
+# Module helper functions
+#------------------------------------------------------------------------------
+
+def get_boot_id():
+	try:
+		with open("/proc/sys/kernel/random/boot_id") as f:
+			return f.read().strip()
+	except Exception as e:
+		logging.warning("Can't get boot ID! => {}".format(e))
+		return None
+
+
+async def probe_gpio_expander():
+	# This touches the I2C bus, so it should run once per boot at most
+	try:
+		out = (await command_runner.run_text(["gpio", "i2cd"], timeout=10)).split("\n")
+		if len(out)>3 and out[3].startswith("20: 20"):
+			out2 = (await command_runner.run_text(["i2cget", "-y", "1", "0x20", "0x10"], timeout=10)).strip()
+			if out2=='0x00':
+				return "MCP23008"
+			else:
+				return "MCP23017"
+	except:
+		pass
+	return "Not detected"
+
+
+def probe_soundcards():
+	# /proc/asound/cards => " 0 [sndrpihifiberry]: HifiberryDacp - snd_rpi_hifiberry_dacplus"
+	soundcards = []
+	try:
+		p = re.compile(r"^\s*(\d+)\s+\[(\S+)\s*\]:\s*(.*)$")
+		with open("/proc/asound/cards") as f:
+			for line in f:
+				m = p.match(line)
+				if m:
+					soundcards.append({
+						'index': int(m.group(1)),
+						'id': m.group(2),
+						'name': m.group(3).split(" - ")[-1].strip()
+					})
+	except Exception as e:
+		logging.warning("Can't get soundcards! => {}".format(e))
+	return soundcards
+
+
+def probe_framebuffers():
+	# /proc/fb => "0 BCM2708 FB"
+	framebuffers = []
+	try:
+		with open("/proc/fb") as f:
+			for line in f:
+				parts = line.strip().split(" ", 1)
+				if len(parts) == 2:
+					framebuffers.append({
+						'device': "/dev/fb{}".format(parts[0]),
+						'name': parts[1]
+					})
+	except Exception as e:
+		logging.warning("Can't get framebuffers! => {}".format(e))
+	return framebuffers
+
+#------------------------------------------------------------------------------
+# Hardware Probe
+#------------------------------------------------------------------------------
+
+class HardwareProbe():
+
+	def __init__(self, fpath=None):
+		if fpath is None:
+			fpath = "%s/webconf_hw_probe.json" % os.environ.get('ZYNTHIAN_CONFIG_DIR', "/zynthian/config")
+		self.fpath = fpath
+		self.info = None
+		# Running rescan, shared by concurrent callers
+		self.rescan_future = None
+
+
+	async def get_info(self):
+		boot_id = get_boot_id()
+		if self.info and self.info['boot_id'] == boot_id:
+			return self.info
+
+		info = self.load()
+		if info and info.get('boot_id') == boot_id:
+			self.info = info
+			return self.info
+		return await self.rescan()
+
+
+	async def rescan(self):
+		if self.rescan_future is None:
+			self.rescan_future = asyncio.ensure_future(self.do_rescan())
+			self.rescan_future.add_done_callback(self.on_rescan_done)
+		return await asyncio.shield(self.rescan_future)
+
+
+	def on_rescan_done(self, future):
+		self.rescan_future = None
+
+
+	async def do_rescan(self):
+		logging.info("Probing hardware ...")
+		self.info = {
+			'boot_id': get_boot_id(),
+			'gpio_expander': await probe_gpio_expander(),
+			'soundcards': probe_soundcards(),
+			'framebuffers': probe_framebuffers()
+		}
+		self.save()
+		return self.info
+
+
+	def load(self):
+		try:
+			with open(self.fpath, "r") as fh:
+				return json.load(fh)
+		except FileNotFoundError:
+			pass
+		except Exception as e:
+			logging.warning("Can't load hardware probe cache '{}': {}".format(self.fpath, e))
+		return None
+
+
+	def save(self):
+		try:
+			tmp_fpath = self.fpath + ".tmp"
+			with open(tmp_fpath, "w") as fh:
+				json.dump(self.info, fh)
+				fh.flush()
+				os.fsync(fh.fileno())
+			os.replace(tmp_fpath, self.fpath)
+		except Exception as e:
+			logging.error("Can't save hardware probe cache '{}': {}".format(self.fpath, e))
+
+
+hardware_probe = HardwareProbe()
+
+#------------------------------------------------------------------------------
@@ -0,0 +1,197 @@
+# -*- coding: utf-8 -*-
+#********************************************************************
+# ZYNTHIAN PROJECT: Zynthian Web Configurator
+#
+# JACK Client Service
+#
+# Copyright (C) 2018 Fernando Moyano <jofemodo@zynthian.org>
+#
+#********************************************************************
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License as
+# published by the Free Software Foundation; either version 2 of
+# the License, or any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# For a full copy of the GNU General Public License see the LICENSE.txt file.
+#
+#********************************************************************
+
+import re
+import time
+import jack
+import logging
+import threading
+
+from lib.request_metrics import request_metrics, add_header
+
+#------------------------------------------------------------------------------
+# JACK Port Info: what's cached from a jack.Port, with the same attributes,
+# so it can be used where a port was (i.e. get_port_alias).
+#------------------------------------------------------------------------------
+
+class JackPortInfo(object):
+	__slots__ = ('name', 'shortname', 'aliases', 'is_audio', 'is_midi', 'is_input', 'is_output', 'is_physical')
+
+	def __init__(self, port):
+		self.name = port.name
+		self.shortname = port.shortname
+		self.aliases = port.aliases
+		self.is_audio = port.is_audio
+		self.is_midi = port.is_midi
+		self.is_input = port.is_input
+		self.is_output = port.is_output
+		self.is_physical = port.is_physical
+
+#------------------------------------------------------------------------------
+# JACK Client Service
+#
+# One long-lived JACK client for the whole webconf, instead of a new client
+# per request. It's connected lazily, without starting jackd, and reconnects
+# (at most every RETRY_INTERVAL seconds) after a JACK shutdown.
+#
+# Port listings are served from a cache, with aliases already read. JACK's
+# port registration & rename callbacks run in its notification thread, where
+# the JACK API can't be called, so they only mark the cache as dirty. It's
+# reloaded on the next get_ports call. JACK doesn't notify alias changes, so
+# the cache is reloaded anyway when it's older than MAX_AGE seconds.
+#------------------------------------------------------------------------------
+
+class JackClientService():
+	RETRY_INTERVAL = 10
+	MAX_AGE = 30
+
+	def __init__(self, name="ZynthianWebConf"):
+		self.name = name
+		self.client = None
+		self.retry_ts = 0
+		self.lock = threading.Lock()
+		self.ports = ()
+		self.dirty = True
+		self.refresh_ts = 0
+		self.refresh_count = 0
+		self.xruns = 0
+
+
+	def get_client(self):
+		if self.client is None:
+			self.connect()
+		return self.client
+
+
+	def connect(self):
+		now = time.monotonic()
+		if now < self.retry_ts:
+			return
+		self.retry_ts = now + self.RETRY_INTERVAL
+		try:
+			client = jack.Client(self.name, no_start_server=True)
+			client.set_port_registration_callback(self.on_port_registration, only_available=False)
+			client.set_port_rename_callback(self.on_port_rename, only_available=False)
+			client.set_xrun_callback(self.on_xrun)
+			client.set_shutdown_callback(self.on_shutdown)
+			client.activate()
+			self.client = client
+			self.dirty = True
+			logging.info("Connected to JACK as '{}'".format(self.name))
+		except Exception as e:
+			logging.debug("Can't connect to JACK! => {}".format(e))
+
+
+	def close(self):
+		if self.client:
+			try:
+				self.client.deactivate()
+				self.client.close()
+			except Exception as e:
+				logging.debug("Can't close JACK client => {}".format(e))
+			self.client = None
+
+
+	# JACK callbacks, called from JACK's notification thread
+
+	def on_port_registration(self, port, register):
+		self.dirty = True
+
+
+	def on_port_rename(self, port, old, new):
+		self.dirty = True
+
+
+	def on_xrun(self, delay):
+		self.xruns += 1
+
+
+	def on_shutdown(self, status, reason):
+		logging.warning("JACK server has been shutdown: {}".format(reason))
+		self.client = None
+		self.dirty = True
+
+
+	def refresh_ports(self):
+		client = self.get_client()
+		if client is None:
+			raise RuntimeError("JACK server is not available")
+		with self.lock:
+			if not self.dirty:
+				return
+			# Cleared before listing, so changes while listing dirty it again
+			self.dirty = False
+			try:
+				self.ports = tuple(JackPortInfo(port) for port in client.get_ports())
+			except Exception:
+				self.dirty = True
+				raise
+			self.refresh_ts = time.monotonic()
+			self.refresh_count += 1
+			logging.debug("JACK port cache reloaded => {} ports".format(len(self.ports)))
+
+
+	def get_ports(self, name_pattern="", is_audio=False, is_midi=False, is_input=False, is_output=False, is_physical=False):
+		"""Cached ports, as jack.Client.get_ports: name_pattern is a regular
+		expression and flags only filter when True."""
+		if self.dirty or self.client is None or time.monotonic() - self.refresh_ts > self.MAX_AGE:
+			self.dirty = True
+			self.refresh_ports()
+		regex = re.compile(name_pattern) if name_pattern else None
+		result = []
+		for port in self.ports:
+			if (is_audio and not port.is_audio) or (is_midi and not port.is_midi):
+				continue
+			if (is_input and not port.is_input) or (is_output and not port.is_output):
+				continue
+			if is_physical and not port.is_physical:
+				continue
+			if regex and not regex.search(port.name):
+				continue
+			result.append(port)
+		return result
+
+
+	def cpu_load(self):
+		client = self.get_client()
+		if client is None:
+			return None
+		return client.cpu_load()
+
+
+	def get_metrics_lines(self):
+		lines = []
+		add_header(lines, "zynthian_webconf_jack_connected", "gauge", "Webconf JACK client connected")
+		lines.append("zynthian_webconf_jack_connected {}".format(1 if self.client else 0))
+		add_header(lines, "zynthian_webconf_jack_ports", "gauge", "JACK ports in the webconf port cache")
+		lines.append("zynthian_webconf_jack_ports {}".format(len(self.ports)))
+		add_header(lines, "zynthian_webconf_jack_port_cache_reloads_total", "counter", "JACK port cache reloads")
+		lines.append("zynthian_webconf_jack_port_cache_reloads_total {}".format(self.refresh_count))
+		return lines
+
+
+jack_client = JackClientService()
+request_metrics.add_collector(jack_client.get_metrics_lines)
+
+#------------------------------------------------------------------------------
@@ -0,0 +1,164 @@
+# -*- coding: utf-8 -*-
+#********************************************************************
+# ZYNTHIAN PROJECT: Zynthian Web Configurator
+#
+# Journal Follower
+#
+# Copyright (C) 2018 Fernando Moyano <jofemodo@zynthian.org>
+#
+#********************************************************************
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License as
+# published by the Free Software Foundation; either version 2 of
+# the License, or any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# For a full copy of the GNU General Public License see the LICENSE.txt file.
+#
+#********************************************************************
+
+import json
+import time
+import asyncio
+import logging
+import tornado.ioloop
+
+from lib.command_runner import command_runner
+from lib.log_ring import LogEntry, parse_message_level
+
+#------------------------------------------------------------------------------
+# Journal Follower
+#
+# Follows the output of a long-running command (journalctl -f ...) from the
+# IOLoop, without extra threads. Lines are delivered in batches to on_lines,
+# when BATCH_SIZE lines are pending or BATCH_INTERVAL seconds after the first
+# pending line, so bursts cost one message and an idle journal costs nothing.
+#------------------------------------------------------------------------------
+
+class JournalFollower(object):
+	BATCH_INTERVAL = 0.05
+	BATCH_SIZE = 64
+	# Max line length, in bytes
+	LINE_LIMIT = 256 * 1024
+
+	def __init__(self, args, on_lines):
+		self.args = args
+		self.on_lines = on_lines
+		self.task = None
+		self.batch = []
+		self.flush_handle = None
+
+
+	def start(self):
+		self.task = command_runner.spawn_task(self.follow())
+
+
+	def stop(self):
+		if self.task:
+			self.task.cancel()
+			self.task = None
+
+
+	async def follow(self):
+		logging.info("Following {}".format(" ".join(self.args)))
+		proc = await asyncio.create_subprocess_exec(*self.args, limit=self.LINE_LIMIT,
+			stdin=asyncio.subprocess.DEVNULL, stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.STDOUT)
+		try:
+			while True:
+				try:
+					line = await proc.stdout.readline()
+				except ValueError:
+					# Line over the limit => skip it
+					continue
+				if not line:
+					break
+				self.add_line(line.decode('utf-8', 'ignore').rstrip("\n"))
+		finally:
+			self.flush()
+			if proc.returncode is None:
+				try:
+					proc.terminate()
+				except ProcessLookupError:
+					pass
+			await proc.wait()
+			logging.info("Stopped following {}".format(" ".join(self.args)))
+
+
+	def add_line(self, line):
+		self.batch.append(line)
+		if len(self.batch) >= self.BATCH_SIZE:
+			self.flush()
+		elif self.flush_handle is None:
+			self.flush_handle = tornado.ioloop.IOLoop.current().call_later(self.BATCH_INTERVAL, self.flush)
+
+
+	def flush(self):
+		if self.flush_handle is not None:
+			tornado.ioloop.IOLoop.current().remove_timeout(self.flush_handle)
+			self.flush_handle = None
+		if self.batch:
+			lines = self.batch
+			self.batch = []
+			try:
+				self.on_lines(lines)
+			except Exception as e:
+				logging.error("Can't deliver journal lines => {}".format(e))
+
+#------------------------------------------------------------------------------
+# Journal entries, from "journalctl -o json" lines
+#
+# The entry position is the (realtime, seqnum) pair encoded in the cursor,
+# so entries can be compared with a cursor sent back by a client.
+#------------------------------------------------------------------------------
+
+def get_cursor_position(cursor):
+	try:
+		fields = dict(part.split("=", 1) for part in cursor.split(";"))
+		return (int(fields['t'], 16), int(fields['i'], 16))
+	except Exception:
+		return None
+
+
+def get_message_text(message):
+	# Non UTF-8 messages are sent as byte arrays, empty ones as null
+	if isinstance(message, list):
+		return bytes(message).decode('utf-8', 'replace')
+	if message is None:
+		return ""
+	return message
+
+
+def parse_journal_entry(line):
+	try:
+		record = json.loads(line)
+		cursor = record['__CURSOR']
+	except (ValueError, KeyError):
+		# journalctl's own notices (i.e. "-- No entries --")
+		return None
+
+	try:
+		ts = int(record['__REALTIME_TIMESTAMP']) / 1000000
+	except (KeyError, ValueError):
+		ts = 0
+	position = get_cursor_position(cursor)
+	if position is None:
+		position = (int(ts * 1000000), 0)
+
+	ident = record.get('SYSLOG_IDENTIFIER') or record.get('_COMM', "")
+	message = get_message_text(record.get('MESSAGE'))
+	level, module = parse_message_level(message, record.get('PRIORITY'), ident)
+
+	# Same than journalctl's default "short" output
+	pid = record.get('_PID')
+	if pid:
+		ident = "{}[{}]".format(ident, pid)
+	text = "{} {} {}: {}".format(time.strftime("%b %d %H:%M:%S", time.localtime(ts)), record.get('_HOSTNAME', ""), ident, message)
+
+	return LogEntry(position, cursor, ts, level, module, message, text)
+
+#------------------------------------------------------------------------------
@@ -65,19 +65,19 @@ class KitConfigHandler(ZynthianConfigHandler):
 
 
 	@tornado.web.authenticated
-	def post(self):
+	async def post(self):
 		postedConfig = tornado.escape.recursive_unicode(self.request.arguments)
 		current_kit_version = os.environ.get('ZYNTHIAN_KIT_VERSION')
 
 		errors={}
 		if postedConfig['ZYNTHIAN_KIT_VERSION'][0]!=current_kit_version:
-			errors = self.configure_kit(postedConfig)
+			errors = await self.configure_kit(postedConfig)
 			self.reboot_flag = True
 
 		self.get(errors)
 
 
-	def configure_kit(self, pconfig):
+	async def configure_kit(self, pconfig):
 		kit_version = pconfig['ZYNTHIAN_KIT_VERSION'][0]
 		if kit_version!="Custom":
 			if kit_version=="V3-PRO":
@@ -114,7 +114,7 @@ class KitConfigHandler(ZynthianConfigHandler):
 				pconfig[k]=[v]
 
 		errors = self.update_config(pconfig)
-		DisplayConfigHandler.delete_fb_splash()
-		WiringConfigHandler.rebuild_zyncoder()
+		await DisplayConfigHandler.delete_fb_splash()
+		await WiringConfigHandler.rebuild_zyncoder()
 		
 		return errors
@@ -0,0 +1,382 @@
+# -*- coding: utf-8 -*-
+#********************************************************************
+# ZYNTHIAN PROJECT: Zynthian Web Configurator
+#
+# Library Index Service
+#
+# Copyright (C) 2018 Fernando Moyano <jofemodo@zynthian.org>
+#
+#********************************************************************
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License as
+# published by the Free Software Foundation; either version 2 of
+# the License, or any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# For a full copy of the GNU General Public License see the LICENSE.txt file.
+#
+#********************************************************************
+
+import os
+import errno
+import ctypes
+import struct
+import fnmatch
+import logging
+import threading
+import ctypes.util
+import tornado.ioloop
+from collections import OrderedDict
+
+#------------------------------------------------------------------------------
+# Library categories, relative to ZYNTHIAN_MY_DATA_DIR
+#------------------------------------------------------------------------------
+
+LIBRARY_CATEGORIES = OrderedDict([
+	['snapshots', { 'path': "snapshots" }],
+	['presets_lv2', { 'path': "presets/lv2", 'pattern': "manifest.ttl" }],
+	['presets_pianoteq', { 'path': "presets/pianoteq" }],
+	['presets_puredata', { 'path': "presets/puredata", 'type': 'dir', 'depth': 2 }],
+	['presets_zynaddsubfx', { 'path': "presets/zynaddsubfx", 'pattern': "*.xiz" }],
+	['soundfonts', { 'path': "soundfonts" }],
+	['captures_wav', { 'path': "capture", 'pattern': "*.wav" }],
+	['captures_ogg', { 'path': "capture", 'pattern': "*.ogg" }],
+	['captures_mp3', { 'path': "capture", 'pattern': "*.mp3" }],
+	['captures_mid', { 'path': "capture", 'pattern': "*.mid" }]
+])
+
+#------------------------------------------------------------------------------
+# Minimal inotify binding (libc)
+#------------------------------------------------------------------------------
+
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ISDIR = 0x40000000
+
+IN_WATCH_MASK = IN_CREATE | IN_DELETE | IN_MOVED_FROM | IN_MOVED_TO | IN_DELETE_SELF | IN_MOVE_SELF
+
+INOTIFY_EVENT = struct.Struct("iIII")
+
+
+class Inotify():
+
+	def __init__(self):
+		self.libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+		self.fd = self.libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+		if self.fd < 0:
+			raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+
+
+	def add_watch(self, path, mask=IN_WATCH_MASK):
+		wd = self.libc.inotify_add_watch(self.fd, os.fsencode(path), mask)
+		if wd < 0:
+			err = ctypes.get_errno()
+			raise OSError(err, "inotify_add_watch failed: {}".format(os.strerror(err)), path)
+		return wd
+
+
+	def rm_watch(self, wd):
+		self.libc.inotify_rm_watch(self.fd, wd)
+
+
+	def read_events(self):
+		try:
+			data = os.read(self.fd, 65536)
+		except BlockingIOError:
+			return
+		pos = 0
+		while pos < len(data):
+			wd, mask, cookie, nlen = INOTIFY_EVENT.unpack_from(data, pos)
+			pos += INOTIFY_EVENT.size
+			name = os.fsdecode(data[pos:pos + nlen].rstrip(b'\0'))
+			pos += nlen
+			yield wd, mask, name
+
+
+	def close(self):
+		os.close(self.fd)
+
+#------------------------------------------------------------------------------
+# Library Index
+#------------------------------------------------------------------------------
+
+class LibraryIndex():
+
+	RESCAN_INTERVAL = 60000
+
+	def __init__(self, root=None):
+		if root is None:
+			root = os.environ.get('ZYNTHIAN_MY_DATA_DIR', "/zynthian/zynthian-my-data")
+		self.root = os.path.normpath(root)
+		self.inotify = None
+		self.periodic_callback = None
+		# Queries can come from worker threads, while the IOLoop updates the index
+		self.lock = threading.RLock()
+		self.reset()
+
+
+	def reset(self):
+		# dir path => { 'dirs': set of subdir names, 'files': set of file names, 'id': (st_dev, st_ino) }
+		self.dirs = {}
+		# (st_dev, st_ino) => indexed dir path. Symlinked dirs are followed, so
+		# a directory reached twice (a loop or a second link) is indexed once.
+		self.dir_ids = {}
+		# category => set of full paths
+		self.category_paths = { cat: set() for cat in LIBRARY_CATEGORIES }
+		self.wd_paths = {}
+		self.path_wds = {}
+
+
+	def start(self):
+		try:
+			self.inotify = Inotify()
+			tornado.ioloop.IOLoop.current().add_handler(self.inotify.fd, self.on_inotify_events, tornado.ioloop.IOLoop.READ)
+		except Exception as e:
+			logging.warning("Can't use inotify, library index will be rescanned periodically => {}".format(e))
+			self.inotify = None
+
+		self.scan()
+
+		if not self.inotify:
+			self.periodic_callback = tornado.ioloop.PeriodicCallback(self.scan, self.RESCAN_INTERVAL)
+			self.periodic_callback.start()
+
+
+	def sync(self):
+		# Apply the pending inotify events now, so changes just done by a request are seen
+		if self.inotify:
+			with self.lock:
+				self.process_inotify_events()
+
+
+	def scan(self):
+		with self.lock:
+			if self.inotify:
+				for wd in list(self.wd_paths):
+					self.inotify.rm_watch(wd)
+			self.reset()
+			self.add_dir(self.root)
+		logging.info("Library index => {}".format({cat: len(paths) for cat, paths in self.category_paths.items()}))
+
+	#----------------------------------------------------------------------------
+	# Query API
+	#----------------------------------------------------------------------------
+
+	def count(self, category):
+		with self.lock:
+			return len(self.category_paths[category])
+
+
+	def get_files(self, category):
+		with self.lock:
+			return sorted(self.category_paths[category])
+
+
+	def is_indexed(self, path):
+		with self.lock:
+			return os.path.normpath(path) in self.dirs
+
+
+	def listdir(self, path):
+		# Same semantic than os.listdir, falling back to it for non-indexed paths
+		with self.lock:
+			entry = self.dirs.get(os.path.normpath(path))
+			if entry is not None:
+				return list(entry['dirs']) + list(entry['files'])
+		return os.listdir(path)
+
+
+	def isdir(self, path):
+		path = os.path.normpath(path)
+		with self.lock:
+			if path in self.dirs:
+				return True
+			parent = self.dirs.get(os.path.dirname(path))
+			if parent is not None and os.path.basename(path) in parent['files']:
+				return False
+		return os.path.isdir(path)
+
+	#----------------------------------------------------------------------------
+	# Path classification
+	#----------------------------------------------------------------------------
+
+	def get_relpath(self, path):
+		if path == self.root:
+			return ""
+		return path[len(self.root) + 1:]
+
+
+	def is_relevant_dir(self, path):
+		if path != self.root and not path.startswith(self.root + "/"):
+			return False
+		rel = self.get_relpath(path)
+		if not rel:
+			return True
+		for cat in LIBRARY_CATEGORIES.values():
+			cpath = cat['path']
+			if rel == cpath or rel.startswith(cpath + "/") or cpath.startswith(rel + "/"):
+				return True
+		return False
+
+
+	def get_categories(self, path, is_dir):
+		result = []
+		rel = self.get_relpath(path)
+		for name, cat in LIBRARY_CATEGORIES.items():
+			cpath = cat['path']
+			if not rel.startswith(cpath + "/"):
+				continue
+			if cat.get('type', 'file') == 'dir':
+				if is_dir and rel[len(cpath) + 1:].count("/") + 1 == cat['depth']:
+					result.append(name)
+			elif not is_dir:
+				pattern = cat.get('pattern')
+				if not pattern or fnmatch.fnmatchcase(os.path.basename(path), pattern):
+					result.append(name)
+		return result
+
+	#----------------------------------------------------------------------------
+	# Index maintenance
+	#----------------------------------------------------------------------------
+
+	def add_dir(self, path):
+		if path in self.dirs or not self.is_relevant_dir(path):
+			return
+		try:
+			st = os.stat(path)
+			dir_id = (st.st_dev, st.st_ino)
+			if dir_id in self.dir_ids:
+				# Still listed in its parent, but not indexed (nor watched) twice
+				logging.debug("Not indexing {}, it's already indexed as {}".format(path, self.dir_ids[dir_id]))
+				if path != self.root:
+					self.dirs[os.path.dirname(path)]['dirs'].add(os.path.basename(path))
+				return
+			names = os.listdir(path)
+		except OSError as e:
+			if e.errno != errno.ENOENT:
+				logging.warning("Can't index {} => {}".format(path, e))
+			return
+
+		self.dirs[path] = { 'dirs': set(), 'files': set(), 'id': dir_id }
+		self.dir_ids[dir_id] = path
+		if path != self.root:
+			self.dirs[os.path.dirname(path)]['dirs'].add(os.path.basename(path))
+		for cat in self.get_categories(path, True):
+			self.category_paths[cat].add(path)
+
+		if self.inotify:
+			try:
+				wd = self.inotify.add_watch(path)
+				self.wd_paths[wd] = path
+				self.path_wds[path] = wd
+			except OSError as e:
+				logging.warning("Can't watch {} => {}".format(path, e))
+
+		for name in names:
+			fpath = os.path.join(path, name)
+			# Follow symlinks, as "find -follow" does
+			if os.path.isdir(fpath):
+				self.add_dir(fpath)
+			else:
+				self.add_file(fpath)
+
+
+	def add_file(self, path):
+		parent = self.dirs.get(os.path.dirname(path))
+		if parent is None:
+			return
+		parent['files'].add(os.path.basename(path))
+		for cat in self.get_categories(path, False):
+			self.category_paths[cat].add(path)
+
+
+	def remove_file(self, path):
+		parent = self.dirs.get(os.path.dirname(path))
+		if parent is None:
+			return
+		parent['files'].discard(os.path.basename(path))
+		for cat in self.get_categories(path, False):
+			self.category_paths[cat].discard(path)
+
+
+	def remove_dir(self, path):
+		entry = self.dirs.pop(path, None)
+		if entry is None:
+			return
+		if self.dir_ids.get(entry['id']) == path:
+			del self.dir_ids[entry['id']]
+		for name in entry['dirs']:
+			self.remove_dir(os.path.join(path, name))
+		for name in entry['files']:
+			fpath = os.path.join(path, name)
+			for cat in self.get_categories(fpath, False):
+				self.category_paths[cat].discard(fpath)
+		for cat in self.get_categories(path, True):
+			self.category_paths[cat].discard(path)
+
+		parent = self.dirs.get(os.path.dirname(path))
+		if parent:
+			parent['dirs'].discard(os.path.basename(path))
+
+		wd = self.path_wds.pop(path, None)
+		if wd is not None:
+			self.wd_paths.pop(wd, None)
+			if self.inotify:
+				self.inotify.rm_watch(wd)
+
+
+	def on_inotify_events(self, fd, events):
+		with self.lock:
+			self.process_inotify_events()
+
+
+	def process_inotify_events(self):
+		for wd, mask, name in self.inotify.read_events():
+			if mask & IN_Q_OVERFLOW:
+				logging.warning("Inotify queue overflow, rescanning library ...")
+				self.scan()
+				return
+
+			dpath = self.wd_paths.get(wd)
+			if dpath is None:
+				continue
+
+			if mask & IN_IGNORED:
+				self.wd_paths.pop(wd, None)
+				if self.path_wds.get(dpath) == wd:
+					del self.path_wds[dpath]
+				continue
+
+			if mask & (IN_DELETE_SELF | IN_MOVE_SELF):
+				if dpath == self.root:
+					self.scan()
+					return
+				continue
+
+			path = os.path.join(dpath, name)
+			if mask & (IN_CREATE | IN_MOVED_TO):
+				if os.path.isdir(path):
+					self.add_dir(path)
+				else:
+					self.add_file(path)
+			elif mask & (IN_DELETE | IN_MOVED_FROM):
+				if mask & IN_ISDIR or path in self.dirs:
+					self.remove_dir(path)
+				else:
+					self.remove_file(path)
+
+
+library_index = LibraryIndex()
+
+#------------------------------------------------------------------------------
@@ -0,0 +1,254 @@
+# -*- coding: utf-8 -*-
+#********************************************************************
+# ZYNTHIAN PROJECT: Zynthian Web Configurator
+#
+# Log Ring Buffer
+#
+# Copyright (C) 2018 Fernando Moyano <jofemodo@zynthian.org>
+#
+#********************************************************************
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License as
+# published by the Free Software Foundation; either version 2 of
+# the License, or any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# For a full copy of the GNU General Public License see the LICENSE.txt file.
+#
+#********************************************************************
+
+import re
+from collections import deque
+
+#------------------------------------------------------------------------------
+# Log levels, as python's logging. Journal priorities (syslog 0-7) are mapped
+# to them when the message doesn't carry its own level.
+#------------------------------------------------------------------------------
+
+LEVELS = {
+	'DEBUG': 10,
+	'INFO': 20,
+	'WARNING': 30,
+	'ERROR': 40,
+	'CRITICAL': 50
+}
+
+PRIORITY_LEVELS = [50, 50, 50, 40, 30, 20, 20, 10]
+
+# Zynthian UI messages => "LEVEL:module.function: message"
+MESSAGE_RE = re.compile(r"(DEBUG|INFO|WARNING|ERROR|CRITICAL):([\w.]+?)(?:\.\w+)?: ")
+
+TOKEN_RE = re.compile(r"\w{2,}")
+
+MAX_REGEX_LENGTH = 256
+
+#------------------------------------------------------------------------------
+# Log Entry
+#------------------------------------------------------------------------------
+
+class LogEntry(object):
+	__slots__ = ('seq', 'position', 'cursor', 'time', 'level', 'module', 'message', 'text')
+
+	def __init__(self, position, cursor, time, level, module, message, text):
+		# Set by the ring
+		self.seq = None
+		self.position = position
+		self.cursor = cursor
+		self.time = time
+		self.level = level
+		self.module = module
+		self.message = message
+		# Formatted line, as sent to clients
+		self.text = text
+
+
+def parse_message_level(message, priority=None, module=""):
+	m = MESSAGE_RE.match(message)
+	if m:
+		return LEVELS[m.group(1)], m.group(2)
+	try:
+		return PRIORITY_LEVELS[int(priority)], module
+	except (TypeError, ValueError, IndexError):
+		return LEVELS['INFO'], module
+
+
+def get_tokens(entry):
+	return set(TOKEN_RE.findall(entry.message.lower()))
+
+#------------------------------------------------------------------------------
+# Log Filter: applied server side to the live stream, backfills and searches
+#------------------------------------------------------------------------------
+
+class LogFilter(object):
+
+	def __init__(self, level=None, modules=None, regex=None):
+		self.level = LEVELS.get(str(level).upper(), 0) if level else 0
+		if isinstance(modules, str):
+			modules = modules.split()
+		self.modules = tuple(modules) if modules else None
+		if regex:
+			if len(regex) > MAX_REGEX_LENGTH:
+				raise ValueError("Regular expression is too long")
+			try:
+				self.regex = re.compile(regex, re.IGNORECASE)
+			except re.error as e:
+				raise ValueError("Invalid regular expression: {}".format(e))
+		else:
+			self.regex = None
+
+
+	@classmethod
+	def from_dict(cls, params):
+		return cls(params.get('level'), params.get('modules'), params.get('regex'))
+
+
+	def is_empty(self):
+		return not (self.level or self.modules or self.regex)
+
+
+	def match(self, entry):
+		if entry.level < self.level:
+			return False
+		if self.modules and not entry.module.startswith(self.modules):
+			return False
+		if self.regex and not self.regex.search(entry.message):
+			return False
+		return True
+
+#------------------------------------------------------------------------------
+# Log Ring: the last "size" entries, with an inverted index from lowercase
+# word tokens to entry sequence numbers. Entries are numbered as they are
+# appended, so sequence numbers map to slots in O(1) and the index postings
+# are kept sorted, evicting from the left as the ring wraps.
+#------------------------------------------------------------------------------
+
+class LogRing(object):
+
+	def __init__(self, size):
+		self.size = size
+		self.entries = [None] * size
+		self.first_seq = 0
+		self.next_seq = 0
+		# token => deque of sequence numbers
+		self.index = {}
+
+
+	def __len__(self):
+		return self.next_seq - self.first_seq
+
+
+	def append(self, entry):
+		if len(self) == self.size:
+			self.evict()
+		entry.seq = self.next_seq
+		self.entries[entry.seq % self.size] = entry
+		self.next_seq += 1
+		for token in get_tokens(entry):
+			try:
+				self.index[token].append(entry.seq)
+			except KeyError:
+				self.index[token] = deque((entry.seq,))
+
+
+	def extend(self, entries):
+		for entry in entries:
+			self.append(entry)
+
+
+	def evict(self):
+		i = self.first_seq % self.size
+		entry = self.entries[i]
+		for token in get_tokens(entry):
+			postings = self.index[token]
+			postings.popleft()
+			if not postings:
+				del self.index[token]
+		self.entries[i] = None
+		self.first_seq += 1
+
+
+	def get(self, seq):
+		if self.first_seq <= seq < self.next_seq:
+			return self.entries[seq % self.size]
+
+
+	def get_range(self, start, stop):
+		start = max(start, self.first_seq)
+		stop = min(stop, self.next_seq)
+		return [self.entries[seq % self.size] for seq in range(start, stop)]
+
+
+	def get_last(self, count, log_filter=None):
+		result = []
+		for seq in range(self.next_seq - 1, self.first_seq - 1, -1):
+			entry = self.entries[seq % self.size]
+			if log_filter is None or log_filter.match(entry):
+				result.append(entry)
+				if len(result) >= count:
+					break
+		result.reverse()
+		return result
+
+
+	def get_after(self, position):
+		"""Entries after position and False if position is older than the ring,
+		so entries were lost."""
+		for seq in range(self.next_seq - 1, self.first_seq - 1, -1):
+			if self.entries[seq % self.size].position <= position:
+				return self.get_range(seq + 1, self.next_seq), True
+		# Empty ring => the journal backfill is coming
+		return self.get_range(self.first_seq, self.next_seq), len(self) == 0
+
+
+	def get_candidates(self, tokens):
+		"""Sequence numbers of entries containing all tokens, newest first."""
+		if not tokens:
+			return range(self.next_seq - 1, self.first_seq - 1, -1)
+		postings = []
+		for token in tokens:
+			try:
+				postings.append(self.index[token])
+			except KeyError:
+				return []
+		postings.sort(key=len)
+		others = [set(p) for p in postings[1:]]
+		return [seq for seq in reversed(postings[0]) if all(seq in p for p in others)]
+
+
+	def search(self, query, log_filter=None, context=2, limit=100):
+		"""Find the last "limit" entries containing all the words in query and
+		matching log_filter. Matches are returned in groups with "context"
+		entries around them, overlapping groups merged: [[entries, match seqs]]."""
+		tokens = set(TOKEN_RE.findall(query.lower()))
+		matches = []
+		for seq in self.get_candidates(tokens):
+			entry = self.entries[seq % self.size]
+			if log_filter is None or log_filter.match(entry):
+				matches.append(seq)
+				if len(matches) >= limit:
+					break
+		matches.reverse()
+
+		groups = []
+		start = stop = None
+		group_matches = []
+		for seq in matches:
+			if stop is not None and seq - context <= stop:
+				stop = seq + context + 1
+			else:
+				if stop is not None:
+					groups.append([self.get_range(start, stop), group_matches])
+				start = seq - context
+				stop = seq + context + 1
+				group_matches = []
+			group_matches.append(seq)
+		if stop is not None:
+			groups.append([self.get_range(start, stop), group_matches])
+		return groups
+
+#------------------------------------------------------------------------------
@@ -27,7 +27,8 @@ import crypt
 import logging
 import tornado.web
 from collections import OrderedDict
-from subprocess import check_output
+
+from lib.command_runner import get_root_crypt
 
 #------------------------------------------------------------------------------
 # Login Handler
@@ -38,10 +39,10 @@ class LoginHandler(tornado.web.RequestHandler):
 	def get(self, errors=None):
 		self.render("config.html", info={}, body="login_block.html", title="Login", config=None, errors=errors)
 
-	def post(self):
+	async def post(self):
 		input_passwd = self.get_argument("PASSWORD")
 		try:
-			root_crypt=check_output("getent shadow root", shell=True).decode("utf-8").split(':')[1]
+			root_crypt=await get_root_crypt()
 			rcparts = root_crypt.split('$')
 			input_crypt = crypt.crypt(input_passwd, "$%s$%s" % (rcparts[1], rcparts[2]))
 		except:
@@ -0,0 +1,88 @@
+# -*- coding: utf-8 -*-
+#********************************************************************
+# ZYNTHIAN PROJECT: Zynthian Web Configurator
+#
+# Prometheus Metrics Handler
+#
+# Copyright (C) 2018 Fernando Moyano <jofemodo@zynthian.org>
+#
+#********************************************************************
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License as
+# published by the Free Software Foundation; either version 2 of
+# the License, or any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# For a full copy of the GNU General Public License see the LICENSE.txt file.
+#
+#********************************************************************
+
+import os
+import hmac
+import logging
+import tornado.web
+
+from lib.request_metrics import request_metrics, add_header
+from lib.system_metrics import system_metrics
+
+#------------------------------------------------------------------------------
+# System gauges, from the last metrics snapshot
+#------------------------------------------------------------------------------
+
+SYSTEM_GAUGES = [
+	['zynthian_cpu_load_percent', 'cpu_load', "CPU load"],
+	['zynthian_dsp_load_percent', 'dsp_load', "JACK DSP load"],
+	['zynthian_temperature_celsius', 'temperature', "CPU temperature"],
+	['zynthian_jack_xruns', 'xruns', "JACK xruns since the webconf connected"]
+]
+
+def get_system_metrics_lines():
+	lines = []
+	snapshot = system_metrics.get_snapshot()
+	if not snapshot:
+		return lines
+	for name, key, help in SYSTEM_GAUGES:
+		value = snapshot.get(key)
+		if value is not None:
+			add_header(lines, name, "gauge", help)
+			lines.append("{} {}".format(name, value))
+	for key in ('ram', 'sd'):
+		info = snapshot.get(key)
+		if info and info.get('percent') is not None:
+			name = "zynthian_{}_usage_percent".format(key)
+			add_header(lines, name, "gauge", "{} usage".format(key.upper()))
+			lines.append("{} {}".format(name, info['percent']))
+	return lines
+
+request_metrics.add_collector(get_system_metrics_lines)
+
+#------------------------------------------------------------------------------
+# Metrics Handler
+#
+# Scrapers can't do the cookie login, so a bearer token can be configured
+# with ZYNTHIAN_WEBCONF_METRICS_TOKEN.
+#------------------------------------------------------------------------------
+
+class MetricsHandler(tornado.web.RequestHandler):
+
+	def get_current_user(self):
+		user = self.get_secure_cookie("user")
+		if user:
+			return user
+		token = os.environ.get('ZYNTHIAN_WEBCONF_METRICS_TOKEN')
+		auth = self.request.headers.get('Authorization', '')
+		if token and auth.startswith("Bearer ") and hmac.compare_digest(auth[7:].strip(), token):
+			return "metrics"
+
+
+	def get(self):
+		# Don't redirect to the login page, scrapers expect a status code
+		if not self.current_user:
+			raise tornado.web.HTTPError(401)
+		self.set_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+		self.write(request_metrics.get_text())
@@ -0,0 +1,333 @@
+# -*- coding: utf-8 -*-
+#********************************************************************
+# ZYNTHIAN PROJECT: Zynthian Web Configurator
+#
+# System Metrics History
+#
+# Copyright (C) 2018 Fernando Moyano <jofemodo@zynthian.org>
+#
+#********************************************************************
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License as
+# published by the Free Software Foundation; either version 2 of
+# the License, or any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# For a full copy of the GNU General Public License see the LICENSE.txt file.
+#
+#********************************************************************
+
+import os
+import math
+import struct
+import logging
+import tornado.ioloop
+from array import array
+from collections import OrderedDict
+
+from lib.system_metrics import system_metrics
+from lib.workers import workers
+
+#------------------------------------------------------------------------------
+# History configuration
+#------------------------------------------------------------------------------
+
+HISTORY_SERIES = ['cpu_load', 'temperature', 'mem_usage', 'dsp_load', 'xruns']
+
+# Tier period (seconds) => number of samples
+#  1s x 3600 => 1 hour
+# 10s x 2160 => 6 hours
+# 60s x 1440 => 24 hours
+HISTORY_TIERS = OrderedDict([
+	[1, 3600],
+	[10, 2160],
+	[60, 1440]
+])
+
+# Tiers saved to disk. The 1s tier is the biggest one and only covers the
+# last hour, so it's not worth the SD card writes: it starts empty.
+PERSISTED_TIERS = (10, 60)
+
+FILE_MAGIC = b'ZMH1'
+FILE_HEADER = struct.Struct("<4sHH")
+TIER_HEADER = struct.Struct("<IIII")
+
+#------------------------------------------------------------------------------
+# Fixed-size ring buffer: one timestamp array + one float array per series
+#------------------------------------------------------------------------------
+
+class MetricsRingBuffer():
+
+	def __init__(self, size, nseries):
+		self.size = size
+		self.pos = 0
+		self.count = 0
+		# Samples appended since created, to know if it changed
+		self.appended = 0
+		self.timestamps = array('d', [0.0]) * size
+		self.values = [array('f', [math.nan]) * size for i in range(nseries)]
+
+
+	def append(self, ts, values):
+		self.timestamps[self.pos] = ts
+		for i, v in enumerate(values):
+			self.values[i][self.pos] = v
+		self.pos = (self.pos + 1) % self.size
+		self.appended += 1
+		if self.count < self.size:
+			self.count += 1
+
+
+	def get_indexes(self, since=0):
+		# Oldest to newest
+		start = (self.pos - self.count) % self.size
+		for i in range(self.count):
+			j = (start + i) % self.size
+			if self.timestamps[j] > since:
+				yield j
+
+
+	def get_data(self, since=0):
+		idxs = list(self.get_indexes(since))
+		timestamps = array('d', (self.timestamps[j] for j in idxs))
+		values = [array('f', (series[j] for j in idxs)) for series in self.values]
+		return timestamps, values
+
+
+	def to_bytes(self):
+		data = [self.timestamps.tobytes()]
+		for series in self.values:
+			data.append(series.tobytes())
+		return b''.join(data)
+
+
+	def from_bytes(self, data):
+		self.timestamps = array('d')
+		self.timestamps.frombytes(data[0:self.size * 8])
+		offset = self.size * 8
+		for i in range(len(self.values)):
+			series = array('f')
+			series.frombytes(data[offset:offset + self.size * 4])
+			offset += self.size * 4
+			self.values[i] = series
+
+
+	def get_bytes_size(self):
+		return self.size * (8 + 4 * len(self.values))
+
+#------------------------------------------------------------------------------
+# Downsampling accumulator for a tier
+#------------------------------------------------------------------------------
+
+class MetricsAccumulator():
+
+	def __init__(self, period, nseries):
+		self.period = period
+		self.bucket = None
+		self.sums = [0.0] * nseries
+		self.counts = [0] * nseries
+
+
+	def add(self, ts, values, ring):
+		bucket = int(ts // self.period)
+		if self.bucket is not None and bucket != self.bucket:
+			self.emit(ring)
+		self.bucket = bucket
+		for i, v in enumerate(values):
+			if not math.isnan(v):
+				self.sums[i] += v
+				self.counts[i] += 1
+
+
+	def emit(self, ring):
+		values = []
+		for i in range(len(self.sums)):
+			if self.counts[i] == 0:
+				values.append(math.nan)
+			elif HISTORY_SERIES[i] == 'xruns':
+				# Xruns are summed over the bucket, everything else averaged
+				values.append(self.sums[i])
+			else:
+				values.append(self.sums[i] / self.counts[i])
+			self.sums[i] = 0.0
+			self.counts[i] = 0
+		ring.append(self.bucket * self.period, values)
+
+#------------------------------------------------------------------------------
+# Metrics History Store
+#------------------------------------------------------------------------------
+
+# The history is saved every FLUSH_INTERVAL ms, only if a persisted tier got
+# new samples, and when stopped. The file is written by the worker pool, so
+# the fsync doesn't block the IOLoop.
+
+class MetricsHistory():
+
+	FLUSH_INTERVAL = 600000
+
+	def __init__(self, fpath=None):
+		if fpath is None:
+			fpath = "%s/webconf_metrics_history.bin" % os.environ.get('ZYNTHIAN_CONFIG_DIR', "/zynthian/config")
+		self.fpath = fpath
+		self.periodic_callback = None
+		self.last_xruns = None
+		# Samples appended to the persisted tiers when last saved
+		self.flushed_stamp = None
+		self.flushing = False
+		nseries = len(HISTORY_SERIES)
+		self.rings = OrderedDict((period, MetricsRingBuffer(size, nseries)) for period, size in HISTORY_TIERS.items())
+		self.accumulators = OrderedDict((period, MetricsAccumulator(period, nseries)) for period in HISTORY_TIERS)
+
+
+	def start(self):
+		self.load()
+		system_metrics.add_listener(self.on_metrics)
+		self.flushed_stamp = self.get_flush_stamp()
+		self.periodic_callback = tornado.ioloop.PeriodicCallback(self.on_flush_timer, self.FLUSH_INTERVAL)
+		self.periodic_callback.start()
+
+
+	def stop(self):
+		system_metrics.remove_listener(self.on_metrics)
+		if self.periodic_callback:
+			self.periodic_callback.stop()
+			self.periodic_callback = None
+		# Shutting down => saved right away
+		data = self.get_flush_data()
+		if data:
+			self.write_file(data)
+
+
+	def on_metrics(self, snapshot):
+		xruns = snapshot['xruns']
+		if self.last_xruns is None or xruns < self.last_xruns:
+			xruns_delta = 0
+		else:
+			xruns_delta = xruns - self.last_xruns
+		self.last_xruns = xruns
+
+		values = [
+			snapshot['cpu_load'],
+			snapshot['temperature'],
+			snapshot['ram']['percent'],
+			snapshot['dsp_load'],
+			xruns_delta
+		]
+		values = [math.nan if v is None else float(v) for v in values]
+		ts = snapshot['timestamp']
+		for period, acc in self.accumulators.items():
+			acc.add(ts, values, self.rings[period])
+
+
+	def get_tier(self, period):
+		return self.rings[period]
+
+
+	def get_json_data(self, period, since=0):
+		timestamps, values = self.rings[period].get_data(since)
+		return {
+			'tier': period,
+			'series': HISTORY_SERIES,
+			'timestamps': list(timestamps),
+			'values': OrderedDict((name, [None if math.isnan(v) else round(v, 2) for v in values[i]]) for i, name in enumerate(HISTORY_SERIES))
+		}
+
+
+	def get_binary_data(self, period, since=0):
+		# Header: magic, period, count, nseries => float64 timestamps, float32 values per series
+		timestamps, values = self.rings[period].get_data(since)
+		data = [struct.pack("<4sIII", FILE_MAGIC, period, len(timestamps), len(values)), timestamps.tobytes()]
+		for series in values:
+			data.append(series.tobytes())
+		return b''.join(data)
+
+
+	def get_flush_stamp(self):
+		return tuple(self.rings[period].appended for period in PERSISTED_TIERS)
+
+
+	def get_flush_data(self):
+		"""File contents, or None if nothing changed since last saved"""
+		stamp = self.get_flush_stamp()
+		if stamp == self.flushed_stamp:
+			return None
+		self.flushed_stamp = stamp
+		data = [FILE_HEADER.pack(FILE_MAGIC, 1, len(HISTORY_SERIES))]
+		for period in PERSISTED_TIERS:
+			ring = self.rings[period]
+			data.append(TIER_HEADER.pack(period, ring.size, ring.pos, ring.count))
+			data.append(ring.to_bytes())
+		return b''.join(data)
+
+
+	def on_flush_timer(self):
+		if not self.flushing:
+			tornado.ioloop.IOLoop.current().spawn_callback(self.flush)
+
+
+	async def flush(self):
+		# The data is taken on the IOLoop, so the rings are not changing
+		data = self.get_flush_data()
+		if not data:
+			return
+		self.flushing = True
+		try:
+			await workers.run_in_thread(self.write_file, data)
+		finally:
+			self.flushing = False
+
+
+	def write_file(self, data):
+		tmp_fpath = self.fpath + ".tmp"
+		try:
+			with open(tmp_fpath, "wb") as f:
+				f.write(data)
+				f.flush()
+				os.fsync(f.fileno())
+			os.replace(tmp_fpath, self.fpath)
+		except Exception as e:
+			logging.error("Can't save metrics history '{}': {}".format(self.fpath, e))
+			# Try again next time
+			self.flushed_stamp = None
+
+
+	def load(self):
+		try:
+			with open(self.fpath, "rb") as f:
+				data = f.read()
+		except FileNotFoundError:
+			return
+		except Exception as e:
+			logging.warning("Can't load metrics history '{}': {}".format(self.fpath, e))
+			return
+
+		try:
+			magic, version, nseries = FILE_HEADER.unpack_from(data, 0)
+			if magic != FILE_MAGIC or nseries != len(HISTORY_SERIES):
+				raise ValueError("unknown format")
+			offset = FILE_HEADER.size
+			while offset < len(data):
+				period, size, pos, count = TIER_HEADER.unpack_from(data, offset)
+				offset += TIER_HEADER.size
+				ring = self.rings.get(period)
+				if ring is None or ring.size != size:
+					raise ValueError("tier layout has changed")
+				nbytes = ring.get_bytes_size()
+				ring.from_bytes(data[offset:offset + nbytes])
+				ring.pos = pos
+				ring.count = count
+				offset += nbytes
+		except Exception as e:
+			logging.warning("Discarding metrics history '{}': {}".format(self.fpath, e))
+			nseries = len(HISTORY_SERIES)
+			self.rings = OrderedDict((period, MetricsRingBuffer(size, nseries)) for period, size in HISTORY_TIERS.items())
+
+
+metrics_history = MetricsHistory()
+
+#------------------------------------------------------------------------------
@@ -0,0 +1,56 @@
+# -*- coding: utf-8 -*-
+#********************************************************************
+# ZYNTHIAN PROJECT: Zynthian Web Configurator
+#
+# System Metrics History Handler
+#
+# Copyright (C) 2018 Fernando Moyano <jofemodo@zynthian.org>
+#
+#********************************************************************
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License as
+# published by the Free Software Foundation; either version 2 of
+# the License, or any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# For a full copy of the GNU General Public License see the LICENSE.txt file.
+#
+#********************************************************************
+
+import logging
+import tornado.web
+
+from lib.metrics_history import metrics_history, HISTORY_TIERS
+
+#------------------------------------------------------------------------------
+# Metrics History Handler
+#------------------------------------------------------------------------------
+
+class MetricsHistoryHandler(tornado.web.RequestHandler):
+
+	def get_current_user(self):
+		return self.get_secure_cookie("user")
+
+
+	@tornado.web.authenticated
+	def get(self):
+		try:
+			period = int(self.get_argument('tier', 1))
+			since = float(self.get_argument('since', 0))
+			if period not in HISTORY_TIERS:
+				raise ValueError("Unknown tier '{}'. Valid tiers: {}".format(period, list(HISTORY_TIERS.keys())))
+		except ValueError as e:
+			self.set_status(400)
+			self.write({'errors': str(e)})
+			return
+
+		if self.get_argument('format', 'json') == 'bin':
+			self.set_header('Content-Type', 'application/octet-stream')
+			self.write(metrics_history.get_binary_data(period, since))
+		else:
+			self.write(metrics_history.get_json_data(period, since))
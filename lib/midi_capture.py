@@ -0,0 +1,219 @@
+# -*- coding: utf-8 -*-
+#********************************************************************
+# ZYNTHIAN PROJECT: Zynthian Web Configurator
+#
+# MIDI Capture Ring
+#
+# Copyright (C) 2018 Fernando Moyano <jofemodo@zynthian.org>
+#
+#********************************************************************
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License as
+# published by the Free Software Foundation; either version 2 of
+# the License, or any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# For a full copy of the GNU General Public License see the LICENSE.txt file.
+#
+#********************************************************************
+
+import os
+import struct
+import threading
+
+#------------------------------------------------------------------------------
+# MIDI Capture Ring: the last "seconds" of raw MIDI events, in a preallocated
+# bytearray of "size" bytes, whatever limit is reached first. It's written
+# from the MIDI thread, so there is no allocation per event: records are
+# copied into the ring, wrapping around the end, and the oldest ones are
+# evicted to make room.
+#
+# Records are packed as:
+#  + double => timestamp (time.perf_counter)
+#  + uint16 LE => length of the MIDI message
+#  + MIDI message bytes
+#------------------------------------------------------------------------------
+
+RECORD_HEADER = struct.Struct('<dH')
+
+class MidiCaptureRing(object):
+	SECONDS = float(os.environ.get('ZYNTHIAN_WEBCONF_MIDI_CAPTURE_SECONDS', 60))
+	SIZE = int(os.environ.get('ZYNTHIAN_WEBCONF_MIDI_CAPTURE_SIZE', 512 * 1024))
+
+	def __init__(self, seconds=SECONDS, size=SIZE):
+		self.seconds = seconds
+		self.size = size
+		self.buffer = bytearray(size)
+		self.view = memoryview(self.buffer)
+		# Header scratch, for records wrapping around the end
+		self.header = bytearray(RECORD_HEADER.size)
+		self.header_view = memoryview(self.header)
+		self.lock = threading.Lock()
+		# Oldest record & write positions, bytes in use
+		self.tail = 0
+		self.head = 0
+		self.used = 0
+		self.dropped = 0
+
+
+	def copy_in(self, pos, data):
+		n = len(data)
+		if pos + n <= self.size:
+			self.buffer[pos:pos + n] = data
+		else:
+			first = self.size - pos
+			self.buffer[pos:] = data[:first]
+			self.buffer[:n - first] = data[first:]
+		return (pos + n) % self.size
+
+
+	def read_header(self, pos):
+		n = RECORD_HEADER.size
+		if pos + n <= self.size:
+			return RECORD_HEADER.unpack_from(self.buffer, pos)
+		first = self.size - pos
+		self.header_view[:first] = self.view[pos:]
+		self.header_view[first:] = self.view[:n - first]
+		return RECORD_HEADER.unpack_from(self.header)
+
+
+	def evict(self):
+		ts, n = self.read_header(self.tail)
+		n += RECORD_HEADER.size
+		self.tail = (self.tail + n) % self.size
+		self.used -= n
+
+
+	# Called from the MIDI thread
+	def add_event(self, ts, message):
+		n = RECORD_HEADER.size + len(message)
+		with self.lock:
+			if n > self.size:
+				self.dropped += 1
+				return
+			while self.used and (self.used + n > self.size or self.read_header(self.tail)[0] < ts - self.seconds):
+				self.evict()
+			RECORD_HEADER.pack_into(self.header, 0, ts, len(message))
+			pos = self.copy_in(self.head, self.header_view)
+			self.head = self.copy_in(pos, message)
+			self.used += n
+
+
+	def get_data(self):
+		"""Copy of the records, oldest first. The MIDI thread is only held for
+		the copy, records are parsed with get_capture_events."""
+		with self.lock:
+			if self.tail + self.used <= self.size:
+				return bytes(self.view[self.tail:self.tail + self.used])
+			return bytes(self.view[self.tail:]) + bytes(self.view[:self.head])
+
+
+def get_capture_events(data, since=None):
+	"""Events newer than "since" in a ring copy, as a list of (timestamp, message bytes)"""
+	events = []
+	pos = 0
+	while pos < len(data):
+		ts, n = RECORD_HEADER.unpack_from(data, pos)
+		pos += RECORD_HEADER.size
+		if since is None or ts >= since:
+			events.append((ts, data[pos:pos + n]))
+		pos += n
+	return events
+
+#------------------------------------------------------------------------------
+# Standard MIDI File writer
+#
+# Tracks are written with a fixed tempo of 120 BPM & TICKS_PER_BEAT, so a
+# tick is ~0.5ms. Channel messages & sysex are written as they came. Other
+# system messages (clock, transport, active sensing ...) are not allowed in
+# SMF tracks and are skipped.
+#------------------------------------------------------------------------------
+
+TICKS_PER_BEAT = 960
+TEMPO = 500000
+
+# Data bytes of channel messages, by status high nibble
+CHANNEL_MESSAGE_DATA = [2, 2, 2, 2, 1, 1, 2]
+
+
+def encode_varlen(value):
+	result = bytearray([value & 0x7F])
+	value >>= 7
+	while value:
+		result.insert(0, 0x80 | (value & 0x7F))
+		value >>= 7
+	return result
+
+
+def encode_track_event(delta, message):
+	"""SMF track event for a raw MIDI message, or None if it can't be stored."""
+	status = message[0]
+	if 0x80 <= status < 0xF0:
+		if len(message) != CHANNEL_MESSAGE_DATA[(status >> 4) - 8] + 1:
+			return None
+		return encode_varlen(delta) + message
+	elif status == 0xF0:
+		data = message[1:]
+		return encode_varlen(delta) + b'\xF0' + encode_varlen(len(data)) + data
+	return None
+
+
+def encode_track(events, start_time, name=None, tempo=None):
+	data = bytearray()
+	if name:
+		name = name.encode('utf-8')
+		data += b'\x00\xFF\x03' + encode_varlen(len(name)) + name
+	if tempo:
+		data += b'\x00\xFF\x51\x03' + tempo.to_bytes(3, 'big')
+	ticks_per_second = TICKS_PER_BEAT * 1000000 / TEMPO
+	last_tick = 0
+	count = 0
+	for ts, message in events:
+		tick = max(last_tick, int(round((ts - start_time) * ticks_per_second)))
+		event = encode_track_event(tick - last_tick, message)
+		if event:
+			data += event
+			last_tick = tick
+			count += 1
+	data += b'\x00\xFF\x2F\x00'
+	return b'MTrk' + struct.pack('>I', len(data)) + data, count
+
+
+def write_midi_file(fpath, tracks):
+	"""Write a format 1 SMF: a tempo track and a track for every (name, events)
+	in tracks. Times are relative to the first event. Return the written event
+	count."""
+	start_time = min((events[0][0] for name, events in tracks if events), default=0.0)
+	chunks = [encode_track((), start_time, tempo=TEMPO)[0]]
+	count = 0
+	for name, events in tracks:
+		chunk, n = encode_track(events, start_time, name)
+		chunks.append(chunk)
+		count += n
+	header = b'MThd' + struct.pack('>IHHH', 6, 1, len(chunks), TICKS_PER_BEAT)
+
+	# Write to a temporary file, so a partial file is never listed
+	tmp_fpath = fpath + ".tmp"
+	with open(tmp_fpath, "wb") as f:
+		f.write(header)
+		for chunk in chunks:
+			f.write(chunk)
+	os.replace(tmp_fpath, fpath)
+	return count
+
+
+def save_midi_capture(fpath, captures, since):
+	"""Write ring copies [(track name, data)] since "since" as an SMF. Blocking,
+	so it's run by the worker pool."""
+	tracks = [(name, get_capture_events(data, since)) for name, data in captures]
+	if not any(events for name, events in tracks):
+		raise ValueError("No MIDI events captured")
+	os.makedirs(os.path.dirname(fpath), exist_ok=True)
+	return write_midi_file(fpath, tracks)
+
+#------------------------------------------------------------------------------
@@ -23,9 +23,8 @@
 #********************************************************************
 
 import os
-import re
 import sys
-import jack
+import time
 import logging
 import tornado.web
 from collections import OrderedDict
@@ -33,6 +32,11 @@ from subprocess import check_output
 from shutil import copyfile
 
 from lib.zynthian_config_handler import ZynthianConfigHandler
+from lib.config_cache import config_cache
+from lib.jack_client import jack_client
+from lib.midi_profiles import midi_profiles
+from lib.midi_filter_rules import get_rule_lines, get_script_rules, get_rule_spec, benchmark_rules
+from lib.workers import workers
 
 import zynconf
 from zyngine.zynthian_midi_filter import MidiFilterScript
@@ -47,8 +51,8 @@ from zyngine.zynthian_midi_filter import MidiFilterScript
 def get_ports_config(current_midi_ports=""):
 	midi_ports = { 'IN': [], 'OUT': [], 'FB': [] }
 	try:
-		#Get MIDI ports list from jack
-		client = jack.Client("ZynthianWebConf")
+		#Get MIDI ports list from the jack port cache
+		client = jack_client
 		#For jack, output/input convention are reversed => output=readable, input=writable
 		midi_in_ports = client.get_ports(is_midi=True, is_physical=True, is_output=True)
 		midi_out_ports = client.get_ports(is_midi=True, is_physical=True, is_input=True)
@@ -105,6 +109,30 @@ def get_ports_config(current_midi_ports=""):
 	return midi_ports
 
 
+def check_filter_rules(rules):
+	"""Parse the rules one line at a time, so all the errors are found, not
+	only the first one. Return the errors [{line, rule, error}], the specs of
+	the parsed rules, for benchmark_rules, and the parsed rules that can't be
+	benchmarked [{line, rule, error}]."""
+	errors = []
+	specs = []
+	skipped = []
+	for n, line in get_rule_lines(rules):
+		try:
+			t0 = time.perf_counter()
+			script = MidiFilterScript(line, False)
+			parse_time = time.perf_counter() - t0
+		except Exception as e:
+			errors.append({'line': n, 'rule': line, 'error': str(e)})
+			continue
+		for rule in get_script_rules(script):
+			try:
+				specs.append(get_rule_spec(n, line, rule, parse_time))
+			except ValueError as e:
+				skipped.append({'line': n, 'rule': line, 'error': str(e)})
+	return errors, specs, skipped
+
+
 def get_port_alias(midi_port):
 	try:
 		alias=midi_port.aliases[0]
@@ -124,7 +152,7 @@ def get_port_alias(midi_port):
 #------------------------------------------------------------------------------
 
 class MidiConfigHandler(ZynthianConfigHandler):
-	PROFILES_DIRECTORY = "%s/midi-profiles" % os.environ.get("ZYNTHIAN_CONFIG_DIR")
+	PROFILES_DIRECTORY = midi_profiles.directory
 	DEFAULT_MIDI_PORTS = "DISABLED_IN=\nENABLED_OUT=ttymidi:MIDI_out\nENABLED_FB="
 
 	midi_channels =  OrderedDict([
@@ -242,8 +270,8 @@ class MidiConfigHandler(ZynthianConfigHandler):
 	])
 
 
-	def prepare(self):
-		super().prepare()
+	async def prepare(self):
+		await super().prepare()
 		self.current_midi_profile_script = None
 		self.load_midi_profile_directories()
 
@@ -415,6 +443,15 @@ class MidiConfigHandler(ZynthianConfigHandler):
 				'addPanelConfig': mfr_config,
 				'advanced': True
 			}],
+			['zynthian_midi_filter_rules_check', {
+				'type': 'button',
+				'title': 'Check & Benchmark Rules',
+				'button_type': 'button',
+				'class': 'btn-theme',
+				'icon' : 'fa fa-tachometer',
+				'script_file': 'midi_filter_rules_check.js',
+				'advanced': True
+			}],
 			['ZYNTHIAN_MIDI_PORTS', {
 				'type': 'textarea',
 				'title': 'MIDI Ports',
@@ -460,11 +497,11 @@ class MidiConfigHandler(ZynthianConfigHandler):
 				try:
 					#create file as copy of default:
 					zynconf.get_midi_config_fpath(self.current_midi_profile_script)
-					zynconf.update_midi_profile(escaped_request_arguments, self.current_midi_profile_script)
+					midi_profiles.update_profile(escaped_request_arguments, self.current_midi_profile_script)
 					mode = os.stat(self.current_midi_profile_script).st_mode
 					mode |= (mode & 0o444) >> 2	# copy R bits to X
 					os.chmod(self.current_midi_profile_script, mode)
-					errors = zynconf.save_config({'ZYNTHIAN_SCRIPT_MIDI_PROFILE':self.current_midi_profile_script})
+					errors = config_cache.save_config({'ZYNTHIAN_SCRIPT_MIDI_PROFILE':self.current_midi_profile_script})
 					self.load_midi_profile_directories()
 				except:
 					errors['zynthian_midi_profile_new_script_name'] = "Can't create new profile!"
@@ -474,7 +511,7 @@ class MidiConfigHandler(ZynthianConfigHandler):
 				if self.current_midi_profile_script.startswith(self.PROFILES_DIRECTORY):
 					os.remove(self.current_midi_profile_script)
 					self.current_midi_profile_script = "{}/default.sh".format(self.PROFILES_DIRECTORY)
-					errors = zynconf.save_config({'ZYNTHIAN_SCRIPT_MIDI_PROFILE':self.current_midi_profile_script})
+					errors = config_cache.save_config({'ZYNTHIAN_SCRIPT_MIDI_PROFILE':self.current_midi_profile_script})
 					self.load_midi_profile_directories()
 				else:
 					errors['zynthian_midi_profile_delete_script'] = 'You can only delete user profiles!'
@@ -490,7 +527,7 @@ class MidiConfigHandler(ZynthianConfigHandler):
 					for k in updateParameters:
 						del escaped_request_arguments[k]
 
-					zynconf.update_midi_profile(escaped_request_arguments, self.current_midi_profile_script)
+					midi_profiles.update_profile(escaped_request_arguments, self.current_midi_profile_script)
 					errors = self.update_config(escaped_request_arguments)
 				else:
 					errors['zynthian_midi_profile_new_script_name'] = 'No profile name!'
@@ -505,7 +542,7 @@ class MidiConfigHandler(ZynthianConfigHandler):
 
 	def load_midi_profile_directories(self):
 		#Get profiles list
-		self.midi_profile_scripts = ["%s/%s" % (self.PROFILES_DIRECTORY, x) for x in os.listdir(self.PROFILES_DIRECTORY)]
+		self.midi_profile_scripts = midi_profiles.get_scripts()
 		#If list is empty ...
 		if len(self.midi_profile_scripts)==0:
 			self.current_midi_profile_script = "%s/default.sh" % self.PROFILES_DIRECTORY
@@ -529,36 +566,19 @@ class MidiConfigHandler(ZynthianConfigHandler):
 
 	def validate_filter_rules(self, escaped_request_arguments):
 		if escaped_request_arguments['ZYNTHIAN_MIDI_FILTER_RULES'][0]:
-			newLine = escaped_request_arguments['ZYNTHIAN_MIDI_FILTER_RULES'][0]
-			try:
-				mfs = MidiFilterScript(newLine, False)
-			except Exception as e:
-				return "ERROR parsing MIDI filter rule: " + str(e)
+			errors = check_filter_rules(escaped_request_arguments['ZYNTHIAN_MIDI_FILTER_RULES'][0])[0]
+			if errors:
+				return "ERROR parsing MIDI filter rules: " + "; ".join("line {}: {}".format(e['line'], e['error']) for e in errors)
 
 
 	def load_midi_profiles(self):
-		self.midi_profile_presets=OrderedDict([])
-		p = re.compile("export (\w*)=\"(.*)\"")
-		invalidFiles = []
-		for midi_profile_script in self.midi_profile_scripts:
-			#logging.info(midi_profile_script)
-			profile_values = {}
-			try:
-				with open(midi_profile_script) as f:
-					for line in f:
-						if line[0]=='#':
-							continue
-						m = p.match(line)
-						if m:
-							profile_values[m.group(1)] = m.group(2)
-				self.midi_profile_presets[midi_profile_script] = profile_values
-				logging.debug("LOADED MIDI PROFILE %s" % midi_profile_script)
-			except:
-				invalidFiles.append(midi_profile_script)
+		#Parsed profiles are cached until the script changes
+		self.midi_profile_presets, invalidFiles = midi_profiles.get_profiles()
 
 		for midi_profile_script in invalidFiles:
 			logging.warning("Invalid profile will be ignored: " + midi_profile_script)
-			self.midi_profile_scripts.remove(midi_profile_script)
+			if midi_profile_script in self.midi_profile_scripts:
+				self.midi_profile_scripts.remove(midi_profile_script)
 
 		if self.current_midi_profile_script:
 			self.midi_envs = self.midi_profile_presets[self.current_midi_profile_script]
@@ -573,3 +593,31 @@ class MidiConfigHandler(ZynthianConfigHandler):
 		else:
 			return default
 
+
+#------------------------------------------------------------------------------
+# Midi Filter Rules Handler: checks the rules line by line and benchmarks them,
+# before they are saved & loaded into the router.
+#------------------------------------------------------------------------------
+
+class MidiFilterRulesHandler(tornado.web.RequestHandler):
+
+	def get_current_user(self):
+		return self.get_secure_cookie("user")
+
+
+	@tornado.web.authenticated
+	async def post(self):
+		rules = self.get_argument('rules', '')
+		result = {}
+		try:
+			errors, specs, skipped = await workers.run_in_thread(check_filter_rules, rules)
+			result['errors'] = errors
+			# Only benchmarked when asked for
+			benchmark_events = int(self.get_argument('benchmark', 0) or 0)
+			if benchmark_events > 0:
+				result['benchmark'] = await workers.run_cpu_bound(benchmark_rules, specs, benchmark_events)
+				result['benchmark']['errors'] = skipped
+		except Exception as e:
+			logging.error("Can't check MIDI filter rules => {}".format(e))
+			result['error'] = str(e)
+		self.write(result)
@@ -0,0 +1,239 @@
+# -*- coding: utf-8 -*-
+#********************************************************************
+# ZYNTHIAN PROJECT: Zynthian Web Configurator
+#
+# MIDI Filter Rules Validation & Benchmark
+#
+# Copyright (C) 2018 Fernando Moyano <jofemodo@zynthian.org>
+#
+#********************************************************************
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License as
+# published by the Free Software Foundation; either version 2 of
+# the License, or any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# For a full copy of the GNU General Public License see the LICENSE.txt file.
+#
+#********************************************************************
+
+import time
+import random
+from array import array
+
+#------------------------------------------------------------------------------
+# The rules are parsed by the router's own parser (MidiFilterScript). Parsed
+# rules are read into plain "rule specs", the events each one applies to as
+# lookup table indexes, so they can be benchmarked in a worker process:
+#
+#  {line, rule, command, parse_us, indexes, targets}
+#
+# The index of a channel message is ((status - 0x80) << 7) | data1, so
+# matching an event is one table lookup.
+#------------------------------------------------------------------------------
+
+RULE_COMMANDS = ('IGNORE', 'MAP', 'TOGGLE', 'CLEAN')
+
+EVENT_TYPES = {
+	'NOFF': 0x80,
+	'NON': 0x90,
+	'KP': 0xA0,
+	'CC': 0xB0,
+	'PC': 0xC0,
+	'CP': 0xD0,
+	'PB': 0xE0
+}
+
+ALL_CHANNELS = tuple(range(16))
+ALL_NUMBERS = tuple(range(128))
+
+BENCHMARK_EVENTS = 10000
+MAX_BENCHMARK_EVENTS = 1000000
+
+
+def get_script_rules(script):
+	"""Parsed rules of a MidiFilterScript"""
+	rules = getattr(script, 'rules', None) or []
+	if hasattr(rules, 'values'):
+		rules = rules.values()
+	return list(rules)
+
+
+def get_status(ev_type):
+	"""Status byte (channel 0) of a parsed event type: a name, a status
+	nibble (0x9) or a status byte (0x90)"""
+	if isinstance(ev_type, str):
+		try:
+			return EVENT_TYPES[ev_type.upper()]
+		except KeyError:
+			raise ValueError("Unknown event type '{}'".format(ev_type))
+	ev_type = int(ev_type)
+	if ev_type < 0x10:
+		ev_type <<= 4
+	if ev_type not in EVENT_TYPES.values():
+		raise ValueError("Can't benchmark event type {:#x}".format(ev_type))
+	return ev_type
+
+
+def get_values(values, all_values):
+	"""Channels or numbers of parsed rule arguments. None means all of them."""
+	if values is None:
+		return all_values
+	if isinstance(values, int):
+		return (values,)
+	values = tuple(int(v) for v in values)
+	return values or all_values
+
+
+def match_targets(sources, targets, what):
+	"""Destination for each source value: the same value (no targets), a
+	single target or the target at the same position."""
+	if targets is None:
+		return sources
+	if len(targets) == 1:
+		return targets * len(sources)
+	if len(targets) == len(sources):
+		return targets
+	raise ValueError("Can't map {} {} to {} {}".format(len(sources), what, len(targets), what))
+
+
+def get_rule_spec(line, text, rule, parse_time):
+	"""Rule spec from a parsed MidiFilterRule. Raise ValueError if the parsed
+	rule can't be read (i.e. a rule kind the benchmark doesn't know)."""
+	command = str(getattr(rule, 'rule_type', None) or text.split()[0]).upper()
+	if command not in RULE_COMMANDS:
+		raise ValueError("Can't benchmark {} rules".format(command))
+	args = getattr(rule, 'args', None)
+	if not args:
+		raise ValueError("Can't read the parsed rule arguments")
+	try:
+		src = args[0]
+		status = get_status(src.ev_type)
+		channels = get_values(src.ev_chan, ALL_CHANNELS)
+		# Unnumbered events match any data1 value
+		numbers = get_values(getattr(src, 'ev_num', None), ALL_NUMBERS)
+		targets = None
+		if command == 'MAP':
+			dst = args[1]
+			dst_status = get_status(dst.ev_type)
+			dst_channels = match_targets(channels, None if dst.ev_chan is None else get_values(dst.ev_chan, ALL_CHANNELS), "channels")
+			dst_num = getattr(dst, 'ev_num', None)
+			dst_numbers = match_targets(numbers, None if dst_num is None else get_values(dst_num, ALL_NUMBERS), "numbers")
+			# (status << 8) | data1, as it would be sent
+			targets = [((dst_status + chan) << 8) | num for chan in dst_channels for num in dst_numbers]
+	except (AttributeError, IndexError, TypeError) as e:
+		raise ValueError("Can't read the parsed rule => {}".format(e))
+	return {
+		'line': line,
+		'rule': text,
+		'command': command,
+		'parse_us': round(parse_time * 1000000, 1),
+		'indexes': [((status + chan - 0x80) << 7) | num for chan in channels for num in numbers],
+		'targets': targets
+	}
+
+#------------------------------------------------------------------------------
+# Rule set: the rule specs compiled into lookup tables, 7 channel message
+# types x 16 channels x 128 numbers. Later rules override earlier ones.
+#------------------------------------------------------------------------------
+
+class MidiFilterRuleSet(object):
+	TABLE_SIZE = 7 * 16 * 128
+
+	def __init__(self, specs):
+		self.specs = specs
+		# Rule number + 1 for each event, 0 = no rule
+		self.rule_table = array('H', [0]) * self.TABLE_SIZE
+		# Mapped event, -1 = not mapped
+		self.map_table = array('l', [-1]) * self.TABLE_SIZE
+		for i, spec in enumerate(specs):
+			if spec['command'] == 'CLEAN':
+				for index in spec['indexes']:
+					self.rule_table[index] = 0
+					self.map_table[index] = -1
+			elif spec['command'] == 'MAP':
+				for index, target in zip(spec['indexes'], spec['targets']):
+					self.rule_table[index] = i + 1
+					self.map_table[index] = target
+			else:
+				for index in spec['indexes']:
+					self.rule_table[index] = i + 1
+					self.map_table[index] = -1
+
+#------------------------------------------------------------------------------
+# Validation & Benchmark
+#------------------------------------------------------------------------------
+
+def get_rule_lines(text):
+	"""(line number, rule) for every rule in a rules text"""
+	for n, line in enumerate(text.replace("\\n", "\n").splitlines(), 1):
+		line = line.strip()
+		if line and not line.startswith("#"):
+			yield n, line
+
+
+def get_benchmark_stream(count, seed=0):
+	"""Random channel messages, as (status bytes, data1 bytes)"""
+	rng = random.Random(seed)
+	# Random bytes => channel message status (7 types x 16 channels) & data1
+	status_map = bytes(0x80 | ((b % 7) << 4) | (b >> 4) for b in range(256))
+	data_map = bytes(b & 0x7F for b in range(256))
+	statuses = rng.getrandbits(8 * count).to_bytes(count, 'little').translate(status_map)
+	data1 = rng.getrandbits(8 * count).to_bytes(count, 'little').translate(data_map)
+	return statuses, data1
+
+
+def route_events(rule_table, statuses, data1, hits):
+	for status, num in zip(statuses, data1):
+		rule = rule_table[((status - 0x80) << 7) | num]
+		if rule:
+			hits[rule] += 1
+
+
+def benchmark_rules(specs, count=BENCHMARK_EVENTS, seed=0):
+	"""Compile the rule specs and route a synthetic stream of "count" random
+	channel events through them. It's run by the worker pool, so it must be
+	picklable => module level.
+
+	The routing cost is one lookup per event whatever the rules, so what's
+	reported is what depends on the rules: the parse & compile cost of every
+	rule and the share of the stream each one catches."""
+	count = max(1, min(int(count), MAX_BENCHMARK_EVENTS))
+	t0 = time.perf_counter()
+	rule_set = MidiFilterRuleSet(specs)
+	compile_time = time.perf_counter() - t0
+	statuses, data1 = get_benchmark_stream(count, seed)
+
+	hits = [0] * (len(specs) + 1)
+	route_events(rule_set.rule_table, statuses, data1, hits)
+
+	rules = []
+	for spec, h in zip(specs, hits[1:]):
+		rules.append({
+			'line': spec['line'],
+			'rule': spec['rule'],
+			'parse_us': spec['parse_us'],
+			'events': len(spec['indexes']),
+			'hits': h,
+			'share': round(100.0 * h / count, 2)
+		})
+	ignored = sum(r['hits'] for r, spec in zip(rules, specs) if spec['command'] == 'IGNORE')
+	return {
+		'events': count,
+		# Parse time is per line, a line may hold several rules
+		'parse_us': round(sum({spec['line']: spec['parse_us'] for spec in specs}.values()), 1),
+		'compile_ms': round(compile_time * 1000, 3),
+		'matched': sum(hits),
+		'ignored': ignored,
+		'mapped': sum(r['hits'] for r, spec in zip(rules, specs) if spec['command'] == 'MAP'),
+		'toggled': sum(r['hits'] for r, spec in zip(rules, specs) if spec['command'] == 'TOGGLE'),
+		'passed': count - ignored,
+		'rules': rules
+	}
+
+#------------------------------------------------------------------------------
@@ -23,15 +23,20 @@
 #********************************************************************
 
 import os
+import json
+import time
 import logging
 import tornado.web
-import jsonpickle
-import mido
-import asyncio
+import tornado.ioloop
 from collections import OrderedDict
-from lib.tail_thread import TailThread
 from lib.zynthian_config_handler import ZynthianBasicHandler
-from lib.zynthian_websocket_handler import ZynthianWebSocketMessageHandler, ZynthianWebSocketMessage
+from lib.zynthian_websocket_handler import ZynthianWebSocketMessageHandler, SEND_DROP_OLDEST, SEND_FIFO, SEND_LATEST
+from lib.websocket_broker import broker, TopicProducer
+from lib.midi_monitor import MidiFilter, MidiMonitorSink, DEFAULT_MIDI_FILTER, open_midi_input, close_midi_input
+from lib.midi_stats import MidiStats
+from lib.midi_capture import MidiCaptureRing, save_midi_capture
+from lib.command_runner import command_runner
+from lib.workers import workers
 from lib.midi_config_handler import get_ports_config
 
 #------------------------------------------------------------------------------
@@ -100,37 +105,174 @@ class MidiLogHandler(ZynthianBasicHandler):
 		return midi_in_ports
 
 
+#------------------------------------------------------------------------------
+# MIDI Port Producer: one input port per MIDI port name, shared by all viewers.
+# Topics are "midi/<port name>". Events are filtered in the MIDI thread into
+# one sink per distinct subscriber filter, and sent as compact frames tagged
+# with the port name, FRAME_RATE times per second (see lib/midi_monitor.py)
+#------------------------------------------------------------------------------
+
+class MidiPortProducer(TopicProducer):
+	FRAME_RATE = int(os.environ.get('ZYNTHIAN_WEBCONF_MIDI_MONITOR_RATE', 30))
+	# Seconds
+	STATS_INTERVAL = 1.0
+
+	def start(self):
+		logging.info("start midi logging on {}".format(self.name))
+		# filter key => sink
+		self.sinks = {}
+		# Read from the MIDI thread => replaced, never modified
+		self.sink_list = ()
+		# Statistics are always collected, snapshots are sent to stats_subscribers
+		self.stats = MidiStats()
+		self.stats_snapshot = None
+		self.stats_subscribers = set()
+		# Last seconds of raw MIDI, for saving them on demand
+		self.capture = MidiCaptureRing() if MidiCaptureRing.SECONDS > 0 else None
+		self.start_time = time.perf_counter()
+		self.midi_in = open_midi_input(self.name, self.on_midi_in)
+		self.frame_callback = tornado.ioloop.PeriodicCallback(self.send_frames, 1000 / max(1, self.FRAME_RATE))
+		self.frame_callback.start()
+		self.stats_callback = tornado.ioloop.PeriodicCallback(self.send_stats, 1000 * self.STATS_INTERVAL)
+		self.stats_callback.start()
+
+
+	def stop(self):
+		logging.info("stop midi logging on {}".format(self.name))
+		self.frame_callback.stop()
+		self.stats_callback.stop()
+		close_midi_input(self.midi_in)
+
+
+	# Called from the rtmidi thread
+	def on_midi_in(self, event, data=None):
+		ts = time.perf_counter()
+		message = event[0]
+		self.stats.add_event(ts, message)
+		if self.capture:
+			self.capture.add_event(ts, message)
+		for sink in self.sink_list:
+			sink.add_event(ts, message)
+
+
+	def send_frames(self):
+		for sink in self.sink_list:
+			frame = sink.buffer.get_frame(self.start_time)
+			if frame:
+				frame['p'] = self.name
+				for subscriber in list(sink.subscribers):
+					subscriber.on_publish(self.topic, frame)
+
+
+	def send_stats(self):
+		self.stats_snapshot = self.stats.get_snapshot()
+		self.stats_snapshot['port'] = self.name
+		for subscriber in list(self.stats_subscribers):
+			subscriber.on_publish(self.topic, self.stats_snapshot)
+
+
+	def set_filter(self, subscriber, midi_filter):
+		self.remove_subscriber(subscriber)
+		sink = self.sinks.get(midi_filter.key)
+		if sink is None:
+			sink = MidiMonitorSink(midi_filter)
+			self.sinks[midi_filter.key] = sink
+			self.sink_list = tuple(self.sinks.values())
+		sink.subscribers.add(subscriber)
+
+
+	def remove_subscriber(self, subscriber):
+		for key, sink in list(self.sinks.items()):
+			if subscriber in sink.subscribers:
+				sink.subscribers.discard(subscriber)
+				if not sink.subscribers:
+					del self.sinks[key]
+					self.sink_list = tuple(self.sinks.values())
+
+
+broker.register_producer("midi", MidiPortProducer)
+
+
 class MidiLogMessageHandler(ZynthianWebSocketMessageHandler):
-	mido_port = None
-	midi_port_name = None
+	send_policy = SEND_DROP_OLDEST
+	CAPTURE_DIRECTORY = os.environ.get('ZYNTHIAN_MY_DATA_DIR', "/zynthian/zynthian-my-data") + "/capture"
 
 	@classmethod
 	def is_registered_for(cls, handler_name):
 		return handler_name == 'MidiLogMessageHandler'
 
 
-	def do_start_logging(self, midi_port_name):
-		logging.info("start midi logging on {}".format(midi_port_name))
+	def __init__(self, handler_name, websocket):
+		super().__init__(handler_name, websocket)
+		self.midi_port_names = []
+		self.midi_filter = DEFAULT_MIDI_FILTER
 
-		self.do_stop_logging()
-		MidiLogMessageHandler.midi_port_name = midi_port_name
 
-		try:
-			mido.set_backend('mido.backends.rtmidi/UNIX_JACK')
-			MidiLogMessageHandler.mido_port = mido.open_input(self.midi_port_name, callback=self.on_midi_in)
-		except:
-			logging.error("Can't open MIDI Port {}".format(self.midi_port_name))
+	def get_producer(self, midi_port_name):
+		return broker.get_producer("midi/" + midi_port_name)
 
 
-	def on_midi_in(self, msg):
-		message = ZynthianWebSocketMessage('MidiLogMessageHandler', msg)
-		self.websocket.write_message(jsonpickle.encode(message))
+	def do_start_logging(self, midi_port_names):
+		for midi_port_name in list(self.midi_port_names):
+			if midi_port_name not in midi_port_names:
+				self.do_stop_port_logging(midi_port_name)
+		for midi_port_name in midi_port_names:
+			if midi_port_name in self.midi_port_names:
+				continue
+			if self.subscribe("midi/" + midi_port_name):
+				self.midi_port_names.append(midi_port_name)
+				self.get_producer(midi_port_name).set_filter(self, self.midi_filter)
+			else:
+				logging.error("Can't open MIDI Port {}".format(midi_port_name))
+
+
+	def do_stop_port_logging(self, midi_port_name):
+		producer = self.get_producer(midi_port_name)
+		if producer:
+			producer.remove_subscriber(self)
+		self.unsubscribe("midi/" + midi_port_name)
+		self.midi_port_names.remove(midi_port_name)
 
 
 	def do_stop_logging(self):
-		if MidiLogMessageHandler.mido_port:
-			logging.info("stop midi logging")
-			MidiLogMessageHandler.mido_port.close()
+		for midi_port_name in list(self.midi_port_names):
+			self.do_stop_port_logging(midi_port_name)
+
+
+	def do_set_filter(self, midi_filter):
+		self.midi_filter = midi_filter
+		for midi_port_name in self.midi_port_names:
+			self.get_producer(midi_port_name).set_filter(self, midi_filter)
+
+
+	def do_save_capture(self, seconds):
+		"""Save the last seconds of the monitored ports as a MIDI file, one track
+		per port. The monitor keeps running."""
+		since = time.perf_counter() - seconds
+		captures = []
+		for midi_port_name in self.midi_port_names:
+			producer = self.get_producer(midi_port_name)
+			if producer and producer.capture:
+				captures.append((midi_port_name, producer.capture.get_data()))
+		if not captures:
+			self.send_reply({'error': "MIDI capture is not available"})
+			return
+		fpath = "{}/midi-capture-{}.mid".format(self.CAPTURE_DIRECTORY, time.strftime("%Y%m%d-%H%M%S"))
+
+		async def save_capture_task():
+			try:
+				count = await workers.run_in_thread(save_midi_capture, fpath, captures, since)
+				logging.info("Saved {} MIDI events to {}".format(count, fpath))
+				self.send_reply({'capture': os.path.basename(fpath), 'count': count})
+			except Exception as e:
+				logging.error("Can't save MIDI capture {} => {}".format(fpath, e))
+				self.send_reply({'error': "Can't save MIDI capture: {}".format(e)})
+		command_runner.spawn_task(save_capture_task())
+
+
+	def send_reply(self, data):
+		# Never dropped by the monitor stream
+		self.websocket.send_message(self.handler_name, data, SEND_FIFO)
 
 
 	def on_websocket_message(self, message):
@@ -139,21 +281,138 @@ class MidiLogMessageHandler(ZynthianWebSocketMessageHandler):
 		action = parts[0]
 
 		if action == 'START_LOGGING':
+			# START_LOGGING <port name> | START_LOGGING ["port name", ...]
 			try:
-				midi_port_name = parts[1]
+				arg = parts[1]
 			except:
-				midi_port_name = "ZyntMidiRouter:main_out"
-			self.do_start_logging(midi_port_name)
+				arg = "ZynMidiRouter:main_out"
+			if arg.startswith("["):
+				try:
+					midi_port_names = [str(name) for name in json.loads(arg)]
+				except (ValueError, TypeError) as e:
+					logging.error("Invalid MIDI port list {} => {}".format(arg, e))
+					return
+			else:
+				midi_port_names = [arg]
+			self.do_start_logging(midi_port_names)
 
 		elif action == 'STOP_LOGGING':
 			self.do_stop_logging()
 
+		elif action == 'SET_FILTER':
+			# SET_FILTER {channels, types, ccs, realtime}
+			try:
+				self.do_set_filter(MidiFilter.from_dict(json.loads(parts[1])))
+			except (IndexError, ValueError, AttributeError, TypeError) as e:
+				self.send_reply({'error': "Invalid filter: {}".format(e)})
+
+		elif action == 'SAVE_CAPTURE':
+			# SAVE_CAPTURE <seconds>
+			try:
+				seconds = float(parts[1])
+			except (IndexError, ValueError):
+				seconds = MidiCaptureRing.SECONDS
+			self.do_save_capture(seconds)
+
+		elif action == 'SHOW_REALTIME':
+			# SHOW_REALTIME 0|1 => send MIDI clock & active sensing messages, instead of counters
+			f = self.midi_filter
+			self.do_set_filter(MidiFilter(f.channels, f.types, f.ccs, len(parts) > 1 and parts[1] == '1'))
+
 		elif action == 'GET_MIDI_PORT':
-			self.websocket.write_message("MIDI_PORT = {}".format(self.midi_port_name))
+			self.send("MIDI_PORT = {}".format(", ".join(self.midi_port_names)))
 
 		logging.debug("message handled.")  # this needs to show up early to get the socket working again.
 
 
 	def on_close(self):
-		logging.info("stopping tail threads")
 		self.do_stop_logging()
+
+#------------------------------------------------------------------------------
+# MIDI Statistics: snapshots of the monitored ports, pushed every
+# STATS_INTERVAL seconds instead of streaming every event.
+#------------------------------------------------------------------------------
+
+class MidiStatsMessageHandler(ZynthianWebSocketMessageHandler):
+	send_policy = SEND_LATEST
+
+	@classmethod
+	def is_registered_for(cls, handler_name):
+		return handler_name == 'MidiStatsMessageHandler'
+
+
+	def __init__(self, handler_name, websocket):
+		super().__init__(handler_name, websocket)
+		self.midi_port_names = []
+
+
+	# One pending snapshot per port
+	def get_send_key(self, data):
+		return data.get('port')
+
+
+	def do_start_stats(self, midi_port_names):
+		for midi_port_name in list(self.midi_port_names):
+			if midi_port_name not in midi_port_names:
+				self.do_stop_port_stats(midi_port_name)
+		for midi_port_name in midi_port_names:
+			if midi_port_name in self.midi_port_names:
+				continue
+			if self.subscribe("midi/" + midi_port_name):
+				self.midi_port_names.append(midi_port_name)
+				producer = broker.get_producer("midi/" + midi_port_name)
+				producer.stats_subscribers.add(self)
+				if producer.stats_snapshot:
+					self.send(producer.stats_snapshot)
+			else:
+				logging.error("Can't open MIDI Port {}".format(midi_port_name))
+
+
+	def do_stop_port_stats(self, midi_port_name):
+		producer = broker.get_producer("midi/" + midi_port_name)
+		if producer:
+			producer.stats_subscribers.discard(self)
+		self.unsubscribe("midi/" + midi_port_name)
+		self.midi_port_names.remove(midi_port_name)
+
+
+	def do_stop_stats(self):
+		for midi_port_name in list(self.midi_port_names):
+			self.do_stop_port_stats(midi_port_name)
+
+
+	def on_websocket_message(self, message):
+		parts = message.split(" ", maxsplit=1)
+		action = parts[0]
+
+		if action == 'START_STATS':
+			# START_STATS ["port name", ...]
+			try:
+				midi_port_names = [str(name) for name in json.loads(parts[1])]
+			except (IndexError, ValueError, TypeError) as e:
+				logging.error("Invalid MIDI port list => {}".format(e))
+				return
+			self.do_start_stats(midi_port_names)
+
+		elif action == 'STOP_STATS':
+			self.do_stop_stats()
+
+
+	def on_close(self):
+		self.do_stop_stats()
+
+
+class MidiStatsHandler(tornado.web.RequestHandler):
+
+	def get_current_user(self):
+		return self.get_secure_cookie("user")
+
+
+	# Last snapshot of every monitored port
+	@tornado.web.authenticated
+	def get(self):
+		ports = []
+		for topic, producer in sorted(broker.producers.items()):
+			if isinstance(producer, MidiPortProducer) and producer.stats_snapshot:
+				ports.append(producer.stats_snapshot)
+		self.write({'ports': ports})
@@ -0,0 +1,280 @@
+# -*- coding: utf-8 -*-
+#********************************************************************
+# ZYNTHIAN PROJECT: Zynthian Web Configurator
+#
+# MIDI Monitor
+#
+# Copyright (C) 2018 Fernando Moyano <jofemodo@zynthian.org>
+#
+#********************************************************************
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License as
+# published by the Free Software Foundation; either version 2 of
+# the License, or any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# For a full copy of the GNU General Public License see the LICENSE.txt file.
+#
+#********************************************************************
+
+import base64
+import struct
+import logging
+import threading
+import rtmidi
+
+#------------------------------------------------------------------------------
+# MIDI status bytes
+#------------------------------------------------------------------------------
+
+MIDI_CLOCK = 0xF8
+MIDI_ACTIVE_SENSING = 0xFE
+
+#------------------------------------------------------------------------------
+# Raw MIDI input, without creating a mido.Message for every event.
+# The callback runs in the rtmidi thread, with (message bytes, delta time).
+#------------------------------------------------------------------------------
+
+def open_midi_input(port_name, callback, client_name="ZynthianWebconf"):
+	midi_in = rtmidi.MidiIn(rtmidi.API_UNIX_JACK, name=client_name)
+	try:
+		index = midi_in.get_ports().index(port_name)
+	except ValueError:
+		midi_in.delete()
+		raise ValueError("MIDI port '{}' not found".format(port_name))
+	# Receive everything, clock & active sensing are aggregated by the monitor
+	midi_in.ignore_types(sysex=False, timing=False, active_sense=False)
+	midi_in.open_port(index, "monitor")
+	midi_in.set_callback(callback)
+	return midi_in
+
+
+def close_midi_input(midi_in):
+	midi_in.cancel_callback()
+	midi_in.close_port()
+	midi_in.delete()
+
+#------------------------------------------------------------------------------
+# MIDI Event Buffer
+#
+# Events are written from the MIDI thread into a preallocated bytearray and
+# collected from the IOLoop as compact frames. Two buffers are swapped on
+# every frame, so there is no allocation per event and the lock is only
+# held to copy a few bytes.
+#
+# Frame events are packed as:
+#  + uint32 LE => microseconds since the frame start
+#  + uint16 LE => length of the MIDI message
+#  + MIDI message bytes
+#
+# MIDI clock & active sensing are counted instead, unless show_realtime.
+#------------------------------------------------------------------------------
+
+EVENT_HEADER = struct.Struct('<IH')
+
+class MidiEventBuffer(object):
+	SIZE = 32 * 1024
+
+	def __init__(self, size=SIZE):
+		self.size = size
+		self.buffers = [bytearray(size), bytearray(size)]
+		self.lock = threading.Lock()
+		self.current = 0
+		self.pos = 0
+		self.frame_time = 0.0
+		self.clock_count = 0
+		self.active_sensing_count = 0
+		self.dropped = 0
+		self.show_realtime = False
+
+
+	# Called from the MIDI thread
+	def add_event(self, ts, message):
+		status = message[0]
+		n = len(message)
+		with self.lock:
+			if not self.show_realtime:
+				if status == MIDI_CLOCK:
+					self.clock_count += 1
+					return
+				elif status == MIDI_ACTIVE_SENSING:
+					self.active_sensing_count += 1
+					return
+			pos = self.pos
+			end = pos + EVENT_HEADER.size + n
+			if end > self.size:
+				self.dropped += 1
+				return
+			if pos == 0:
+				self.frame_time = ts
+			buf = self.buffers[self.current]
+			EVENT_HEADER.pack_into(buf, pos, int((ts - self.frame_time) * 1000000), n)
+			buf[pos + EVENT_HEADER.size:end] = message
+			self.pos = end
+
+
+	def swap(self):
+		"""Return (frame time, events memoryview, clock count, active sensing count,
+		dropped) and start a new frame. The view is valid until the next swap."""
+		with self.lock:
+			buf = self.buffers[self.current]
+			result = (self.frame_time, memoryview(buf)[:self.pos], self.clock_count, self.active_sensing_count, self.dropped)
+			self.current ^= 1
+			self.pos = 0
+			self.clock_count = 0
+			self.active_sensing_count = 0
+			self.dropped = 0
+		return result
+
+
+	def get_frame(self, start_time):
+		"""Collect a frame, ready to be sent as {t: ms since start_time, e: base64 events,
+		clk: clocks, as: active sensing, x: dropped}, or None if there is nothing new."""
+		frame_time, events, clock_count, active_sensing_count, dropped = self.swap()
+		if not (events or clock_count or active_sensing_count or dropped):
+			return None
+		frame = {}
+		if events:
+			frame['t'] = round((frame_time - start_time) * 1000, 3)
+			frame['e'] = base64.b64encode(events).decode('ascii')
+		if clock_count:
+			frame['clk'] = clock_count
+		if active_sensing_count:
+			frame['as'] = active_sensing_count
+		if dropped:
+			logging.warning("MIDI monitor buffer full, {} events dropped".format(dropped))
+			frame['x'] = dropped
+		return frame
+
+#------------------------------------------------------------------------------
+# MIDI Filter: channel, message type & CC number, evaluated in the MIDI
+# thread before the event is buffered. It's compiled into lookup tables
+# indexed by status byte and CC number, so matching is 1 or 2 lookups.
+#------------------------------------------------------------------------------
+
+MIDI_CHANNEL_TYPES = {
+	'note_off': 0x80,
+	'note_on': 0x90,
+	'polytouch': 0xA0,
+	'control_change': 0xB0,
+	'program_change': 0xC0,
+	'aftertouch': 0xD0,
+	'pitchwheel': 0xE0
+}
+
+MIDI_SYSTEM_TYPES = {
+	'sysex': 0xF0,
+	'quarter_frame': 0xF1,
+	'songpos': 0xF2,
+	'song_select': 0xF3,
+	'tune_request': 0xF6,
+	'clock': 0xF8,
+	'start': 0xFA,
+	'continue': 0xFB,
+	'stop': 0xFC,
+	'active_sensing': 0xFE,
+	'reset': 0xFF
+}
+
+
+def parse_number_list(value, min_value, max_value):
+	"""Numbers from a list or a string like "1,3,5-8". None means all."""
+	if value is None or value == "" or value == []:
+		return None
+	if isinstance(value, str):
+		value = value.split(",")
+	numbers = set()
+	for item in value:
+		item = str(item).strip()
+		if "-" in item:
+			first, last = item.split("-", 1)
+			numbers.update(range(int(first), int(last) + 1))
+		elif item:
+			numbers.add(int(item))
+	for n in numbers:
+		if n < min_value or n > max_value:
+			raise ValueError("{} is out of range {}-{}".format(n, min_value, max_value))
+	return numbers
+
+
+class MidiFilter(object):
+
+	def __init__(self, channels=None, types=None, ccs=None, realtime=False):
+		"""channels: 0-15, types: message type names, ccs: 0-127, None means all.
+		realtime: send MIDI clock & active sensing, instead of counting them."""
+		self.channels = frozenset(channels) if channels is not None else None
+		self.types = frozenset(types) if types is not None else None
+		self.ccs = frozenset(ccs) if ccs is not None else None
+		self.realtime = realtime
+		self.key = (self.channels, self.types, self.ccs, self.realtime)
+
+		for t in self.types or ():
+			if t not in MIDI_CHANNEL_TYPES and t not in MIDI_SYSTEM_TYPES:
+				raise ValueError("Unknown MIDI message type '{}'".format(t))
+
+		self.status_table = bytearray(256)
+		for name, status in MIDI_CHANNEL_TYPES.items():
+			if self.types is None or name in self.types:
+				for chan in range(16):
+					if self.channels is None or chan in self.channels:
+						self.status_table[status | chan] = 1
+		for name, status in MIDI_SYSTEM_TYPES.items():
+			if self.types is None or name in self.types:
+				self.status_table[status] = 1
+		if not realtime:
+			# Counted by the event buffer
+			self.status_table[MIDI_CLOCK] = 1
+			self.status_table[MIDI_ACTIVE_SENSING] = 1
+
+		self.cc_table = bytearray(128)
+		for cc in range(128):
+			if self.ccs is None or cc in self.ccs:
+				self.cc_table[cc] = 1
+
+
+	@classmethod
+	def from_dict(cls, params):
+		return cls(
+			parse_number_list(params.get('channels'), 0, 15),
+			params.get('types') or None,
+			parse_number_list(params.get('ccs'), 0, 127),
+			bool(params.get('realtime'))
+		)
+
+
+	def match(self, message):
+		status = message[0]
+		if not self.status_table[status]:
+			return False
+		if status & 0xF0 == 0xB0 and len(message) > 1:
+			return self.cc_table[message[1]] == 1
+		return True
+
+
+DEFAULT_MIDI_FILTER = MidiFilter()
+
+#------------------------------------------------------------------------------
+# MIDI Monitor Sink: events matching a filter, buffered for the subscribers
+# using that filter. Subscribers with the same filter share the sink.
+#------------------------------------------------------------------------------
+
+class MidiMonitorSink(object):
+
+	def __init__(self, midi_filter):
+		self.filter = midi_filter
+		self.buffer = MidiEventBuffer()
+		self.buffer.show_realtime = midi_filter.realtime
+		self.subscribers = set()
+
+
+	# Called from the MIDI thread
+	def add_event(self, ts, message):
+		if self.filter.match(message):
+			self.buffer.add_event(ts, message)
+
+#------------------------------------------------------------------------------
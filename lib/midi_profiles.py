@@ -0,0 +1,133 @@
+# -*- coding: utf-8 -*-
+#********************************************************************
+# ZYNTHIAN PROJECT: Zynthian Web Configurator
+#
+# MIDI Profile Repository
+#
+# Copyright (C) 2018 Fernando Moyano <jofemodo@zynthian.org>
+#
+#********************************************************************
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License as
+# published by the Free Software Foundation; either version 2 of
+# the License, or any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# For a full copy of the GNU General Public License see the LICENSE.txt file.
+#
+#********************************************************************
+
+import os
+import re
+import shutil
+import logging
+from collections import OrderedDict
+
+from lib.config_cache import config_cache, get_file_stamp
+
+#------------------------------------------------------------------------------
+# Module helper functions
+#------------------------------------------------------------------------------
+
+PROFILE_LINE_RE = re.compile(r"export (\w*)=\"(.*)\"")
+
+def parse_midi_profile(fpath):
+	"""Key/value map of the "export KEY="value"" lines in a profile script"""
+	values = {}
+	with open(fpath) as f:
+		for line in f:
+			if line[0] == '#':
+				continue
+			m = PROFILE_LINE_RE.match(line)
+			if m:
+				values[m.group(1)] = m.group(2)
+	return values
+
+#------------------------------------------------------------------------------
+# MIDI Profile Repository
+#
+# The profile scripts in midi-profiles, listed & parsed once. The listing is
+# cached until the directory mtime changes (a profile is created, deleted or
+# replaced) and every parsed profile until its own mtime or size changes, so
+# the MIDI options page only re-reads what was modified.
+#
+# Profiles are updated by zynconf on a temporary copy that replaces the
+# script, so readers (the UI too) never see a half written profile, and the
+# cache is refreshed with the new values straight away.
+#------------------------------------------------------------------------------
+
+class MidiProfileRepository():
+
+	def __init__(self, directory=None):
+		if directory is None:
+			directory = "%s/midi-profiles" % os.environ.get("ZYNTHIAN_CONFIG_DIR")
+		self.directory = directory
+		self.scripts = []
+		self.scripts_stamp = None
+		# fpath => (file stamp, values)
+		self.profiles = {}
+
+
+	def get_scripts(self):
+		"""Full paths of the profile scripts, sorted by name"""
+		stamp = os.stat(self.directory).st_mtime_ns
+		if stamp != self.scripts_stamp:
+			# Every file, as before, but the temporary copies of update_profile
+			self.scripts = sorted("%s/%s" % (self.directory, x) for x in os.listdir(self.directory) if not x.endswith(".tmp"))
+			self.scripts_stamp = stamp
+			# Forget deleted profiles
+			for fpath in [f for f in self.profiles if f not in self.scripts]:
+				del self.profiles[fpath]
+			logging.debug("Listed {} MIDI profiles".format(len(self.scripts)))
+		return list(self.scripts)
+
+
+	def get_profile(self, fpath):
+		"""Parsed profile values. Raise OSError if the script can't be read."""
+		stamp = get_file_stamp(fpath)
+		cached = self.profiles.get(fpath)
+		if stamp is None or cached is None or cached[0] != stamp:
+			values = parse_midi_profile(fpath)
+			self.profiles[fpath] = (stamp, values)
+			logging.debug("LOADED MIDI PROFILE %s" % fpath)
+		else:
+			values = cached[1]
+		# Callers may modify it
+		return dict(values)
+
+
+	def get_profiles(self):
+		"""(OrderedDict of fpath => values, list of invalid scripts)"""
+		profiles = OrderedDict()
+		invalid = []
+		for fpath in self.get_scripts():
+			try:
+				profiles[fpath] = self.get_profile(fpath)
+			except Exception as e:
+				logging.debug("Can't load MIDI profile {} => {}".format(fpath, e))
+				invalid.append(fpath)
+		return profiles, invalid
+
+
+	def update_profile(self, params, fpath):
+		tmp_fpath = fpath + ".tmp"
+		try:
+			# Keep the mode, profiles are executable
+			shutil.copy2(fpath, tmp_fpath)
+			config_cache.update_midi_profile(params, tmp_fpath)
+			os.replace(tmp_fpath, fpath)
+		finally:
+			if os.path.exists(tmp_fpath):
+				os.remove(tmp_fpath)
+		# Write through
+		self.profiles[fpath] = (get_file_stamp(fpath), parse_midi_profile(fpath))
+
+
+midi_profiles = MidiProfileRepository()
+
+#------------------------------------------------------------------------------
@@ -0,0 +1,150 @@
+# -*- coding: utf-8 -*-
+#********************************************************************
+# ZYNTHIAN PROJECT: Zynthian Web Configurator
+#
+# MIDI Activity Statistics
+#
+# Copyright (C) 2018 Fernando Moyano <jofemodo@zynthian.org>
+#
+#********************************************************************
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License as
+# published by the Free Software Foundation; either version 2 of
+# the License, or any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# For a full copy of the GNU General Public License see the LICENSE.txt file.
+#
+#********************************************************************
+
+import time
+from array import array
+from bisect import bisect_left
+
+#------------------------------------------------------------------------------
+# Counters are kept in slots indexed by status byte:
+#  + channel messages => (type - 8) * 16 + channel, 0-111
+#  + system messages => 112 + (status - 0xF0), 112-127
+#------------------------------------------------------------------------------
+
+N_SLOTS = 128
+
+CHANNEL_TYPE_NAMES = ['note_off', 'note_on', 'polytouch', 'control_change', 'program_change', 'aftertouch', 'pitchwheel']
+
+SYSTEM_TYPE_NAMES = ['sysex', 'quarter_frame', 'songpos', 'song_select', 'system_f4', 'system_f5', 'tune_request', 'sysex_end',
+	'clock', 'system_f9', 'start', 'continue', 'stop', 'system_fd', 'active_sensing', 'reset']
+
+# Inter-arrival jitter buckets (seconds), last slot is +Inf
+JITTER_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.002, 0.005, 0.01, 0.02, 0.05)
+N_JITTER = len(JITTER_BUCKETS) + 1
+
+
+def get_slot_info(slot):
+	"""(channel, message type) for a slot. Channel is None for system messages."""
+	if slot < 112:
+		return slot & 0x0F, CHANNEL_TYPE_NAMES[slot >> 4]
+	return None, SYSTEM_TYPE_NAMES[slot - 112]
+
+#------------------------------------------------------------------------------
+# MIDI Stats: event counters, rates & inter-arrival jitter histograms for a
+# MIDI port, in preallocated arrays. add_event is called from the MIDI
+# thread, snapshots from the IOLoop.
+#
+# Jitter is the difference between consecutive inter-arrival intervals of
+# the same channel & message type, so a steady stream (i.e. MIDI clock)
+# falls in the first buckets whatever its rate.
+#------------------------------------------------------------------------------
+
+class MidiStats(object):
+
+	def __init__(self):
+		self.counts = array('Q', [0]) * N_SLOTS
+		self.last_time = array('d', [0.0]) * N_SLOTS
+		self.last_interval = array('d', [-1.0]) * N_SLOTS
+		self.jitter = array('L', [0]) * (N_SLOTS * N_JITTER)
+		# channel * 128 + CC number
+		self.cc_counts = array('Q', [0]) * (16 * 128)
+		self.start_time = time.perf_counter()
+		# Counters at the previous snapshot, for rates
+		self.prev_time = self.start_time
+		self.prev_counts = array('Q', self.counts)
+		self.prev_cc_counts = array('Q', self.cc_counts)
+
+
+	# Called from the MIDI thread
+	def add_event(self, ts, message):
+		status = message[0]
+		if status < 0x80:
+			return
+		if status < 0xF0:
+			slot = ((status >> 4) - 8) * 16 + (status & 0x0F)
+			if status & 0xF0 == 0xB0 and len(message) > 1:
+				self.cc_counts[((status & 0x0F) << 7) + message[1]] += 1
+		else:
+			slot = 112 + (status & 0x0F)
+
+		self.counts[slot] += 1
+		last_time = self.last_time[slot]
+		if last_time:
+			interval = ts - last_time
+			last_interval = self.last_interval[slot]
+			if last_interval >= 0:
+				self.jitter[slot * N_JITTER + bisect_left(JITTER_BUCKETS, abs(interval - last_interval))] += 1
+			self.last_interval[slot] = interval
+		self.last_time[slot] = ts
+
+
+	def get_snapshot(self):
+		"""Counters, with rates since the previous snapshot. Only active slots
+		and controllers are included."""
+		now = time.perf_counter()
+		dt = max(now - self.prev_time, 0.001)
+		counts = array('Q', self.counts)
+		cc_counts = array('Q', self.cc_counts)
+
+		total = 0
+		total_rate = 0
+		events = []
+		for slot, count in enumerate(counts):
+			if count:
+				rate = (count - self.prev_counts[slot]) / dt
+				total += count
+				total_rate += rate
+				channel, mtype = get_slot_info(slot)
+				events.append({
+					'channel': channel,
+					'type': mtype,
+					'count': count,
+					'rate': round(rate, 2),
+					'jitter': self.jitter[slot * N_JITTER:(slot + 1) * N_JITTER].tolist()
+				})
+
+		controllers = []
+		for i, count in enumerate(cc_counts):
+			if count:
+				controllers.append({
+					'channel': i >> 7,
+					'cc': i & 0x7F,
+					'count': count,
+					'rate': round((count - self.prev_cc_counts[i]) / dt, 2)
+				})
+
+		self.prev_time = now
+		self.prev_counts = counts
+		self.prev_cc_counts = cc_counts
+
+		return {
+			'uptime': round(now - self.start_time, 3),
+			'count': total,
+			'rate': round(total_rate, 2),
+			'jitter_buckets': JITTER_BUCKETS,
+			'events': events,
+			'controllers': controllers
+		}
+
+#------------------------------------------------------------------------------
@@ -32,11 +32,13 @@ import subprocess
 import shlex
 import shutil
 import glob
-from subprocess import check_output
+import inspect
 from collections import OrderedDict
 from xml.etree import ElementTree as ET
 
 from lib.zynthian_config_handler import ZynthianBasicHandler
+from lib.config_cache import config_cache
+from lib.command_runner import command_runner
 from zyngine.zynthian_engine_pianoteq import *
 
 sys.path.append(os.environ.get('ZYNTHIAN_UI_DIR'))
@@ -72,7 +74,7 @@ class PianoteqHandler(ZynthianBasicHandler):
 
 
 	@tornado.web.authenticated
-	def post(self):
+	async def post(self):
 		action = self.get_argument('ZYNTHIAN_PIANOTEQ_ACTION')
 		if action:
 			errors = {
@@ -80,10 +82,12 @@ class PianoteqHandler(ZynthianBasicHandler):
 				'ACTIVATE_LICENSE': lambda: self.do_activate_license(),
 				'UPDATE_PRESETS_CACHE': lambda: self.do_update_presets_cache()
 			}[action]()
+			if inspect.isawaitable(errors):
+				errors = await errors
 		self.get(errors)
 
 
-	def do_install_pianoteq(self):
+	async def do_install_pianoteq(self):
 		errors = None
 		filename = self.get_argument('ZYNTHIAN_PIANOTEQ_FILENAME');
 		if filename:
@@ -93,7 +97,7 @@ class PianoteqHandler(ZynthianBasicHandler):
 			filename_parts = os.path.splitext(filename)
 			# Pianoteq binaries
 			if filename_parts[1].lower() == '.7z':
-				errors = self.do_install_pianoteq_binary(filename);
+				errors = await self.do_install_pianoteq_binary(filename);
 			# Pianoteq instruments
 			elif filename_parts[1].lower() == '.ptq':
 				errors = self.do_install_pianoteq_ptq(filename);
@@ -107,10 +111,10 @@ class PianoteqHandler(ZynthianBasicHandler):
 		return errors
 
 
-	def do_install_pianoteq_binary(self, filename):
+	async def do_install_pianoteq_binary(self, filename):
 		# Install new binary package
-		command = self.recipes_dir + "/install_pianoteq_binary.sh {}".format(filename)
-		check_output(command, shell=True)
+		command = [self.recipes_dir + "/install_pianoteq_binary.sh", filename]
+		await command_runner.run(command, timeout=600)
 
 
 	def do_install_pianoteq_ptq(self, filename):
@@ -122,15 +126,15 @@ class PianoteqHandler(ZynthianBasicHandler):
 		shutil.move(filename, PIANOTEQ_ADDON_DIR + "/" + os.path.basename(filename))
 
 
-	def do_activate_license(self):
+	async def do_activate_license(self):
 		license_serial = self.get_argument('ZYNTHIAN_PIANOTEQ_LICENSE');
 		logging.info("Configuring Pianoteq License Key: {}".format(license_serial))
 		
 		# Activate the License Key by calling Pianoteq binary
-		command = "{} --activate {}".format(PIANOTEQ_BINARY, license_serial)
+		command = [PIANOTEQ_BINARY, "--activate", license_serial]
 		result = ""
 		try:
-			result = check_output(command, shell=True).decode("utf-8")
+			result = await command_runner.run_text(command, timeout=60)
 		except Exception as e:
 			logging.error("Pianoteq License Activation Failed: {}".format(e))
 			result = format(e)
@@ -177,4 +181,4 @@ class PianoteqHandler(ZynthianBasicHandler):
 		for vn in config:
 			sconfig[vn]=config[vn][0]
 
-		zynconf.save_config(sconfig, update_sys=True)
+		config_cache.save_config(sconfig, update_sys=True)
@@ -34,10 +34,12 @@ import requests
 import bz2
 import zipfile
 import tarfile
+import inspect
 import tornado.web
 from collections import OrderedDict
 
 from lib.zynthian_config_handler import ZynthianBasicHandler
+from lib.workers import workers
 from zyngui.zynthian_gui_engine import *
 
 #------------------------------------------------------------------------------
@@ -60,7 +62,7 @@ class PresetsConfigHandler(ZynthianBasicHandler):
 
 
 	@tornado.web.authenticated
-	def post(self, action):
+	async def post(self, action):
 		try:
 			self.engine = self.get_argument('ENGINE', 'ZY')
 			self.engine_info = zynthian_gui_engine.engine_info[self.engine]
@@ -84,6 +86,8 @@ class PresetsConfigHandler(ZynthianBasicHandler):
 				'install': lambda: self.do_install_url(),
 				'upload': lambda: self.do_install_file()
 			}[action]()
+			if inspect.isawaitable(result):
+				result = await result
 
 		except:
 			result = {}
@@ -93,12 +97,13 @@ class PresetsConfigHandler(ZynthianBasicHandler):
 			self.write(result)
 
 
-	def do_get_tree(self):
+	async def do_get_tree(self):
 		result = {}
 		try:
 			result['methods'] =	self.engine_cls.get_zynapi_methods()
 			result['formats'] =	self.get_upload_formats()
-			result['presets'] = self.get_presets_data()
+			# Engine APIs scan the bank directories & parse files => worker thread
+			result['presets'] = await workers.run_in_thread(self.get_presets_data)
 		except Exception as e:
 			result['methods'] =  None
 			result['formats'] =  None
@@ -24,11 +24,13 @@
 
 import os
 import re
+import asyncio
 import logging
 import tornado.web
 from collections import OrderedDict
-from subprocess import check_output, call
 
+from lib import git_info
+from lib.command_runner import command_runner
 from lib.zynthian_config_handler import ZynthianConfigHandler
 from lib.audio_config_handler import AudioConfigHandler
 from lib.display_config_handler import DisplayConfigHandler
@@ -42,6 +44,8 @@ class RepositoryHandler(ZynthianConfigHandler):
 
 	zynthian_base_dir = os.environ.get('ZYNTHIAN_DIR', "/zynthian")
 
+	REMOTE_UPDATE_TTL = 60
+
 	repository_list = [
 		['zynthian-ui', False],
 		['zynthian-webconf', False],
@@ -51,12 +55,12 @@ class RepositoryHandler(ZynthianConfigHandler):
 	]
 
 	@tornado.web.authenticated
-	def get(self, errors=None):
-		super().get("Repositories", self.get_config_info(), errors)
+	async def get(self, errors=None):
+		super().get("Repositories", await self.get_config_info(), errors)
 
 
 	@tornado.web.authenticated
-	def post(self):
+	async def post(self):
 		postedConfig = tornado.escape.recursive_unicode(self.request.arguments)
 		logging.info(postedConfig)
 
@@ -65,13 +69,13 @@ class RepositoryHandler(ZynthianConfigHandler):
 		for posted_config_key in postedConfig:
 			repo_name = posted_config_key[14:]
 			try:
-				if self.set_repo_branch(repo_name, postedConfig[posted_config_key][0]):
+				if await self.set_repo_branch(repo_name, postedConfig[posted_config_key][0]):
 					changed_repos += 1
 			except Exception as err:
 				logging.error(err)
 				errors["ZYNTHIAN_REPO_{}".format(repo_name)]=err
 
-		config = self.get_config_info()
+		config = await self.get_config_info()
 		if changed_repos>0:
 			config['ZYNTHIAN_MESSAGE'] = {
 				'type': 'html',
@@ -81,10 +85,12 @@ class RepositoryHandler(ZynthianConfigHandler):
 		super().get("Repositories", config, errors)
 
 
-	def get_config_info(self):
+	async def get_config_info(self):
+		# Fetch all the remotes concurrently. The runner limits the number of git processes.
+		branch_lists = await asyncio.gather(*[self.get_repo_branch_list(repitem[0]) for repitem in self.repository_list])
+
 		config = OrderedDict([])
-		for repitem in self.repository_list:
-			options = self.get_repo_branch_list(repitem[0])
+		for repitem, options in zip(self.repository_list, branch_lists):
 			config["ZYNTHIAN_REPO_{}".format(repitem[0])] = {
 				'type': 'select',
 				'title': repitem[0],
@@ -96,30 +102,30 @@ class RepositoryHandler(ZynthianConfigHandler):
 		return config
 
 
-	def get_repo_tag_list(self, repo_name):
+	async def update_remote(self, repo_dir):
+		# Remote refs don't change so often, so don't fetch them on every page load
+		try:
+			await command_runner.run(["git", "remote", "update", "origin", "--prune"], cwd=repo_dir, timeout=60, cache_ttl=self.REMOTE_UPDATE_TTL)
+		except Exception as e:
+			logging.error("Can't update remote of {} => {}".format(repo_dir, e))
+
+
+	async def get_repo_tag_list(self, repo_name):
 		result = ["master"]
 		repo_dir = self.zynthian_base_dir + "/" + repo_name
 
-		check_output("cd {}; git remote update origin --prune".format(repo_dir), shell=True)
-		for byteLine in check_output("cd {}; git tag".format(repo_dir), shell=True).splitlines():
-			result.append(byteLine.decode("utf-8").strip())
+		await self.update_remote(repo_dir)
+		result += git_info.get_tags(repo_dir)
 
 		return result
 
 
-	def get_repo_branch_list(self, repo_name):
+	async def get_repo_branch_list(self, repo_name):
 		result = ["master"]
 		repo_dir = self.zynthian_base_dir + "/" + repo_name
 
-		check_output("cd {}; git remote update origin --prune".format(repo_dir), shell=True)
-		for byteLine in check_output("cd {}; git branch -a".format(repo_dir), shell=True).splitlines():
-			bname=byteLine.decode("utf-8").strip()
-			if bname.startswith("*"):
-				bname = bname[2:]
-			if bname.startswith("remotes/origin/"):
-				bname = bname[15:]
-			if "->" in bname:
-				continue
+		await self.update_remote(repo_dir)
+		for bname in git_info.get_branches(repo_dir):
 			if bname not in result:
 				result.append(bname)
 
@@ -128,12 +134,10 @@ class RepositoryHandler(ZynthianConfigHandler):
 
 	def get_repo_current_branch(self, repo_name):
 		repo_dir = self.zynthian_base_dir + "/" + repo_name
-
-		for byteLine in check_output("cd {}; git branch | grep \* | cut -d ' ' -f2".format(repo_dir), shell=True).splitlines():
-			return byteLine.decode("utf-8")
+		return git_info.get_current_branch(repo_dir)
 
 
-	def set_repo_tag(self, repo_name, tag_name):
+	async def set_repo_tag(self, repo_name, tag_name):
 		logging.info("Changing repository '{}' to tag '{}'".format(repo_name, tag_name))
 
 		repo_dir = self.zynthian_base_dir + "/" + repo_name
@@ -141,14 +145,16 @@ class RepositoryHandler(ZynthianConfigHandler):
 
 		if tag_name != current_branch:
 			logging.info("... needs change: '{}' != '{}'".format(current_branch, tag_name))
+			await command_runner.run(["git", "checkout", "."], cwd=repo_dir, check=False)
 			if tag_name == 'master':
-				check_output("cd {}; git checkout .; git checkout {}".format(repo_dir, tag_name), shell=True)
+				await command_runner.run(["git", "checkout", tag_name], cwd=repo_dir)
 			else:
-				check_output("cd {}; git checkout .; git branch -d {}; git checkout tags/{} -b {}".format(repo_dir, tag_name, tag_name, tag_name), shell=True)
+				await command_runner.run(["git", "branch", "-d", tag_name], cwd=repo_dir, check=False)
+				await command_runner.run(["git", "checkout", "tags/{}".format(tag_name), "-b", tag_name], cwd=repo_dir)
 			return True
 
 
-	def set_repo_branch(self, repo_name, branch_name):
+	async def set_repo_branch(self, repo_name, branch_name):
 		logging.info("Changing repository '{}' to branch '{}'".format(repo_name, branch_name))
 
 		repo_dir = self.zynthian_base_dir + "/" + repo_name
@@ -156,5 +162,6 @@ class RepositoryHandler(ZynthianConfigHandler):
 
 		if branch_name != current_branch:
 			logging.info("... needs change: '{}' != '{}'".format(current_branch, branch_name))
-			check_output("cd {}; git checkout .; git checkout {}".format(repo_dir, branch_name), shell=True)
+			await command_runner.run(["git", "checkout", "."], cwd=repo_dir, check=False)
+			await command_runner.run(["git", "checkout", branch_name], cwd=repo_dir)
 			return True
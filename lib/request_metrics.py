@@ -0,0 +1,214 @@
+# -*- coding: utf-8 -*-
+#********************************************************************
+# ZYNTHIAN PROJECT: Zynthian Web Configurator
+#
+# Request Metrics
+#
+# Copyright (C) 2018 Fernando Moyano <jofemodo@zynthian.org>
+#
+#********************************************************************
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License as
+# published by the Free Software Foundation; either version 2 of
+# the License, or any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# For a full copy of the GNU General Public License see the LICENSE.txt file.
+#
+#********************************************************************
+
+import time
+import logging
+from array import array
+from bisect import bisect_left
+import tornado.log
+
+#------------------------------------------------------------------------------
+# Latency buckets (seconds), as the Prometheus client defaults
+#------------------------------------------------------------------------------
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+#------------------------------------------------------------------------------
+# Fixed-bucket histogram. Counts are not cumulative until exported.
+#------------------------------------------------------------------------------
+
+class Histogram():
+
+	def __init__(self, buckets=LATENCY_BUCKETS):
+		self.buckets = buckets
+		# Last slot is +Inf
+		self.counts = array('L', [0]) * (len(buckets) + 1)
+		self.sum = 0.0
+		self.count = 0
+
+
+	def observe(self, value):
+		self.counts[bisect_left(self.buckets, value)] += 1
+		self.sum += value
+		self.count += 1
+
+
+	def get_cumulative_counts(self):
+		result = []
+		acc = 0
+		for c in self.counts:
+			acc += c
+			result.append(acc)
+		return result
+
+#------------------------------------------------------------------------------
+# Request & Websocket Metrics
+#------------------------------------------------------------------------------
+
+class RequestMetrics():
+
+	def __init__(self):
+		self.start_time = time.time()
+		# (handler, method, status) => count
+		self.requests = {}
+		# handler => Histogram
+		self.latencies = {}
+		self.ws_connections = 0
+		self.ws_connections_total = 0
+		# message handler class => count
+		self.ws_messages_in = {}
+		self.ws_messages_out = {}
+		self.ws_bytes_out = {}
+		self.ws_dropped = {}
+		self.ws_coalesced = {}
+		# Extra collectors => callable returning a list of exposition lines
+		self.collectors = []
+
+
+	def log_request(self, handler):
+		"""Application log_function: keeps tornado's access log and records the request."""
+		status = handler.get_status()
+		request_time = handler.request.request_time()
+
+		if status < 400:
+			log_method = tornado.log.access_log.info
+		elif status < 500:
+			log_method = tornado.log.access_log.warning
+		else:
+			log_method = tornado.log.access_log.error
+		log_method("%d %s %.2fms", status, handler._request_summary(), 1000.0 * request_time)
+
+		hname = type(handler).__name__
+		key = (hname, handler.request.method, status)
+		self.requests[key] = self.requests.get(key, 0) + 1
+		try:
+			self.latencies[hname].observe(request_time)
+		except KeyError:
+			histogram = Histogram()
+			histogram.observe(request_time)
+			self.latencies[hname] = histogram
+
+
+	def on_ws_open(self):
+		self.ws_connections += 1
+		self.ws_connections_total += 1
+
+
+	def on_ws_close(self):
+		self.ws_connections -= 1
+
+
+	def on_ws_message_in(self, hname):
+		self.ws_messages_in[hname] = self.ws_messages_in.get(hname, 0) + 1
+
+
+	def on_ws_message_out(self, hname, nbytes):
+		self.ws_messages_out[hname] = self.ws_messages_out.get(hname, 0) + 1
+		self.ws_bytes_out[hname] = self.ws_bytes_out.get(hname, 0) + nbytes
+
+
+	def on_ws_dropped(self, hname):
+		self.ws_dropped[hname] = self.ws_dropped.get(hname, 0) + 1
+
+
+	def on_ws_coalesced(self, hname):
+		self.ws_coalesced[hname] = self.ws_coalesced.get(hname, 0) + 1
+
+
+	def add_collector(self, collector):
+		self.collectors.append(collector)
+
+	#----------------------------------------------------------------------------
+	# Prometheus text exposition format
+	#----------------------------------------------------------------------------
+
+	def get_text(self):
+		lines = []
+
+		add_header(lines, "zynthian_webconf_uptime_seconds", "gauge", "Seconds since the webconf process started")
+		lines.append("zynthian_webconf_uptime_seconds {:.3f}".format(time.time() - self.start_time))
+
+		add_header(lines, "zynthian_webconf_http_requests_total", "counter", "HTTP requests by handler, method and status")
+		for (hname, method, status), count in sorted(self.requests.items()):
+			lines.append("zynthian_webconf_http_requests_total{} {}".format(get_labels(handler=hname, method=method, status=status), count))
+
+		add_header(lines, "zynthian_webconf_http_request_duration_seconds", "histogram", "HTTP request latency by handler")
+		for hname, histogram in sorted(self.latencies.items()):
+			cumulative = histogram.get_cumulative_counts()
+			for le, count in zip(histogram.buckets, cumulative):
+				lines.append("zynthian_webconf_http_request_duration_seconds_bucket{} {}".format(get_labels(handler=hname, le=le), count))
+			lines.append("zynthian_webconf_http_request_duration_seconds_bucket{} {}".format(get_labels(handler=hname, le="+Inf"), cumulative[-1]))
+			lines.append("zynthian_webconf_http_request_duration_seconds_sum{} {:.6f}".format(get_labels(handler=hname), histogram.sum))
+			lines.append("zynthian_webconf_http_request_duration_seconds_count{} {}".format(get_labels(handler=hname), histogram.count))
+
+		add_header(lines, "zynthian_webconf_ws_connections", "gauge", "Open websocket connections")
+		lines.append("zynthian_webconf_ws_connections {}".format(self.ws_connections))
+		add_header(lines, "zynthian_webconf_ws_connections_total", "counter", "Accepted websocket connections")
+		lines.append("zynthian_webconf_ws_connections_total {}".format(self.ws_connections_total))
+
+		add_header(lines, "zynthian_webconf_ws_messages_received_total", "counter", "Websocket messages received by message handler")
+		for hname, count in sorted(self.ws_messages_in.items()):
+			lines.append("zynthian_webconf_ws_messages_received_total{} {}".format(get_labels(handler=hname), count))
+		add_header(lines, "zynthian_webconf_ws_messages_sent_total", "counter", "Websocket messages sent by message handler")
+		for hname, count in sorted(self.ws_messages_out.items()):
+			lines.append("zynthian_webconf_ws_messages_sent_total{} {}".format(get_labels(handler=hname), count))
+		add_header(lines, "zynthian_webconf_ws_bytes_sent_total", "counter", "Websocket payload bytes sent by message handler")
+		for hname, count in sorted(self.ws_bytes_out.items()):
+			lines.append("zynthian_webconf_ws_bytes_sent_total{} {}".format(get_labels(handler=hname), count))
+		add_header(lines, "zynthian_webconf_ws_messages_dropped_total", "counter", "Websocket messages dropped over the outbox high-water mark")
+		for hname, count in sorted(self.ws_dropped.items()):
+			lines.append("zynthian_webconf_ws_messages_dropped_total{} {}".format(get_labels(handler=hname), count))
+		add_header(lines, "zynthian_webconf_ws_messages_coalesced_total", "counter", "Websocket messages replaced by a newer value before being sent")
+		for hname, count in sorted(self.ws_coalesced.items()):
+			lines.append("zynthian_webconf_ws_messages_coalesced_total{} {}".format(get_labels(handler=hname), count))
+
+		for collector in self.collectors:
+			try:
+				lines += collector()
+			except Exception as e:
+				logging.error("Metrics collector {} failed => {}".format(collector, e))
+
+		lines.append("")
+		return "\n".join(lines)
+
+#------------------------------------------------------------------------------
+# Exposition helpers
+#------------------------------------------------------------------------------
+
+def add_header(lines, name, mtype, help):
+	lines.append("# HELP {} {}".format(name, help))
+	lines.append("# TYPE {} {}".format(name, mtype))
+
+
+def escape_label(value):
+	return str(value).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+
+
+def get_labels(**labels):
+	return "{" + ",".join("{}=\"{}\"".format(k, escape_label(v)) for k, v in labels.items()) + "}"
+
+
+request_metrics = RequestMetrics()
+
+#------------------------------------------------------------------------------
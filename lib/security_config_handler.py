@@ -28,9 +28,9 @@ import logging
 import tornado.web
 from crypt import crypt
 from collections import OrderedDict
-from subprocess import check_output
 
 from lib.zynthian_config_handler import ZynthianConfigHandler
+from lib.command_runner import command_runner, get_root_crypt
 
 #------------------------------------------------------------------------------
 # System Menu
@@ -87,23 +87,23 @@ class SecurityConfigHandler(ZynthianConfigHandler):
 
 
 	@tornado.web.authenticated
-	def post(self):
+	async def post(self):
 		params=tornado.escape.recursive_unicode(self.request.arguments)
 		logging.debug("COMMAND: %s" % params['_command'][0])
 		if params['_command'][0]=="REGENERATE_KEYS":
 			cmd=os.environ.get('ZYNTHIAN_SYS_DIR') + "/sbin/regenerate_keys.sh"
-			check_output(cmd, shell=True)
+			await command_runner.run([cmd], timeout=120)
 			self.redirect('/sys-reboot')
 		else:
-			errors=self.update_system_config(params)
+			errors=await self.update_system_config(params)
 			self.get(errors)
 
 
-	def update_system_config(self, config):
+	async def update_system_config(self, config):
 		#Update Password
 		current_passwd = self.get_argument("CURRENT_PASSWORD")
 		try:
-			root_crypt = check_output("getent shadow root", shell=True).decode("utf-8").split(':')[1]
+			root_crypt = await get_root_crypt()
 			rcparts = root_crypt.split('$')
 			current_crypt = crypt(current_passwd, "$%s$%s" % (rcparts[1], rcparts[2]))
 
@@ -119,7 +119,7 @@ class SecurityConfigHandler(ZynthianConfigHandler):
 			if config['PASSWORD'][0]!=config['REPEAT_PASSWORD'][0]:
 				return { 'REPEAT_PASSWORD': "Passwords does not match!" }
 			try:
-				check_output(['usermod', '-p', crypt(config['PASSWORD'][0]), 'root'])
+				await command_runner.run(['usermod', '-p', crypt(config['PASSWORD'][0]), 'root'])
 			except Exception as e:
 				logging.error("Can't set new password! => {}".format(e))
 				return { 'REPEAT_PASSWORD': "Can't set new password!" }
@@ -145,6 +145,6 @@ class SecurityConfigHandler(ZynthianConfigHandler):
 				f.write(contents)
 				f.close()
 
-			check_output(["hostnamectl", "set-hostname", newHostname])
+			await command_runner.run(["hostnamectl", "set-hostname", newHostname])
 
 			#self.reboot_flag=True
@@ -0,0 +1,148 @@
+# -*- coding: utf-8 -*-
+#********************************************************************
+# ZYNTHIAN PROJECT: Zynthian Web Configurator
+#
+# Service Control
+#
+# Copyright (C) 2018 Fernando Moyano <jofemodo@zynthian.org>
+#
+#********************************************************************
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License as
+# published by the Free Software Foundation; either version 2 of
+# the License, or any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# For a full copy of the GNU General Public License see the LICENSE.txt file.
+#
+#********************************************************************
+
+import os
+import time
+import asyncio
+import logging
+
+from lib.command_runner import command_runner
+
+#------------------------------------------------------------------------------
+# Service Control
+#
+# Stops, starts & restarts systemd services without blocking the IOLoop:
+# jobs are queued with "systemctl --no-block" and the unit state is polled
+# with "systemctl is-active", sleeping asynchronously between polls. State
+# changes are reported to an optional on_progress(message) callback.
+#
+# Operations are serialized, so two clients switching the UI mode at the
+# same time don't interleave their stop/start jobs. The systemctl command
+# can be replaced (i.e. by a fake for testing) with the constructor argument
+# or ZYNTHIAN_WEBCONF_SYSTEMCTL.
+#------------------------------------------------------------------------------
+
+class ServiceControl():
+	POLL_INTERVAL = 0.2
+	MAX_POLL_INTERVAL = 1.0
+	STOP_TIMEOUT = 20
+	START_TIMEOUT = 30
+
+	def __init__(self, systemctl=None, runner=command_runner):
+		if systemctl is None:
+			systemctl = os.environ.get('ZYNTHIAN_WEBCONF_SYSTEMCTL', "systemctl")
+		self.systemctl = systemctl.split() if isinstance(systemctl, str) else list(systemctl)
+		self.runner = runner
+		self.lock = None
+
+
+	def get_lock(self):
+		# Created lazily, so it's bound to the running loop
+		if self.lock is None:
+			self.lock = asyncio.Lock()
+		return self.lock
+
+
+	async def systemctl_command(self, *args, timeout=10):
+		return await self.runner.run(self.systemctl + list(args), timeout=timeout)
+
+
+	async def get_state(self, service):
+		# is-active exits with non-zero status for any state but "active"
+		result = await self.runner.run_text(self.systemctl + ["is-active", service], timeout=5, check=False)
+		return result.strip() or "unknown"
+
+
+	async def wait_for_state(self, service, states, timeout, on_progress=None):
+		"""Poll the service until it reaches one of states. Return the state."""
+		deadline = time.monotonic() + timeout
+		interval = self.POLL_INTERVAL
+		last_state = None
+		while True:
+			state = await self.get_state(service)
+			if state != last_state:
+				logging.info("Service {} is {}".format(service, state))
+				if on_progress:
+					on_progress("{} is {}".format(service, state))
+				last_state = state
+			if state in states:
+				return state
+			if time.monotonic() >= deadline:
+				raise TimeoutError("Timeout waiting for {} to be {}".format(service, " or ".join(states)))
+			await asyncio.sleep(interval)
+			interval = min(interval * 2, self.MAX_POLL_INTERVAL)
+
+
+	async def do_stop(self, service, on_progress=None):
+		if on_progress:
+			on_progress("Stopping {} ...".format(service))
+		await self.systemctl_command("stop", "--no-block", service)
+		await self.wait_for_state(service, ("inactive", "failed", "unknown"), self.STOP_TIMEOUT, on_progress)
+
+
+	async def do_start(self, service, on_progress=None):
+		if on_progress:
+			on_progress("Starting {} ...".format(service))
+		await self.systemctl_command("start", "--no-block", service)
+		state = await self.wait_for_state(service, ("active", "failed"), self.START_TIMEOUT, on_progress)
+		if state == "failed":
+			raise RuntimeError("Service {} failed to start".format(service))
+
+
+	async def stop(self, service, on_progress=None):
+		async with self.get_lock():
+			await self.do_stop(service, on_progress)
+
+
+	async def start(self, service, on_progress=None):
+		async with self.get_lock():
+			await self.do_start(service, on_progress)
+
+
+	async def restart(self, service, daemon_reload=False, on_progress=None):
+		async with self.get_lock():
+			if daemon_reload:
+				await self.systemctl_command("daemon-reload", timeout=30)
+			if on_progress:
+				on_progress("Restarting {} ...".format(service))
+			# The old instance is still "active" until the job runs, so wait for
+			# the job itself. It's a child process, so the IOLoop keeps running.
+			await self.systemctl_command("restart", service, timeout=self.STOP_TIMEOUT + self.START_TIMEOUT)
+			state = await self.get_state(service)
+			if on_progress:
+				on_progress("{} is {}".format(service, state))
+			if state != "active":
+				raise RuntimeError("Service {} failed to restart".format(service))
+
+
+	async def switch(self, running_service, next_service, on_progress=None):
+		"""Stop running_service and start next_service, when it's stopped."""
+		async with self.get_lock():
+			await self.do_stop(running_service, on_progress)
+			await self.do_start(next_service, on_progress)
+
+
+service_control = ServiceControl()
+
+#------------------------------------------------------------------------------
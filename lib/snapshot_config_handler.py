@@ -23,16 +23,35 @@
 #********************************************************************
 
 import os
-import re
 import json
 import base64
 import shutil
 import base64
+import inspect
 import logging
 import tornado.web
 from collections import OrderedDict
 
 from lib.zynthian_config_handler import ZynthianBasicHandler
+from lib.library_index import library_index
+from lib.workers import workers
+from lib.midi_profiles import midi_profiles
+
+#------------------------------------------------------------------------------
+# Module helper functions
+#------------------------------------------------------------------------------
+
+def load_snapshot_files(fpaths):
+	# Run by the worker pool, so it must be picklable => module level
+	result = []
+	for fpath in fpaths:
+		try:
+			with open(fpath) as ssfile:
+				result.append(json.load(ssfile))
+		except Exception as e:
+			logging.warning("Can't load snapshot {} => {}".format(fpath, e))
+			result.append("")
+	return result
 
 #------------------------------------------------------------------------------
 # Snapshot Config Handler
@@ -44,20 +63,20 @@ class SnapshotConfigHandler(ZynthianBasicHandler):
 	my_data_dir = os.environ.get('ZYNTHIAN_MY_DATA_DIR',"/zynthian/zynthian-my-data")
 
 	SNAPSHOTS_DIRECTORY = my_data_dir + "/snapshots"
-	PROFILES_DIRECTORY = "%s/midi-profiles" % os.environ.get("ZYNTHIAN_CONFIG_DIR")
+	PROFILES_DIRECTORY = midi_profiles.directory
 
 	@tornado.web.authenticated
-	def get(self, errors=None):
+	async def get(self, errors=None):
 		config=OrderedDict([])
 
-		ssdata = self.get_snapshots_data()
+		ssdata = await self.get_snapshots_data()
 		#logging.debug(snapshot)
 
 		config['SNAPSHOTS'] = json.dumps(ssdata)
 		config['BANKS'] = self.get_existing_banks(ssdata, True)
 		config['NEXT_BANK_NUM'] = self.calculate_next_bank(self.get_existing_banks(ssdata, False))
 		config['PROGS_NUM'] = map(lambda x: str(x).zfill(3), list(range(0, 128)))
-		config['MIDI_PROFILE_SCRIPTS'] = {os.path.splitext(x)[0]:  "%s/%s" % (self.PROFILES_DIRECTORY, x) for x in os.listdir(self.PROFILES_DIRECTORY)}
+		config['MIDI_PROFILE_SCRIPTS'] = {os.path.splitext(os.path.basename(x))[0]: x for x in midi_profiles.get_scripts()}
 		config['ZYNTHIAN_UPLOAD_MULTIPLE'] = True
 
 		# Try to maintain selection after a POST action...
@@ -67,7 +86,7 @@ class SnapshotConfigHandler(ZynthianBasicHandler):
 
 
 	@tornado.web.authenticated
-	def post(self, action):
+	async def post(self, action):
 		if action:
 			result = {
 				'new_bank': lambda: self.do_new_bank(),
@@ -77,8 +96,10 @@ class SnapshotConfigHandler(ZynthianBasicHandler):
 				'save_as_default': lambda: self.do_save_as_default(),
 				'save_as_last_state': lambda: self.do_save_as_last_state()
 			}[action]()
+			if inspect.isawaitable(result):
+				result = await result
 
-		ssdata = self.get_snapshots_data()
+		ssdata = await self.get_snapshots_data()
 		result['SNAPSHOTS'] = ssdata
 		result['SEL_NODE_ID'] = self.get_selected_node_id(ssdata)
 		result['BANKS'] = self.get_existing_banks(ssdata, True)
@@ -90,9 +111,9 @@ class SnapshotConfigHandler(ZynthianBasicHandler):
 		self.write(result)
 
 
-	def do_new_bank(self):
+	async def do_new_bank(self):
 		result = {}
-		existing_banks = self.get_existing_banks(self.get_snapshots_data(), False)
+		existing_banks = self.get_existing_banks(await self.get_snapshots_data(), False)
 		new_bank_dname = self.get_argument('NEW_BANK_NUM', str(self.calculate_next_bank(existing_banks))).zfill(3)
 		if new_bank_dname in existing_banks:
 			result['errors'] = "Bank already exists!"
@@ -235,16 +256,29 @@ class SnapshotConfigHandler(ZynthianBasicHandler):
 		return ''
 
 
-	def get_snapshots_data(self):
-		return self.walk_directory(SnapshotConfigHandler.SNAPSHOTS_DIRECTORY)
+	async def get_snapshots_data(self):
+		# The tree is walked in a thread and the snapshot files are parsed by the worker pool.
+		# Snapshot nodes are filled with their details afterwards.
+		ssfiles = []
+		ssdata = await workers.run_in_thread(self.walk_snapshots, ssfiles)
+		details = await workers.run_cpu_bound(load_snapshot_files, [snapshot['fullpath'] for snapshot in ssfiles])
+		for snapshot, prog_details in zip(ssfiles, details):
+			snapshot['prog_details'] = prog_details
+		return ssdata
+
 
+	def walk_snapshots(self, ssfiles):
+		library_index.sync()
+		return self.walk_directory(SnapshotConfigHandler.SNAPSHOTS_DIRECTORY, ssfiles=ssfiles)
 
-	def walk_directory(self, directory, idx=0, _bank_num=None, _bank_name=None):
+
+	def walk_directory(self, directory, idx=0, _bank_num=None, _bank_name=None, ssfiles=None):
 		snapshots = []
-		file_list =  sorted(os.listdir(directory))
+		file_list =  sorted(library_index.listdir(directory))
 		for f in file_list:
 			fullpath = os.path.join(directory, f)
-			if os.path.isdir(fullpath):
+			is_dir = library_index.isdir(fullpath)
+			if is_dir:
 				node_type = "BANK"
 				parts = f.split("-", 1)
 				bank_num = parts[0]
@@ -276,13 +310,7 @@ class SnapshotConfigHandler(ZynthianBasicHandler):
 						prog_num = ''
 						prog_name = fname
 					name = prog_name
-
-					with open(fullpath) as ssfile:
-						try:
-							prog_details = json.load(ssfile)
-						except:
-							pass
-						ssfile.close()
+					prog_details = ""
 				else:
 					continue
 
@@ -300,9 +328,11 @@ class SnapshotConfigHandler(ZynthianBasicHandler):
 			}
 			
 			idx += 1
-			if os.path.isdir(fullpath):
-				snapshot['nodes'] = self.walk_directory(fullpath, idx, bank_num, bank_name)
+			if is_dir:
+				snapshot['nodes'] = self.walk_directory(fullpath, idx, bank_num, bank_name, ssfiles)
 				idx+=len(snapshot['nodes'])
+			elif ssfiles is not None:
+				ssfiles.append(snapshot)
 
 			snapshots.append(snapshot)
 
@@ -409,7 +439,7 @@ class SnapshotRemoveOptionHandler(tornado.web.RequestHandler):
 
 
 class SnapshotAddOptionsHandler(tornado.web.RequestHandler):
-	PROFILES_DIRECTORY = "%s/midi-profiles" % os.environ.get("ZYNTHIAN_CONFIG_DIR")
+	PROFILES_DIRECTORY = midi_profiles.directory
 
 	def get_current_user(self):
 		return self.get_secure_cookie("user")
@@ -427,16 +457,10 @@ class SnapshotAddOptionsHandler(tornado.web.RequestHandler):
 				data = json.load(fp)
 				fp.close()
 
-			p = re.compile("export ZYNTHIAN_MIDI_(\w*)=\"(.*)\"")
 			profile_values = {}
-			with open(midi_profile_script, "r") as midi_fp:
-				for line in midi_fp:
-					if line[0] == '#':
-						continue
-					m = p.match(line)
-					if m:
-						profile_values[m.group(1)] = m.group(2)
-				midi_fp.close()
+			for key, value in midi_profiles.get_profile(midi_profile_script).items():
+				if key.startswith("ZYNTHIAN_MIDI_"):
+					profile_values[key[14:]] = value
 
 			for profile_value in profile_values:
 				data['midi_profile_state'][profile_value] = profile_values[profile_value]
@@ -27,10 +27,10 @@ import logging
 import tornado.web
 import tornado.websocket
 from collections import OrderedDict
-import subprocess
-import jsonpickle
+import shlex
 from lib.zynthian_config_handler import ZynthianBasicHandler
-from lib.zynthian_websocket_handler import ZynthianWebSocketMessageHandler, ZynthianWebSocketMessage
+from lib.zynthian_websocket_handler import ZynthianWebSocketMessageHandler
+from lib.command_runner import command_runner
 
 UPDATE_COMMANDS = OrderedDict([
 		#['Diagnosis', 'echo "Not implemented yet"'],
@@ -58,11 +58,21 @@ class SoftwareUpdateMessageHandler(ZynthianWebSocketMessageHandler):
 		return handler_name == 'SoftwareUpdateMessageHandler'
 
 	def on_websocket_message(self, update_command):
-		p = subprocess.Popen(UPDATE_COMMANDS[update_command], shell=True, stderr=subprocess.STDOUT, stdout=subprocess.PIPE)
-		for line in p.stdout:
-			logging.info(line.decode())
-			message = ZynthianWebSocketMessage('SoftwareUpdateMessageHandler', line.decode())
-			self.websocket.write_message(jsonpickle.encode(message))
+		# Output is streamed while the command runs, without blocking the IOLoop
+		command_runner.spawn_task(self.run_update(update_command))
 
-		message = ZynthianWebSocketMessage('SoftwareUpdateMessageHandler', "EOCOMMAND")
-		self.websocket.write_message(jsonpickle.encode(message))
+
+	async def run_update(self, update_command):
+		try:
+			returncode = await command_runner.stream(shlex.split(UPDATE_COMMANDS[update_command]), self.on_output_line)
+			if returncode:
+				logging.error("{} failed with exit code {}".format(update_command, returncode))
+		except Exception as e:
+			logging.error("Can't run {} => {}".format(update_command, e))
+			self.send("ERROR: {}\n".format(e))
+		self.send("EOCOMMAND")
+
+
+	def on_output_line(self, line):
+		logging.info(line)
+		self.send(line)
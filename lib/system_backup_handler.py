@@ -23,15 +23,18 @@
 #********************************************************************
 
 import os
+import inspect
 import logging
+import threading
 import tornado.web
 import zipfile
 from io import BytesIO
 from collections import OrderedDict
 import time
-import jsonpickle
 from lib.zynthian_config_handler import ZynthianBasicHandler
-from lib.zynthian_websocket_handler import ZynthianWebSocketMessageHandler, ZynthianWebSocketMessage
+from lib.zynthian_websocket_handler import ZynthianWebSocketMessageHandler
+from lib.workers import workers
+from lib.command_runner import command_runner
 
 #------------------------------------------------------------------------------
 # Module helper functions
@@ -51,13 +54,15 @@ class SystemBackupHandler(ZynthianBasicHandler):
 	DATA_BACKUP_ITEMS_FILE = "/zynthian/config/data_backup_items.txt"
 	EXCLUDE_SUFFIX = ".exclude"
 
+	walk_lock = threading.Lock()
+
 
 	@tornado.web.authenticated
-	def get(self, errors=None):
-		self.do_get(None, errors)
+	async def get(self, errors=None):
+		await self.do_get(None, errors)
 
 
-	def do_get(self, active_tab, errors=None):
+	async def do_get(self, active_tab, errors=None):
 		config=OrderedDict([])
 
 		config['ZYNTHIAN_SYSTEM_BACKUP_ITEMS'] = OrderedDict([])
@@ -99,14 +104,14 @@ class SystemBackupHandler(ZynthianBasicHandler):
 		def add_system_backup_item( dirname, subdirs, files ):
 			add_backup_item(dirname, subdirs, files, 'ZYNTHIAN_SYSTEM_BACKUP_ITEMS')
 
-		self.walk_backup_items(add_system_backup_item, system_backup_items)
-		self.walk_backup_items(add_data_backup_item, data_backup_items)
+		await workers.run_in_thread(self.walk_backup_items, add_system_backup_item, system_backup_items)
+		await workers.run_in_thread(self.walk_backup_items, add_data_backup_item, data_backup_items)
 
 		super().get("backup.html", "Backup / Restore", config, errors)
 
 
 	@tornado.web.authenticated
-	def post(self):
+	async def post(self):
 		action = self.get_argument('ZYNTHIAN_BACKUP_ACTION')
 		if action:
 			errors = {
@@ -121,9 +126,11 @@ class SystemBackupHandler(ZynthianBasicHandler):
 					SystemBackupHandler.DATA_BACKUP_ITEMS_FILE,
 					'DATA_BACKUP')
 			}[action]()
+			if inspect.isawaitable(errors):
+				errors = await errors
 
 
-	def do_save_backup_directories(self, backup_directory_parameter, backup_directory_exclusion_parameter, backup_file_name, tab_name):
+	async def do_save_backup_directories(self, backup_directory_parameter, backup_directory_exclusion_parameter, backup_file_name, tab_name):
 		backup_directories = ''
 		for backup_directory in self.get_argument(backup_directory_exclusion_parameter).split("\n"):
 			if backup_directory:
@@ -136,19 +143,29 @@ class SystemBackupHandler(ZynthianBasicHandler):
 		with open(backup_file_name, 'w') as backup_file:
 			backup_file.write(backup_directories)
 
-		self.do_get(tab_name)
+		await self.do_get(tab_name)
 
 
-	def do_system_backup(self):
-		self.do_backup('zynthian_system_backup',SystemBackupHandler.SYSTEM_BACKUP_ITEMS_FILE)
+	async def do_system_backup(self):
+		await self.do_backup('zynthian_system_backup',SystemBackupHandler.SYSTEM_BACKUP_ITEMS_FILE)
 
 
-	def do_data_backup(self):
-		self.do_backup('zynthian_data_backup', SystemBackupHandler.DATA_BACKUP_ITEMS_FILE)
+	async def do_data_backup(self):
+		await self.do_backup('zynthian_data_backup', SystemBackupHandler.DATA_BACKUP_ITEMS_FILE)
 
 
-	def do_backup(self, backupFileNamePrefix, backupItemsFileName):
+	async def do_backup(self, backupFileNamePrefix, backupItemsFileName):
 		zipname='{0}{1}.zip'.format(backupFileNamePrefix, time.strftime("%Y%m%d-%H%M%S"))
+		f = await workers.run_in_thread(self.create_backup_zip, backupItemsFileName)
+		self.set_header('Content-Type', 'application/zip')
+		self.set_header('Content-Disposition', 'attachment; filename=%s' % zipname)
+
+		self.write(f.getvalue())
+		f.close()
+		self.finish()
+
+
+	def create_backup_zip(self, backupItemsFileName):
 		f=BytesIO()
 		zf = zipfile.ZipFile(f, "w")
 		def zip_backup_items(dirname, subdirs, files):
@@ -163,37 +180,34 @@ class SystemBackupHandler(ZynthianBasicHandler):
 		self.walk_backup_items(zip_backup_items, backup_items)
 
 		zf.close()
-		self.set_header('Content-Type', 'application/zip')
-		self.set_header('Content-Disposition', 'attachment; filename=%s' % zipname)
-
-		self.write(f.getvalue())
-		f.close()
-		self.finish()
+		return f
 
 
 	def walk_backup_items(self, worker, backup_items):
-		excluded_folders = []
-		for backupFolder in backup_items:
-			sourceFolder = os.path.expandvars(backupFolder)
-			if sourceFolder.startswith("^"):
-				sourceFolder = os.path.expandvars(sourceFolder[1:])
-				excluded_folders.append(sourceFolder)
-				exclude_filename = '/' + os.path.basename(os.path.normpath(sourceFolder)) + SystemBackupHandler.EXCLUDE_SUFFIX
-				with open(exclude_filename, "w") as exclude_file:
-					for dirname, subdirs, files in os.walk(sourceFolder):
-						for filename in files:
-							exclude_file.write(os.path.join(dirname,filename) + '\n')
-				logging.info(exclude_filename)
-				worker('/', None , exclude_filename[1:].split(':')) #convert single string to array of 1 string
-				os.remove(exclude_filename)
-			else:
-				try:
-					for dirname, subdirs, files in os.walk(sourceFolder):
-						if not any(dirname.startswith(s) for s in excluded_folders):
-							worker(dirname, subdirs, files)
-
-				except:
-					pass
+		# Exclusion lists are written to temporary files, so walks can't overlap
+		with self.walk_lock:
+			excluded_folders = []
+			for backupFolder in backup_items:
+				sourceFolder = os.path.expandvars(backupFolder)
+				if sourceFolder.startswith("^"):
+					sourceFolder = os.path.expandvars(sourceFolder[1:])
+					excluded_folders.append(sourceFolder)
+					exclude_filename = '/' + os.path.basename(os.path.normpath(sourceFolder)) + SystemBackupHandler.EXCLUDE_SUFFIX
+					with open(exclude_filename, "w") as exclude_file:
+						for dirname, subdirs, files in os.walk(sourceFolder):
+							for filename in files:
+								exclude_file.write(os.path.join(dirname,filename) + '\n')
+					logging.info(exclude_filename)
+					worker('/', None , exclude_filename[1:].split(':')) #convert single string to array of 1 string
+					os.remove(exclude_filename)
+				else:
+					try:
+						for dirname, subdirs, files in os.walk(sourceFolder):
+							if not any(dirname.startswith(s) for s in excluded_folders):
+								worker(dirname, subdirs, files)
+
+					except:
+						pass
 
 
 	def is_valid_restore_item(self, validRestoreItems, restoreMember):
@@ -218,6 +232,21 @@ class RestoreMessageHandler(ZynthianWebSocketMessageHandler):
 
 
 	def on_websocket_message(self, restoreFile):
+		# Unzipping is blocking, so it's run by the worker pool. send() is
+		# thread safe, so the log is streamed while restoring.
+		command_runner.spawn_task(self.run_restore(restoreFile))
+
+
+	async def run_restore(self, restoreFile):
+		try:
+			await workers.run_in_thread(self.restore, restoreFile)
+		except Exception as e:
+			logging.error("Can't restore {} => {}".format(restoreFile, e))
+			self.send("ERROR: {}".format(e))
+		self.send('EOCOMMAND')
+
+
+	def restore(self, restoreFile):
 		#fileinfo = self.request.files['ZYNTHIAN_RESTORE_FILE'][0]
 		#restoreFile = fileinfo['filename']
 		with open(restoreFile , "rb") as f:
@@ -230,14 +259,12 @@ class RestoreMessageHandler(ZynthianWebSocketMessageHandler):
 						logMessage = "restored: " + member
 						restoreZip.extract(member, "/")
 						logging.debug(logMessage)
-						message = ZynthianWebSocketMessage('RestoreMessageHandler', logMessage)
-						self.websocket.write_message(jsonpickle.encode(message))
+						self.send(logMessage)
 					else:
 						if member.endswith(SystemBackupHandler.EXCLUDE_SUFFIX):
 							restoreZip.extract(member, "/")
 							with open("/" + member, 'r') as exclude_file:
-								message = ZynthianWebSocketMessage('RestoreMessageHandler',"<b>PLEASE ENSURE THAT THE FOLLOWING FILES EXIST:<br />" + exclude_file.read().replace('\n', '<br />') + "</b>")
-								self.websocket.write_message(jsonpickle.encode(message))
+								self.send("<b>PLEASE ENSURE THAT THE FOLLOWING FILES EXIST:<br />" + exclude_file.read().replace('\n', '<br />') + "</b>")
 							os.remove('/' + member)
 						else:
 							logging.warn("restore of " + member + " not permitted")
@@ -245,5 +272,3 @@ class RestoreMessageHandler(ZynthianWebSocketMessageHandler):
 				restoreZip.close()
 			f.close()
 		os.remove(restoreFile)
-		message = ZynthianWebSocketMessage('RestoreMessageHandler', 'EOCOMMAND')
-		self.websocket.write_message(jsonpickle.encode(message))
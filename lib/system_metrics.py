@@ -0,0 +1,288 @@
+# -*- coding: utf-8 -*-
+#********************************************************************
+# ZYNTHIAN PROJECT: Zynthian Web Configurator
+#
+# System Metrics Collector
+#
+# Copyright (C) 2018 Fernando Moyano <jofemodo@zynthian.org>
+#
+#********************************************************************
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License as
+# published by the Free Software Foundation; either version 2 of
+# the License, or any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# For a full copy of the GNU General Public License see the LICENSE.txt file.
+#
+#********************************************************************
+
+import os
+import time
+import fcntl
+import socket
+import struct
+import logging
+import tornado.ioloop
+
+from lib.jack_client import jack_client
+
+#------------------------------------------------------------------------------
+# Module helper functions
+#------------------------------------------------------------------------------
+
+SIOCGIFADDR = 0x8915
+
+def format_size(nbytes):
+	# Same style as "df -h" => 7.2G, 512M, ...
+	for unit in ['', 'K', 'M', 'G', 'T']:
+		if abs(nbytes) < 1024.0 or unit == 'T':
+			if unit and nbytes < 10:
+				return "{:.1f}{}".format(nbytes, unit)
+			else:
+				return "{:.0f}{}".format(nbytes, unit)
+		nbytes /= 1024.0
+
+
+def read_meminfo():
+	info = {}
+	with open("/proc/meminfo") as f:
+		for line in f:
+			parts = line.split()
+			if len(parts) >= 2:
+				# Values are in kB
+				info[parts[0].rstrip(':')] = int(parts[1])
+	return info
+
+
+def read_cpu_times():
+	with open("/proc/stat") as f:
+		parts = f.readline().split()
+	times = [int(v) for v in parts[1:]]
+	# idle + iowait
+	idle = times[3] + (times[4] if len(times) > 4 else 0)
+	return sum(times), idle
+
+
+def read_temperature(path="/sys/class/thermal/thermal_zone0/temp"):
+	with open(path) as f:
+		return int(f.read().strip()) / 1000.0
+
+
+def get_interface_ip(ifname):
+	s = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+	try:
+		res = fcntl.ioctl(s.fileno(), SIOCGIFADDR, struct.pack('256s', ifname[:15].encode()))
+		return socket.inet_ntoa(res[20:24])
+	finally:
+		s.close()
+
+
+def get_ip_list():
+	# Equivalent to "hostname -I" for IPv4 addresses
+	ips = []
+	for idx, ifname in socket.if_nameindex():
+		if ifname == 'lo':
+			continue
+		try:
+			ips.append(get_interface_ip(ifname))
+		except OSError:
+			pass
+	return ips
+
+
+def get_os_info():
+	# Equivalent to "lsb_release -ds"
+	try:
+		with open("/etc/os-release") as f:
+			for line in f:
+				if line.startswith("PRETTY_NAME="):
+					return line.split("=", 1)[1].strip().strip('"')
+	except Exception as e:
+		logging.warning("Can't get OS info! => {}".format(e))
+	return "???"
+
+
+def get_host_name():
+	try:
+		with open("/etc/hostname") as f:
+			return f.readline().strip()
+	except Exception as e:
+		logging.warning("Can't get hostname! => {}".format(e))
+	return ""
+
+#------------------------------------------------------------------------------
+# System Metrics Collector
+#------------------------------------------------------------------------------
+
+class SystemMetricsCollector():
+
+	DEFAULT_INTERVAL = 1000
+
+	def __init__(self, interval=None):
+		if interval is None:
+			interval = int(os.environ.get('ZYNTHIAN_WEBCONF_METRICS_INTERVAL', self.DEFAULT_INTERVAL))
+		self.interval = interval
+		self.periodic_callback = None
+		self.last_cpu_times = None
+		self.listeners = []
+		self.snapshot = {
+			'timestamp': 0,
+			'host_name': get_host_name(),
+			'os_info': get_os_info(),
+			'ram': { 'total': 'NA', 'used': 'NA', 'free': 'NA', 'usage': 'NA', 'percent': None },
+			'sd': { 'total': 'NA', 'used': 'NA', 'free': 'NA', 'usage': 'NA', 'percent': None },
+			'temperature': None,
+			'cpu_load': None,
+			'dsp_load': None,
+			'xruns': 0,
+			'ip': []
+		}
+
+
+	def start(self):
+		if self.periodic_callback:
+			return
+		self.sample()
+		self.periodic_callback = tornado.ioloop.PeriodicCallback(self.sample, self.interval)
+		self.periodic_callback.start()
+		logging.info("System metrics collector started ({} ms)".format(self.interval))
+
+
+	def stop(self):
+		if self.periodic_callback:
+			self.periodic_callback.stop()
+			self.periodic_callback = None
+
+
+	def add_listener(self, listener):
+		if listener not in self.listeners:
+			self.listeners.append(listener)
+
+
+	def remove_listener(self, listener):
+		try:
+			self.listeners.remove(listener)
+		except ValueError:
+			pass
+
+
+	def get_snapshot(self):
+		# Lazy sample if the collector is not running (i.e. from scripts)
+		if not self.periodic_callback and not self.snapshot['timestamp']:
+			self.sample()
+		return self.snapshot
+
+
+	def sample(self):
+		snapshot = dict(self.snapshot)
+		snapshot['ram'] = self.get_ram_info()
+		snapshot['sd'] = self.get_sd_info()
+		snapshot['temperature'] = self.get_temperature()
+		snapshot['cpu_load'] = self.get_cpu_load()
+		snapshot['dsp_load'] = self.get_dsp_load()
+		snapshot['xruns'] = jack_client.xruns
+		snapshot['ip'] = self.get_ip()
+		snapshot['host_name'] = get_host_name()
+		snapshot['timestamp'] = time.time()
+		# Swap the whole dict, so readers always get a consistent snapshot
+		self.snapshot = snapshot
+
+		for listener in list(self.listeners):
+			try:
+				listener(snapshot)
+			except Exception as e:
+				logging.error("System metrics listener failed => {}".format(e))
+
+
+	def get_ram_info(self):
+		try:
+			mi = read_meminfo()
+			total = mi['MemTotal']
+			if 'MemAvailable' in mi:
+				free = mi['MemAvailable']
+			else:
+				free = mi['MemFree'] + mi.get('Buffers', 0) + mi.get('Cached', 0)
+			used = total - free
+			percent = 100 * used / total
+			return {
+				'total': "{}M".format(total // 1024),
+				'used': "{}M".format(used // 1024),
+				'free': "{}M".format(free // 1024),
+				'usage': "{}%".format(int(percent)),
+				'percent': percent
+			}
+		except Exception as e:
+			logging.warning("Can't get RAM info! => {}".format(e))
+			return { 'total': 'NA', 'used': 'NA', 'free': 'NA', 'usage': 'NA', 'percent': None }
+
+
+	def get_sd_info(self, path="/"):
+		try:
+			st = os.statvfs(path)
+			total = st.f_blocks * st.f_frsize
+			free = st.f_bavail * st.f_frsize
+			used = (st.f_blocks - st.f_bfree) * st.f_frsize
+			# Same rounding than "df"
+			percent = 100 * used / (used + free) if used + free else 0
+			return {
+				'total': format_size(total),
+				'used': format_size(used),
+				'free': format_size(free),
+				'usage': "{}%".format(int(percent + 0.999)),
+				'percent': percent
+			}
+		except Exception as e:
+			logging.warning("Can't get SD info! => {}".format(e))
+			return { 'total': 'NA', 'used': 'NA', 'free': 'NA', 'usage': 'NA', 'percent': None }
+
+
+	def get_temperature(self):
+		try:
+			return read_temperature()
+		except Exception as e:
+			logging.debug("Can't get temperature! => {}".format(e))
+			return None
+
+
+	def get_cpu_load(self):
+		try:
+			total, idle = read_cpu_times()
+		except Exception as e:
+			logging.debug("Can't get CPU load! => {}".format(e))
+			return None
+
+		load = None
+		if self.last_cpu_times:
+			dtotal = total - self.last_cpu_times[0]
+			didle = idle - self.last_cpu_times[1]
+			if dtotal > 0:
+				load = 100 * (dtotal - didle) / dtotal
+		self.last_cpu_times = (total, idle)
+		return load
+
+
+	def get_dsp_load(self):
+		try:
+			return jack_client.cpu_load()
+		except Exception as e:
+			logging.debug("Can't get JACK DSP load! => {}".format(e))
+		return None
+
+
+	def get_ip(self):
+		try:
+			return get_ip_list()
+		except Exception as e:
+			logging.warning("Can't get IP list! => {}".format(e))
+			return []
+
+
+system_metrics = SystemMetricsCollector()
+
+#------------------------------------------------------------------------------
@@ -23,19 +23,18 @@
 #********************************************************************
 
 
+import json
 import logging
-import time
-import asyncio
-import subprocess
-import jsonpickle
 import tornado.web
 from collections import OrderedDict
-from multiprocessing import Queue
-from subprocess import check_output
-from lib.tail_thread import TailThread, AsynchronousFileReader
 
 from lib.zynthian_config_handler import ZynthianBasicHandler
-from lib.zynthian_websocket_handler import ZynthianWebSocketMessageHandler, ZynthianWebSocketMessage
+from lib.zynthian_websocket_handler import ZynthianWebSocketMessageHandler, SEND_DROP_OLDEST, SEND_FIFO
+from lib.websocket_broker import broker, TopicProducer
+from lib.journal_follower import JournalFollower, get_cursor_position, parse_journal_entry
+from lib.log_ring import LogRing, LogFilter
+from lib.command_runner import command_runner
+from lib.service_control import service_control
 
 
 #------------------------------------------------------------------------------
@@ -55,47 +54,49 @@ class UiLogHandler(ZynthianBasicHandler):
 		self.get()
 
 
-class UiTailThread(TailThread):
+#------------------------------------------------------------------------------
+# Journal Producer: one "journalctl -f" per service, shared by all viewers.
+# Topics are "journal/<service>" and data is a list of LogEntry.
+#
+# The last RING_SIZE entries are kept, parsed and indexed, so new viewers get
+# a backfill, reconnecting ones resume after their last cursor and searches
+# don't need extra processes. The producer lingers for a while after the last
+# viewer leaves, so a page reload resumes from the same ring.
+#------------------------------------------------------------------------------
+
+class JournalTailProducer(TopicProducer):
+	RING_SIZE = 2000
+	# Entries read from the journal when starting
+	BACKFILL_SIZE = 200
+	linger = 60
 
-	def __init__(self, websocket, loop, process_command):
-		TailThread.__init__(self, websocket, loop)
-		self.process_command = process_command
-		self.loop = loop
+	def start(self):
+		self.ring = LogRing(self.RING_SIZE)
+		args = ["journalctl", "-f", "-o", "json", "-n", str(self.BACKFILL_SIZE), "-u", self.name]
+		self.follower = JournalFollower(args, self.on_lines)
+		self.follower.start()
 
 
-	def run(self):
-		asyncio.set_event_loop(self.loop)
-		process = subprocess.Popen(self.process_command, shell=True, stderr=subprocess.PIPE,
-				stdout=subprocess.PIPE)
+	def stop(self):
+		self.follower.stop()
 
-		stdout_queue = Queue()
-		stdout_reader = AsynchronousFileReader(process.stdout, stdout_queue)
-		stdout_reader.start()
-		stderr_queue = Queue()
-		stderr_reader = AsynchronousFileReader(process.stderr, stderr_queue)
-		stderr_reader.start()
 
-		while self.is_running and (not stdout_reader.eof() or not stderr_reader.eof()):
-			while self.is_running and not stdout_queue.empty() and not stdout_reader.eof():
-				line = stdout_queue.get()
-				logging.info("stdout: %s" % line.decode())
-				message = ZynthianWebSocketMessage('UiLogMessageHandler', line.decode())
-				self.websocket.write_message(jsonpickle.encode(message))
+	def on_lines(self, lines):
+		entries = [e for e in map(parse_journal_entry, lines) if e]
+		if entries:
+			self.ring.extend(entries)
+			self.publish(entries)
 
-			while self.is_running and not stderr_queue.empty() and not stderr_reader.eof():
-				line = stderr_queue.get()
-				logging.info("stderr: %s" % line.decode())
-				message = ZynthianWebSocketMessage('UiLogMessageHandler', line.decode())
-				self.websocket.write_message(jsonpickle.encode(message))
 
-		stdout_reader.join()
-		stderr_reader.join()
-		process.stdout.close()
-		process.stderr.close()
+broker.register_producer("journal", JournalTailProducer)
 
 
 class UiLogMessageHandler(ZynthianWebSocketMessageHandler):
-	logging_thread = None
+	send_policy = SEND_DROP_OLDEST
+	services = ('zynthian', 'zynthian_debug')
+	backfill_size = JournalTailProducer.BACKFILL_SIZE
+	max_search_results = 200
+	max_search_context = 10
 
 
 	@classmethod
@@ -103,63 +104,153 @@ class UiLogMessageHandler(ZynthianWebSocketMessageHandler):
 		return handler_name == 'UiLogMessageHandler'
 
 
-	def get_process_command(self, debug_logging):
-		service_name = ('zynthian_debug' if debug_logging else 'zynthian')
-		logging.info("journalctl -f -u %s" % service_name)
-		return "journalctl  -f -u %s" % service_name
-
-
-	def spawn_tail_thread(self, debug_level):
-		logging.info("spawn_tail_thread")
-		loop = asyncio.get_event_loop()
-		UiLogMessageHandler.logging_thread = UiTailThread(self.websocket, loop, self.get_process_command(debug_level))
-		UiLogMessageHandler.logging_thread.start()
-
-
-	def toggle_service(self, running_service, next_service):
-		check_output("(systemctl stop %s)&" % running_service, shell=True)
-
-		is_active = True
-		max_trials = 20
-		while is_active and max_trials > 0:
-			logging.info("getting status of %s" % running_service)
+	def __init__(self, handler_name, websocket):
+		super().__init__(handler_name, websocket)
+		self.topic = None
+		# Position of the last entry sent
+		self.position = None
+		# Resuming on a just started producer => check the first entries read
+		self.check_gap = False
+		self.log_filter = None
+		self.closed = False
+
+
+	@staticmethod
+	def get_service(debug_logging):
+		return 'zynthian_debug' if debug_logging else 'zynthian'
+
+
+	def get_ring(self):
+		return broker.get_producer(self.topic).ring
+
+
+	def follow_journal(self, service, cursor=None):
+		topic = "journal/" + service
+		if topic != self.topic:
+			if self.topic:
+				self.unsubscribe(self.topic)
+			self.topic = None
+			if not self.subscribe(topic):
+				return
+			self.topic = topic
+		elif cursor is None:
+			return
+		self.send_backfill(cursor)
+
+
+	def send_backfill(self, cursor=None):
+		ring = self.get_ring()
+		self.position = get_cursor_position(cursor) if cursor else None
+		self.check_gap = False
+		if self.position is not None:
+			if len(ring) == 0:
+				# The producer has just started, its journal backfill is coming
+				self.check_gap = True
+				return
+			entries, complete = ring.get_after(self.position)
+			if complete:
+				if entries:
+					self.send_entries(entries)
+				return
+		# A new viewer, or one that missed too much => the client clears the log
+		self.send_entries(ring.get_last(self.backfill_size, self.log_filter), True)
+
+
+	# Journal entries are sent as {c: last cursor, l: lines, r: reset}
+	def send_entries(self, entries, reset=False):
+		if self.log_filter:
+			lines = [e.text for e in entries if self.log_filter.match(e)]
+		else:
+			lines = [e.text for e in entries]
+		if not lines and not reset:
+			return
+		data = {'l': lines}
+		if entries:
+			self.position = entries[-1].position
+			data['c'] = entries[-1].cursor
+		if reset:
+			data['r'] = 1
+		self.send(data)
+
+
+	def send_reply(self, data):
+		# Replies are never dropped, unlike log lines
+		self.websocket.send_message(self.handler_name, data, SEND_FIFO)
+
+
+	def on_publish(self, topic, entries):
+		if topic != self.topic:
+			return
+		if self.check_gap:
+			self.check_gap = False
+			# The backfill starts after the client's last entry => some may be lost
+			if entries[0].position > self.position:
+				self.send_entries(self.get_ring().get_last(self.backfill_size, self.log_filter), True)
+				return
+		# Skip entries already sent, if resuming
+		if self.position is not None and entries[0].position <= self.position:
+			entries = [e for e in entries if e.position > self.position]
+			if not entries:
+				return
+		self.send_entries(entries)
+
+
+	def do_set_filter(self, params):
+		"""FILTER {level, modules, regex} => the log is sent again, filtered"""
+		try:
+			log_filter = LogFilter.from_dict(json.loads(params))
+		except (ValueError, AttributeError) as e:
+			self.send_reply({'e': str(e)})
+			return
+		self.log_filter = None if log_filter.is_empty() else log_filter
+		if self.topic:
+			self.send_backfill()
+
+
+	def do_search(self, params):
+		"""SEARCH {q, level, modules, regex, context, limit} => {q, s: [{l: lines, m: match indexes}]}"""
+		try:
+			params = json.loads(params)
+			log_filter = LogFilter.from_dict(params)
+			context = max(0, min(int(params.get('context', 2)), self.max_search_context))
+			limit = max(1, min(int(params.get('limit', 100)), self.max_search_results))
+		except (ValueError, TypeError, AttributeError) as e:
+			self.send_reply({'e': str(e)})
+			return
+		query = params.get('q', "")
+		result = []
+		if self.topic:
+			for entries, matches in self.get_ring().search(query, log_filter, context, limit):
+				start = entries[0].seq
+				result.append({
+					'l': [e.text for e in entries],
+					'm': [seq - start for seq in matches]
+				})
+		self.send_reply({'q': query, 's': result})
+
+
+	def switch_service(self, running_service, next_service, message):
+		"""Switch the UI service in background, reporting progress to the client."""
+		async def switch_service_task():
+			self.send_reply(message)
 			try:
-				check_output("systemctl status %s" % running_service, shell=True)
-			except subprocess.CalledProcessError as e:
-				for byte_line in e.output.splitlines():
-					line = byte_line.decode("utf-8")
-					logging.info(line)
-					if "Active:" in line and ("inactive" in line or "inactive" in line):
-						is_active = False
-
-			time.sleep(1)
-			max_trials -= 1
-
-		check_output("(systemctl start %s)&" % next_service, shell=True)
+				await service_control.switch(running_service, next_service, self.send_reply)
+			except Exception as e:
+				logging.error("Can't switch from {} to {} => {}".format(running_service, next_service, e))
+				self.send_reply(str(e))
+			if not self.closed:
+				self.follow_journal(next_service)
+		command_runner.spawn_task(switch_service_task())
 
 
 	def do_start_debug_logging(self):
 		logging.info("start debug logging")
-		message = ZynthianWebSocketMessage('UiLogMessageHandler', 'Restarting UI in debug mode')
-		self.websocket.write_message(jsonpickle.encode(message))
-		if UiLogMessageHandler.logging_thread:
-			UiLogMessageHandler.logging_thread.stop()
-
-		self.toggle_service("zynthian", "zynthian_debug")
-
-		self.spawn_tail_thread(True)
+		self.switch_service("zynthian", "zynthian_debug", 'Restarting UI in debug mode')
 
 
 	def do_stop_debug_logging(self):
 		logging.info("stop debug logging")
-		message = ZynthianWebSocketMessage('UiLogMessageHandler', 'Restarting UI in normal mode')
-		self.websocket.write_message(jsonpickle.encode(message))
-		if UiLogMessageHandler.logging_thread:
-			UiLogMessageHandler.logging_thread.stop()
-
-		self.toggle_service("zynthian_debug", "zynthian")
-
-		self.spawn_tail_thread(False)
+		self.switch_service("zynthian_debug", "zynthian", 'Restarting UI in normal mode')
 
 
 	def on_websocket_message(self, action):
@@ -169,14 +260,20 @@ class UiLogMessageHandler(ZynthianWebSocketMessageHandler):
 		elif action == 'HIDE_DEBUG_LOGGING':
 			self.do_stop_debug_logging()
 		elif action == 'SHOW_DEFAULT':
-			if UiLogMessageHandler.logging_thread:
-				UiLogMessageHandler.logging_thread.stop()
-			self.spawn_tail_thread(False)
+			self.follow_journal(self.get_service(False))
+		elif action.startswith('FILTER '):
+			self.do_set_filter(action[7:])
+		elif action.startswith('SEARCH '):
+			self.do_search(action[7:])
+		elif action.startswith('RESUME '):
+			# RESUME <service> [cursor]
+			parts = action.split(" ", 2)
+			if parts[1] in self.services:
+				self.follow_journal(parts[1], parts[2] if len(parts) > 2 else None)
+			else:
+				logging.error("Can't follow service '{}'".format(parts[1]))
 		logging.debug("message handled.")  # this needs to show up early to get the socket working again.
 
 
 	def on_close(self):
-		logging.debug("stopping tail threads")
-		if UiLogMessageHandler.logging_thread:
-			UiLogMessageHandler.logging_thread.stop()
-
+		self.closed = True
@@ -29,9 +29,9 @@ import tornado.web
 import tornado.websocket
 import shutil
 import datetime
-import jsonpickle
 
-from lib.zynthian_websocket_handler import ZynthianWebSocketMessageHandler, ZynthianWebSocketMessage
+from lib.zynthian_websocket_handler import ZynthianWebSocketMessageHandler, SEND_LATEST
+from lib.websocket_broker import broker
 
 #from lib.post_streamer import PostDataStreamer
 from tornadostreamform.multipart_streamer import MultiPartStreamer, StreamedPart, TemporaryFileStreamedPart
@@ -60,8 +60,8 @@ class UploadPostDataStreamer(MultiPartStreamer):
 
 	percent = 0
 
-	def __init__(self, webSocketHandler, destinationPath, total):
-		self.webSocketHandler = webSocketHandler
+	def __init__(self, topic, destinationPath, total):
+		self.topic = topic
 		self.destinationPath = destinationPath
 		super(UploadPostDataStreamer, self).__init__(total)
 
@@ -77,9 +77,7 @@ class UploadPostDataStreamer(MultiPartStreamer):
 			if new_percent != self.percent:
 				self.percent = new_percent
 				#logging.info("upload progress: " + str(datetime.datetime.now()) + " " + str(new_percent) + ", received: " + str(received) + ", total: " + str(total))
-				if self.webSocketHandler:
-					message = ZynthianWebSocketMessage('UploadProgressHandler', str(new_percent))
-					self.webSocketHandler.websocket.write_message(jsonpickle.encode(message))
+				broker.publish(self.topic, str(new_percent))
 
 
 	def examine(self):
@@ -111,24 +109,25 @@ class UploadPostDataStreamer(MultiPartStreamer):
 				logging.info("destinationPath: " + self.destinationPath)
 				part.move(self.destinationPath + "/" + destinationFilename)
 
+def get_upload_topic(client_id):
+	return "upload/{}".format(client_id)
+
+
 class UploadProgressHandler(ZynthianWebSocketMessageHandler):
 	clientId = '1'
+	send_policy = SEND_LATEST
 
 	@classmethod
 	def is_registered_for(cls, handler_name):
 		return handler_name == 'UploadProgressHandler'
 
 	def on_websocket_message(self, message):
+		self.unsubscribe(get_upload_topic(self.clientId))
 		if message:
 			self.clientId = message
-		self.websocket.application.settings['upload_progress_handler'][self.clientId] = self
+		self.subscribe(get_upload_topic(self.clientId))
 		#logging.info("progress handler set for %s" % self.clientId)
 
-	# client disconnected
-	def on_close(self):
-		if self.clientId in self.websocket.application.settings['upload_progress_handler']:
-			del self.websocket.application.settings['upload_progress_handler'][self.clientId]
-
 @tornado.web.stream_request_body
 class UploadHandler(tornado.web.RequestHandler):
 
@@ -181,10 +180,7 @@ class UploadHandler(tornado.web.RequestHandler):
 			total = 0
 			client_id = '1'
 
-		upload_progress_handler = None
-		if client_id in self.application.settings['upload_progress_handler']:
-			upload_progress_handler = self.application.settings['upload_progress_handler'][client_id]
-		self.ps = UploadPostDataStreamer(upload_progress_handler,  destinationPath, total ) #,tmpdir="/tmp"
+		self.ps = UploadPostDataStreamer(get_upload_topic(client_id),  destinationPath, total ) #,tmpdir="/tmp"
 
 	def data_received(self, chunk):
 		self.ps.data_received(chunk)
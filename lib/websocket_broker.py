@@ -0,0 +1,194 @@
+# -*- coding: utf-8 -*-
+#********************************************************************
+# ZYNTHIAN PROJECT: Zynthian Web Configurator
+#
+# Websocket Topic Broker
+#
+# Copyright (C) 2018 Fernando Moyano <jofemodo@zynthian.org>
+#
+#********************************************************************
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License as
+# published by the Free Software Foundation; either version 2 of
+# the License, or any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# For a full copy of the GNU General Public License see the LICENSE.txt file.
+#
+#********************************************************************
+
+import logging
+import threading
+import tornado.ioloop
+
+from lib.request_metrics import request_metrics, add_header, get_labels
+
+#------------------------------------------------------------------------------
+# Topic Producer: runs once per topic, while the topic has subscribers.
+#------------------------------------------------------------------------------
+
+class TopicProducer(object):
+	# Seconds it keeps running after the last subscriber leaves, so
+	# reconnecting subscribers find it (and its state) still there
+	linger = 0
+
+	def __init__(self, topic):
+		self.topic = topic
+		# Topic name without the producer prefix, i.e. "journal/zynthian" => "zynthian"
+		self.name = topic.split("/", 1)[1] if "/" in topic else ""
+
+
+	# Can be called from any thread
+	def publish(self, data):
+		broker.publish(self.topic, data)
+
+
+	def start(self):
+		raise NotImplementedError("Please Implement start")
+
+
+	def stop(self):
+		pass
+
+#------------------------------------------------------------------------------
+# Topic Broker
+#
+# Message handlers subscribe to named topics and get published data through
+# on_publish(topic, data), always from the IOLoop. The first subscriber to a
+# topic starts its producer, if any is registered for the topic prefix, and
+# the last one to leave stops it, so N viewers share one producer. Producers
+# with a linger time are stopped that many seconds later, unless somebody
+# subscribes again meanwhile.
+# Topics without producer (i.e. "mixer") are fed by publish() calls.
+#------------------------------------------------------------------------------
+
+class ZynthianTopicBroker(object):
+
+	def __init__(self):
+		# topic => {subscriber: None}, ordered
+		self.subscribers = {}
+		# topic => running producer
+		self.producers = {}
+		# topic prefix => producer class
+		self.producer_classes = {}
+		# topic => timeout handle, for lingering producers
+		self.stop_handles = {}
+		self.io_loop = None
+		self.io_loop_thread = None
+
+
+	def register_producer(self, prefix, producer_class):
+		self.producer_classes[prefix] = producer_class
+
+
+	def get_producer_class(self, topic):
+		return self.producer_classes.get(topic.split("/", 1)[0])
+
+
+	# Subscribe & unsubscribe must be called from the IOLoop
+	def subscribe(self, topic, subscriber):
+		if self.io_loop is None:
+			self.io_loop = tornado.ioloop.IOLoop.current()
+			self.io_loop_thread = threading.get_ident()
+
+		subscribers = self.subscribers.setdefault(topic, {})
+		if subscriber in subscribers:
+			return True
+		subscribers[subscriber] = None
+		handle = self.stop_handles.pop(topic, None)
+		if handle:
+			self.io_loop.remove_timeout(handle)
+		if len(subscribers) > 1 or topic in self.producers:
+			return True
+
+		producer_class = self.get_producer_class(topic)
+		if producer_class:
+			logging.info("Starting producer for topic '{}'".format(topic))
+			try:
+				producer = producer_class(topic)
+				producer.start()
+				self.producers[topic] = producer
+			except Exception as e:
+				logging.error("Can't start producer for topic '{}' => {}".format(topic, e))
+				self.unsubscribe(topic, subscriber)
+				return False
+		return True
+
+
+	def unsubscribe(self, topic, subscriber):
+		subscribers = self.subscribers.get(topic)
+		if not subscribers or subscriber not in subscribers:
+			return
+		del subscribers[subscriber]
+		if subscribers:
+			return
+		del self.subscribers[topic]
+		producer = self.producers.get(topic)
+		if producer and producer.linger > 0:
+			self.stop_handles[topic] = self.io_loop.call_later(producer.linger, self.stop_producer, topic)
+		else:
+			self.stop_producer(topic)
+
+
+	def stop_producer(self, topic):
+		self.stop_handles.pop(topic, None)
+		if topic in self.subscribers:
+			return
+		producer = self.producers.pop(topic, None)
+		if producer:
+			logging.info("Stopping producer for topic '{}'".format(topic))
+			try:
+				producer.stop()
+			except Exception as e:
+				logging.error("Can't stop producer for topic '{}' => {}".format(topic, e))
+
+
+	def unsubscribe_all(self, subscriber):
+		for topic in [t for t, subscribers in self.subscribers.items() if subscriber in subscribers]:
+			self.unsubscribe(topic, subscriber)
+
+
+	def get_producer(self, topic):
+		return self.producers.get(topic)
+
+
+	def get_subscriber_count(self, topic):
+		return len(self.subscribers.get(topic, ()))
+
+
+	# Can be called from any thread
+	def publish(self, topic, data):
+		# Nobody listening => don't bother the IOLoop
+		if topic not in self.subscribers:
+			return
+		if threading.get_ident() == self.io_loop_thread:
+			self.dispatch(topic, data)
+		else:
+			self.io_loop.add_callback(self.dispatch, topic, data)
+
+
+	def dispatch(self, topic, data):
+		for subscriber in list(self.subscribers.get(topic, ())):
+			try:
+				subscriber.on_publish(topic, data)
+			except Exception as e:
+				logging.error("Can't publish '{}' to {} => {}".format(topic, subscriber, e))
+
+
+	def get_metrics_lines(self):
+		lines = []
+		add_header(lines, "zynthian_webconf_ws_topic_subscribers", "gauge", "Websocket subscribers by topic")
+		for topic, subscribers in sorted(self.subscribers.items()):
+			lines.append("zynthian_webconf_ws_topic_subscribers{} {}".format(get_labels(topic=topic), len(subscribers)))
+		return lines
+
+
+broker = ZynthianTopicBroker()
+request_metrics.add_collector(broker.get_metrics_lines)
+
+#------------------------------------------------------------------------------
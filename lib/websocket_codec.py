@@ -0,0 +1,112 @@
+# -*- coding: utf-8 -*-
+#********************************************************************
+# ZYNTHIAN PROJECT: Zynthian Web Configurator
+#
+# Websocket Wire Formats
+#
+# Copyright (C) 2018 Fernando Moyano <jofemodo@zynthian.org>
+#
+#********************************************************************
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License as
+# published by the Free Software Foundation; either version 2 of
+# the License, or any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# For a full copy of the GNU General Public License see the LICENSE.txt file.
+#
+#********************************************************************
+
+import json
+import jsonpickle
+
+try:
+	import msgpack
+except ImportError:
+	msgpack = None
+
+#------------------------------------------------------------------------------
+# Wire formats, selected by websocket subprotocol at connect time:
+#  + zynthian.msgpack => binary frames, msgpack map {h: handler name, d: data}
+#  + zynthian.json    => text frames, JSON object {h: handler name, d: data}
+#  + no subprotocol   => legacy jsonpickle'd ZynthianWebSocketMessage
+#
+# Incoming messages are accepted both as {h, d} and {handler_name, data}.
+#------------------------------------------------------------------------------
+
+def encode_default(obj):
+	# mido messages & similar objects
+	if callable(getattr(obj, 'dict', None)):
+		return obj.dict()
+	if hasattr(obj, '__dict__'):
+		return vars(obj)
+	raise TypeError("Can't encode object of type {}".format(type(obj).__name__))
+
+
+def get_envelope(message):
+	try:
+		return message['h'], message['d']
+	except KeyError:
+		return message['handler_name'], message['data']
+
+
+class LegacyCodec():
+	subprotocol = None
+	binary = False
+
+	@staticmethod
+	def encode(handler_name, data):
+		# Import here to avoid a circular import
+		from lib.zynthian_websocket_handler import ZynthianWebSocketMessage
+		return jsonpickle.encode(ZynthianWebSocketMessage(handler_name, data))
+
+	@staticmethod
+	def decode(message):
+		return get_envelope(jsonpickle.decode(message))
+
+
+class JsonCodec():
+	subprotocol = "zynthian.json"
+	binary = False
+	encoder = json.JSONEncoder(separators=(',', ':'), default=encode_default)
+
+	@classmethod
+	def encode(cls, handler_name, data):
+		return cls.encoder.encode({'h': handler_name, 'd': data})
+
+	@staticmethod
+	def decode(message):
+		return get_envelope(json.loads(message))
+
+
+class MsgpackCodec():
+	subprotocol = "zynthian.msgpack"
+	binary = True
+
+	@staticmethod
+	def encode(handler_name, data):
+		return msgpack.packb({'h': handler_name, 'd': data}, default=encode_default, use_bin_type=True)
+
+	@staticmethod
+	def decode(message):
+		if isinstance(message, str):
+			return get_envelope(json.loads(message))
+		return get_envelope(msgpack.unpackb(message, raw=False))
+
+
+# Ordered by preference
+CODECS = [JsonCodec]
+if msgpack:
+	CODECS.insert(0, MsgpackCodec)
+
+
+def select_codec(subprotocols):
+	for codec in CODECS:
+		if codec.subprotocol in subprotocols:
+			return codec
+	return LegacyCodec
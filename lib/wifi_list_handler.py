@@ -27,34 +27,31 @@ import re
 import sys
 import logging
 import tornado.web
-from subprocess import check_output
 from collections import OrderedDict
 
 sys.path.append(os.environ.get('ZYNTHIAN_UI_DIR'))
 import zynconf
 
+from lib.command_runner import command_runner
+
 #------------------------------------------------------------------------------
 # Wifi List Handler
 #------------------------------------------------------------------------------
 class WifiListHandler(tornado.web.RequestHandler):
 
+	SCAN_TIMEOUT = 30
 
 	def get_current_user(self):
 		return self.get_secure_cookie("user")
 
 
 	@tornado.web.authenticated
-	def get(self):
+	async def get(self):
 		wifiList = OrderedDict()
 		zynconf.wifi_up()
 		try:
-			for interface_byte in check_output("ifconfig -a | sed 's/[ \t].*//;/^$/d'", shell=True).splitlines():
-				interface = interface_byte.decode("utf-8")
-
+			for interface in sorted(os.listdir("/sys/class/net")):
 				if interface.startswith("wlan"):
-					if interface[-1:]==":":
-						interface=interface[:-1]
-
 					logging.info("Scanning wifi networks on {}...".format(interface))
 
 					network = None
@@ -63,8 +60,8 @@ class WifiListHandler(tornado.web.RequestHandler):
 					quality = 0
 					signal_level = 0	
 
-					for line_byte in check_output("iwlist {0} scan | grep -e ESSID -e Encryption -e Quality".format(interface), shell=True).splitlines():
-						line = line_byte.decode("utf-8")
+					scan = await command_runner.run_text(["iwlist", interface, "scan"], timeout=self.SCAN_TIMEOUT)
+					for line in scan.splitlines():
 						if line.find('ESSID')>=0:
 							network = {'encryption':False, 'quality':0, 'signalLevel':0}
 							ssid = line.split(':')[1].replace("\"","")
@@ -26,11 +26,11 @@ import os
 import tornado.web
 import logging
 from collections import OrderedDict
-from subprocess import check_output
 from enum import Enum
 
 from zynconf import CustomSwitchActionType, CustomUiAction
 from lib.zynthian_config_handler import ZynthianConfigHandler
+from lib.command_runner import command_runner
 
 #------------------------------------------------------------------------------
 # Wiring Configuration
@@ -409,19 +409,23 @@ class WiringConfigHandler(ZynthianConfigHandler):
 
 
 	@tornado.web.authenticated
-	def post(self):
+	async def post(self):
 		errors=self.update_config(tornado.escape.recursive_unicode(self.request.arguments))
-		self.rebuild_zyncoder()
+		await self.rebuild_zyncoder()
 
 		self.restart_ui_flag = True
 		self.get(errors)
 
 
+	REBUILD_TIMEOUT = 600
+
 	@classmethod
-	def rebuild_zyncoder(cls):
+	async def rebuild_zyncoder(cls):
 		try:
-			cmd="cd %s/zyncoder/build;cmake ..;make" % os.environ.get('ZYNTHIAN_DIR')
-			check_output(cmd, shell=True)
+			build_dir = "%s/zyncoder/build" % os.environ.get('ZYNTHIAN_DIR')
+			# As "cmake ..;make" => make runs even if cmake fails
+			await command_runner.run(["cmake", ".."], cwd=build_dir, timeout=cls.REBUILD_TIMEOUT, check=False)
+			await command_runner.run(["make"], cwd=build_dir, timeout=cls.REBUILD_TIMEOUT)
 		except Exception as e:
 			logging.error("Rebuilding Zyncoder Library: %s" % e)
 
@@ -0,0 +1,96 @@
+# -*- coding: utf-8 -*-
+#********************************************************************
+# ZYNTHIAN PROJECT: Zynthian Web Configurator
+#
+# Worker Pools
+#
+# Copyright (C) 2018 Fernando Moyano <jofemodo@zynthian.org>
+#
+#********************************************************************
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License as
+# published by the Free Software Foundation; either version 2 of
+# the License, or any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# For a full copy of the GNU General Public License see the LICENSE.txt file.
+#
+#********************************************************************
+
+import os
+import logging
+import functools
+import tornado.ioloop
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+
+#------------------------------------------------------------------------------
+# Worker Pools
+#
+# Blocking work (directory walks, file parsing, zipping ...) is moved out of
+# the IOLoop:
+#  + run_in_thread: bounded thread pool, for I/O bound work or anything that
+#    needs the webconf state (library index, engine APIs ...).
+#  + run_cpu_bound: process pool, for pure parsing functions that would hold
+#    the GIL for long. Functions & arguments must be picklable, so use module
+#    level functions. The pool is only created when enabled with
+#    ZYNTHIAN_WEBCONF_WORKER_PROCS > 0, otherwise the thread pool is used.
+#------------------------------------------------------------------------------
+
+class WorkerPools():
+
+	def __init__(self, max_threads=None, max_procs=None):
+		if max_threads is None:
+			max_threads = int(os.environ.get('ZYNTHIAN_WEBCONF_WORKER_THREADS', 2))
+		if max_procs is None:
+			max_procs = int(os.environ.get('ZYNTHIAN_WEBCONF_WORKER_PROCS', 0))
+		self.max_threads = max(1, max_threads)
+		self.max_procs = max_procs
+		self.thread_pool = None
+		self.process_pool = None
+
+
+	def get_thread_pool(self):
+		if self.thread_pool is None:
+			self.thread_pool = ThreadPoolExecutor(max_workers=self.max_threads, thread_name_prefix="webconf-worker")
+		return self.thread_pool
+
+
+	def get_process_pool(self):
+		if self.process_pool is None and self.max_procs > 0:
+			logging.info("Starting process pool with {} workers".format(self.max_procs))
+			self.process_pool = ProcessPoolExecutor(max_workers=self.max_procs)
+		return self.process_pool
+
+
+	def run_in_thread(self, func, *args, **kwargs):
+		if kwargs:
+			func = functools.partial(func, **kwargs)
+		return tornado.ioloop.IOLoop.current().run_in_executor(self.get_thread_pool(), func, *args)
+
+
+	def run_cpu_bound(self, func, *args, **kwargs):
+		pool = self.get_process_pool()
+		if pool is None:
+			return self.run_in_thread(func, *args, **kwargs)
+		if kwargs:
+			func = functools.partial(func, **kwargs)
+		return tornado.ioloop.IOLoop.current().run_in_executor(pool, func, *args)
+
+
+	def shutdown(self):
+		if self.thread_pool:
+			self.thread_pool.shutdown(wait=False)
+			self.thread_pool = None
+		if self.process_pool:
+			self.process_pool.shutdown(wait=False)
+			self.process_pool = None
+
+
+workers = WorkerPools()
+
+#------------------------------------------------------------------------------
@@ -28,11 +28,14 @@ import sys
 import liblo
 import logging
 import tornado.web
-from subprocess import check_output
 
 sys.path.append(os.environ.get('ZYNTHIAN_UI_DIR'))
 import zynconf
 
+from lib.config_cache import config_cache
+from lib.command_runner import command_runner, is_service_active
+from lib.service_control import service_control
+
 #------------------------------------------------------------------------------
 # Zynthian-UI OSC Address
 #------------------------------------------------------------------------------
@@ -49,14 +52,16 @@ class ZynthianBasicHandler(tornado.web.RequestHandler):
 	restart_ui_flag = False
 	reload_midi_config_flag = False
 	reload_key_binding_flag = False
+	# MOD-UI is rarely switched on/off, so its state is cached for a while
+	MODUI_CHECK_TTL = 30
 
 	def get_current_user(self):
 		return self.get_secure_cookie("user")
 
 
-	def prepare(self):
-		zynconf.load_config()
-		zynconf.load_midi_config()
+	async def prepare(self):
+		config_cache.load_config()
+		config_cache.load_midi_config()
 
 		self.read_reboot_flag()
 		self.genjson=False
@@ -65,6 +70,11 @@ class ZynthianBasicHandler(tornado.web.RequestHandler):
 				self.genjson=True
 		except:
 			pass
+		# Only needed for rendering pages, not for JSON & AJAX requests
+		if self.genjson or self.request.headers.get("X-Requested-With") == "XMLHttpRequest":
+			self.modui_active = False
+		else:
+			self.modui_active = await is_service_active("mod-ui", cache_ttl=self.MODUI_CHECK_TTL)
 
 
 	def render(self, tpl, **kwargs):
@@ -74,7 +84,7 @@ class ZynthianBasicHandler(tornado.web.RequestHandler):
 		}
 
 		# If MOD-UI is enabled, add access URI to info
-		if self.is_service_active("mod-ui"):
+		if self.modui_active:
 			info['modui_uri']="http://{}:8888".format(self.request.host)
 
 		super().render(tpl, info=info, **kwargs)
@@ -102,15 +112,17 @@ class ZynthianBasicHandler(tornado.web.RequestHandler):
 			self.render("config.html", body=body, config=config, title=title, errors=errors)
 
 
-	def is_service_active(self, service):
-		return zynconf.is_service_active(service)
+	async def is_service_active(self, service):
+		return await is_service_active(service)
 
 
 	def restart_ui(self):
-		try:
-			check_output("systemctl daemon-reload;systemctl restart zynthian", shell=True)
-		except Exception as e:
-			logging.error("Restarting UI: %s" % e)
+		async def restart_ui_task():
+			try:
+				await service_control.restart("zynthian", daemon_reload=True)
+			except Exception as e:
+				logging.error("Restarting UI: %s" % e)
+		command_runner.spawn_task(restart_ui_task())
 
 
 	def reload_midi_config(self):
@@ -122,11 +134,17 @@ class ZynthianBasicHandler(tornado.web.RequestHandler):
 
 
 	def persist_update_sys_flag(self):
-		check_output("touch /zynthian_update_sys", shell=True)
+		self.touch("/zynthian_update_sys")
 
 
 	def persist_reboot_flag(self):
-		check_output("touch /tmp/zynthian_reboot", shell=True)
+		self.touch("/tmp/zynthian_reboot")
+
+
+	@staticmethod
+	def touch(fpath):
+		with open(fpath, "a"):
+			os.utime(fpath, None)
 
 
 	def read_reboot_flag(self):
@@ -148,5 +166,5 @@ class ZynthianConfigHandler(ZynthianBasicHandler):
 		for vn in config:
 			sconfig[vn]=config[vn][0]
 
-		zynconf.save_config(sconfig, update_sys=True)
+		config_cache.save_config(sconfig, update_sys=True)
 
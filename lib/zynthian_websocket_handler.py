@@ -24,25 +24,92 @@
 
 
 import logging
+import threading
+import tornado.ioloop
 import tornado.websocket
-import jsonpickle
+from collections import deque
+
+from lib.request_metrics import request_metrics
+from lib.websocket_codec import select_codec, LegacyCodec
+from lib.websocket_broker import broker
+
+#------------------------------------------------------------------------------
+# Outbound message policies, applied when a connection can't keep up:
+#  + fifo        => never dropped
+#  + latest      => pending messages with the same key are replaced by the new one
+#  + merge       => same than latest, but dict messages (deltas) are merged into
+#                   the pending one, so no change is lost
+#  + drop_oldest => the oldest pending messages are dropped over the high-water mark
+#
+# A connection whose queue grows over the hard limit anyway (FIFO messages
+# to a stalled client) is closed, so it can't grow forever.
+#------------------------------------------------------------------------------
+
+SEND_FIFO = 'fifo'
+SEND_LATEST = 'latest'
+SEND_MERGE = 'merge'
+SEND_DROP_OLDEST = 'drop_oldest'
 
 #------------------------------------------------------------------------------
 # Zynthian Websocket Handling
 #------------------------------------------------------------------------------
 
-def ZynthianWebSocketMessageHandlerFactory(handler_name, websocket):
-	for cls in ZynthianWebSocketMessageHandler.__subclasses__():
+def get_message_handler_class(handler_name):
+	try:
+		return ZynthianWebSocketMessageHandler.registry[handler_name]
+	except KeyError:
+		pass
+	# Handlers registered for other names than their class name
+	for cls in ZynthianWebSocketMessageHandler.handler_classes:
 		if cls.is_registered_for(handler_name):
-			return cls(handler_name, websocket)
-	raise ValueError
+			ZynthianWebSocketMessageHandler.registry[handler_name] = cls
+			return cls
+	raise ValueError("No websocket message handler for '{}'".format(handler_name))
+
+
+def ZynthianWebSocketMessageHandlerFactory(handler_name, websocket):
+	return get_message_handler_class(handler_name)(handler_name, websocket)
 
 
 class ZynthianWebSocketMessageHandler(object):
+	# handler name => class, filled when subclasses are defined
+	registry = {}
+	handler_classes = []
+	send_policy = SEND_FIFO
+
+	def __init_subclass__(cls, **kwargs):
+		super().__init_subclass__(**kwargs)
+		ZynthianWebSocketMessageHandler.handler_classes.append(cls)
+		if cls.is_registered_for(cls.__name__):
+			ZynthianWebSocketMessageHandler.registry[cls.__name__] = cls
+
+	@classmethod
+	def is_registered_for(cls, handler_name):
+		return handler_name == cls.__name__
+
 	def __init__(self, handler_name, websocket):
 		self.handler_name = handler_name
 		self.websocket = websocket
 
+	# Can be called from any thread
+	def send(self, data):
+		self.websocket.send_message(self.handler_name, data, self.send_policy, self.get_send_key(data))
+
+	# Messages with the same key are coalesced by the "latest" policy
+	def get_send_key(self, data):
+		return self.handler_name
+
+	# Topics are released when the connection is closed
+	def subscribe(self, topic):
+		return broker.subscribe(topic, self)
+
+	def unsubscribe(self, topic):
+		broker.unsubscribe(topic, self)
+
+	# Data published to a subscribed topic
+	def on_publish(self, topic, data):
+		self.send(data)
+
 	def on_open(self):
 		pass
 
@@ -75,27 +142,201 @@ class ZynthianWebSocketMessage(object):
 		self._data = value
 
 
+#------------------------------------------------------------------------------
+# Websocket Session: one message handler instance per handler name and
+# connection, all of them released when the connection is closed.
+#------------------------------------------------------------------------------
+
+class ZynthianWebSocketSession(object):
+	def __init__(self, websocket):
+		self.websocket = websocket
+		self.handlers = {}
+
+	def get_handler(self, handler_name):
+		try:
+			return self.handlers[handler_name]
+		except KeyError:
+			handler = ZynthianWebSocketMessageHandlerFactory(handler_name, self.websocket)
+			self.handlers[handler_name] = handler
+			handler.on_open()
+			return handler
+
+	def close(self):
+		for handler in self.handlers.values():
+			try:
+				handler.on_close()
+			except Exception as e:
+				logging.error("Closing websocket message handler {} => {}".format(handler.handler_name, e))
+			broker.unsubscribe_all(handler)
+		self.handlers.clear()
+
+
+#------------------------------------------------------------------------------
+# Websocket Outbox: per-connection outbound queue, only used from the IOLoop.
+# Messages are encoded when written, so coalesced ones are never encoded.
+#------------------------------------------------------------------------------
+
+class ZynthianWebSocketOutbox(object):
+	HIGH_WATER = 256
+	MAX_QUEUE = 4096
+	MAX_INFLIGHT = 8
+
+	def __init__(self, websocket):
+		self.websocket = websocket
+		# entries => [handler_name, policy, key, data]. Dropped entries are
+		# left in the queue with policy None and skipped when flushing.
+		self.queue = deque()
+		# Queued entries, not counting the dropped ones
+		self.size = 0
+		# "drop_oldest" entries, in queue order, so dropping is O(1)
+		self.droppable = deque()
+		# coalescing key => queued entry
+		self.pending = {}
+		self.inflight = 0
+		self.flush_scheduled = False
+		self.closed = False
+
+	def put(self, handler_name, data, policy=SEND_FIFO, key=None):
+		if self.closed:
+			return
+		if policy == SEND_LATEST or policy == SEND_MERGE:
+			key = (handler_name, key)
+			entry = self.pending.get(key)
+			if entry:
+				if policy == SEND_MERGE and isinstance(entry[3], dict) and isinstance(data, dict):
+					entry[3].update(data)
+				else:
+					entry[3] = data
+				request_metrics.on_ws_coalesced(handler_name)
+				return
+			if policy == SEND_MERGE and isinstance(data, dict):
+				# Merged in place => the caller's dict is not modified
+				data = dict(data)
+			entry = [handler_name, policy, key, data]
+			self.pending[key] = entry
+		else:
+			entry = [handler_name, policy, None, data]
+			if policy == SEND_DROP_OLDEST:
+				self.droppable.append(entry)
+		self.queue.append(entry)
+		self.size += 1
+
+		if self.size > self.HIGH_WATER:
+			self.drop_oldest()
+			if self.size > self.MAX_QUEUE:
+				logging.warning("Websocket client is not reading, closing the connection")
+				self.close()
+				self.websocket.close()
+				return
+		self.schedule_flush()
+
+	def drop_oldest(self):
+		# FIFO entries are kept and "latest" entries are already bounded by their keys
+		if self.droppable:
+			entry = self.droppable.popleft()
+			entry[1] = None
+			self.size -= 1
+			request_metrics.on_ws_dropped(entry[0])
+			# Compacted once dropped entries are half of the queue
+			if len(self.queue) > 2 * self.HIGH_WATER and len(self.queue) > 2 * self.size:
+				self.queue = deque(e for e in self.queue if e[1] is not None)
+
+	def schedule_flush(self):
+		if not self.flush_scheduled and self.inflight < self.MAX_INFLIGHT:
+			self.flush_scheduled = True
+			tornado.ioloop.IOLoop.current().add_callback(self.flush)
+
+	def flush(self):
+		self.flush_scheduled = False
+		while self.queue and self.inflight < self.MAX_INFLIGHT and not self.closed:
+			handler_name, policy, key, data = self.queue.popleft()
+			if policy is None:
+				continue
+			self.size -= 1
+			if policy == SEND_DROP_OLDEST:
+				self.droppable.popleft()
+			if key is not None:
+				del self.pending[key]
+			try:
+				future = self.websocket.write_encoded(handler_name, data)
+			except tornado.websocket.WebSocketClosedError:
+				self.close()
+				return
+			except Exception as e:
+				logging.error("Can't send websocket message from {} => {}".format(handler_name, e))
+				continue
+			if future is not None:
+				self.inflight += 1
+				future.add_done_callback(self.on_written)
+
+	def on_written(self, future):
+		self.inflight -= 1
+		if future.cancelled() or future.exception():
+			self.close()
+		elif self.queue:
+			self.schedule_flush()
+
+	def close(self):
+		self.closed = True
+		self.queue.clear()
+		self.size = 0
+		self.droppable.clear()
+		self.pending.clear()
+
+
 class ZynthianWebSocketHandler(tornado.websocket.WebSocketHandler):
-	handlers = []
+	codec = LegacyCodec
 
 	def check_origin(self, origin):
 		return True
 
+	# the wire format is negotiated with the subprotocol
+	def select_subprotocol(self, subprotocols):
+		self.codec = select_codec(subprotocols)
+		return self.codec.subprotocol
+
 	# the client connected
 	def open(self):
 		logging.info("New client connected to ZynthianWebSocketHandler")
+		self.io_loop = tornado.ioloop.IOLoop.current()
+		self.io_loop_thread = threading.get_ident()
+		self.outbox = ZynthianWebSocketOutbox(self)
+		self.session = ZynthianWebSocketSession(self)
+		request_metrics.on_ws_open()
 
 	# the client sent the message
 	def on_message(self, message):
 		if message:
-			decoded_message = jsonpickle.decode(message)
-			logging.info("incoming ws message %s " % decoded_message)
-			handler = ZynthianWebSocketMessageHandlerFactory(decoded_message['handler_name'], self)
-			handler.on_websocket_message(decoded_message['data'])
-			self.handlers.append(handler)
+			# a malformed frame is dropped, the connection is kept
+			try:
+				handler_name, data = self.codec.decode(message)
+			except (ValueError, KeyError, TypeError) as e:
+				logging.error("Can't decode ws message => {}".format(e))
+				return
+			logging.info("incoming ws message {} => {}".format(handler_name, data))
+			try:
+				handler = self.session.get_handler(handler_name)
+			except ValueError as e:
+				logging.error(e)
+				return
+			request_metrics.on_ws_message_in(type(handler).__name__)
+			handler.on_websocket_message(data)
+
+	# Queue a message. It can be called from any thread.
+	def send_message(self, handler_name, data, policy=SEND_FIFO, key=None):
+		if threading.get_ident() == self.io_loop_thread:
+			self.outbox.put(handler_name, data, policy, key)
+		else:
+			self.io_loop.add_callback(self.outbox.put, handler_name, data, policy, key)
+
+	def write_encoded(self, handler_name, data):
+		message = self.codec.encode(handler_name, data)
+		request_metrics.on_ws_message_out(handler_name, len(message))
+		return self.write_message(message, self.codec.binary)
 
 	# client disconnected
 	def on_close(self):
 		logging.info("Client disconnected")
-		for handler in self.handlers:
-			handler.on_close()
+		request_metrics.on_ws_close()
+		self.outbox.close()
+		self.session.close()
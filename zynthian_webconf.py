@@ -27,6 +27,7 @@ import os
 import sys
 import string
 import random
+import signal
 import logging
 import tornado.web
 import tornado.ioloop
@@ -46,7 +47,7 @@ from lib.wifi_config_handler import WifiConfigHandler
 from lib.wifi_list_handler import WifiListHandler
 from lib.snapshot_config_handler import SnapshotConfigHandler, SnapshotRemoveOptionHandler, SnapshotAddOptionsHandler, \
 	SnapshotDownloadHandler, SnapshotRemoveLayerHandler
-from lib.midi_config_handler import MidiConfigHandler
+from lib.midi_config_handler import MidiConfigHandler, MidiFilterRulesHandler
 from lib.upload_handler import UploadHandler
 from lib.system_backup_handler import SystemBackupHandler
 from lib.software_update_handler import SoftwareUpdateHandler
@@ -56,9 +57,16 @@ from lib.pianoteq_handler import PianoteqHandler
 from lib.captures_config_handler import CapturesConfigHandler
 from lib.jalv_lv2_handler import JalvLv2Handler
 from lib.ui_log_handler import UiLogHandler
-from lib.midi_log_handler import MidiLogHandler
+from lib.midi_log_handler import MidiLogHandler, MidiStatsHandler
 from lib.repository_handler import RepositoryHandler
 from lib.audio_mixer_handler import AudioConfigMessageHandler, AudioMixerHandler
+from lib.metrics_history_handler import MetricsHistoryHandler
+from lib.metrics_handler import MetricsHandler
+from lib.request_metrics import request_metrics
+from lib.system_metrics import system_metrics
+from lib.library_index import library_index
+from lib.metrics_history import metrics_history
+from lib.hardware_probe import hardware_probe
 
 #------------------------------------------------------------------------------
 
@@ -112,7 +120,7 @@ def make_app():
 		"template_path": "templates",
 		"cookie_secret": get_cookie_secret(),
 		"login_url": "/login",
-		"upload_progress_handler": dict()
+		"log_function": request_metrics.log_request
 		#"autoescape": None
 	}
 
@@ -153,12 +161,16 @@ def make_app():
 		(r"/ui-keybind$", UiKeybindHandler),
 		(r"/ui-log$", UiLogHandler),
 		(r"/ui-midi-options$", MidiConfigHandler),
+		(r"/midi-filter-rules$", MidiFilterRulesHandler),
 		(r"/ui-midi-log$", MidiLogHandler),
+		(r"/midi-stats$", MidiStatsHandler),
 		(r"/sys-wifi$", WifiConfigHandler),
 		(r"/sys-backup$", SystemBackupHandler),
 		(r"/sys-security$", SecurityConfigHandler),
 		(r"/sys-reboot$", RebootHandler),
 		(r"/sys-poweroff$", PoweroffHandler),
+		(r"/sys-metrics-history$", MetricsHistoryHandler),
+		(r"/metrics$", MetricsHandler),
 		(r"/wifi/list$", WifiListHandler),
 		(r'/upload$', UploadHandler),
 		(r"/ws$", ZynthianWebSocketHandler)
@@ -168,6 +180,17 @@ def make_app():
 if __name__ == "__main__":
 	app = make_app()
 	app.listen(os.environ.get('ZYNTHIAN_WEBCONF_PORT', 80), max_body_size=MAX_STREAMED_SIZE)
+	system_metrics.start()
+	library_index.start()
+	metrics_history.start()
+	tornado.ioloop.IOLoop.current().spawn_callback(hardware_probe.get_info)
+
+	# Save state on "systemctl stop", reboot & poweroff
+	def shutdown():
+		metrics_history.stop()
+		tornado.ioloop.IOLoop.current().stop()
+	signal.signal(signal.SIGTERM, lambda signum, frame: tornado.ioloop.IOLoop.current().add_callback_from_signal(shutdown))
+
 	tornado.ioloop.IOLoop.current().start()
 
 #------------------------------------------------------------------------------